@@ -0,0 +1,210 @@
+# Copyright 2019 IBM Corporation 
+# 
+# Licensed under the Apache License, Version 2.0 (the "License"); 
+# you may not use this file except in compliance with the License. 
+# You may obtain a copy of the License at 
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0 
+# 
+# Unless required by applicable law or agreed to in writing, software 
+# distributed under the License is distributed on an "AS IS" BASIS, 
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. 
+# See the License for the specific language governing permissions and 
+# limitations under the License. 
+#
+# End-to-end benchmarks of the openaihub commands against the fake cluster.
+#
+#   python benchmarks/bench.py                       all scenarios, 3 runs each
+#   python benchmarks/bench.py install -r 5 --scale 0.2
+#   python benchmarks/bench.py --json new.json --baseline old.json
+#
+# Every run is a fresh openaihub process (the CLI as users run it) against a
+# freshly reset cluster. Reported per scenario: wall time, processes spawned
+# through run(), kubectl/oc/helm invocations and API requests by verb.
+from __future__ import print_function
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+import yaml
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+# pylint: disable=wrong-import-position
+from fakecluster import FakeCluster
+
+SOURCE = os.path.dirname(HERE)
+
+def write_bundle(path, name):
+    # an operator bundle as register expects it: a CSV with one deployment and a package yaml
+    workdir = tempfile.mkdtemp()
+    try:
+        bundle = os.path.join(workdir, name, "0.0.1")
+        os.makedirs(bundle)
+        with open(os.path.join(bundle, "%s.clusterserviceversion.yaml" % name), "w") as f:
+            yaml.safe_dump({"apiVersion": "operators.coreos.com/v1alpha1", "kind": "ClusterServiceVersion",
+                            "metadata": {"name": "%s.v0.0.1" % name},
+                            "spec": {"install": {"strategy": "deployment", "spec": {"deployments": [{"name": name}]}}}}, f)
+        with open(os.path.join(workdir, name, "%s.package.yaml" % name), "w") as f:
+            yaml.safe_dump({"packageName": name, "channels": [{"name": "alpha", "currentCSV": "%s.v0.0.1" % name}]}, f)
+        with tarfile.open(os.path.join(path, "%s.tgz" % name), "w:gz") as tf:
+            tf.add(os.path.join(workdir, name), arcname=name)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def prepare_install(cluster, workdir):
+    return ["install", "--namespace", "kubeflow"]
+
+def prepare_install_operator(cluster, workdir):
+    cluster.seed(cluster.package_manifest("example-operator", "example-catalog", "olm"))
+    return ["install-operator", "--operator", "example-operator", "--logpath", workdir]
+
+def prepare_install_operators(cluster, workdir):
+    names = ["operator-%02d" % x for x in range(10)]
+    for x in names:
+        cluster.seed(cluster.package_manifest(x, "example-catalog", "olm"))
+    return ["install-operator", "--operator", ",".join(names), "--logpath", workdir]
+
+def prepare_register(cluster, workdir):
+    bundles = os.path.join(workdir, "bundles")
+    os.makedirs(bundles, exist_ok=True)
+    for x in ["alpha-operator", "beta-operator", "gamma-operator"]:
+        write_bundle(bundles, x)
+    return ["register", "--path", bundles, "--catalog", "bench", "--build-cache", "off"]
+
+def prepare_register_configmap(cluster, workdir):
+    return prepare_register(cluster, workdir) + ["--catalog-mode", "configmap"]
+
+def prepare_check_installed(cluster, workdir):
+    for x in range(20):
+        cluster.seed({"apiVersion": "operators.coreos.com/v1alpha1", "kind": "ClusterServiceVersion",
+                      "metadata": {"name": "operator-%02d.v0.0.1" % x, "namespace": "operators"}, "status": {"phase": "Succeeded"}})
+    return ["check-installed", "--namespace", "operators"]
+
+def prepare_uninstall(cluster, workdir):
+    cluster.seed_install("kubeflow")
+    return ["uninstall", "--namespace", "kubeflow"]
+
+SCENARIOS = {
+    "install": prepare_install,
+    "install_operator": prepare_install_operator,
+    "install_operators": prepare_install_operators,
+    "register": prepare_register,
+    "register_configmap": prepare_register_configmap,
+    "check_installed": prepare_check_installed,
+    "uninstall": prepare_uninstall,
+}
+
+def run_once(cluster, scenario, args, use_kubectl, cold):
+    cluster.reset()
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    try:
+        argv = SCENARIOS[scenario](cluster, workdir)
+        trace_file = os.path.join(workdir, "trace.json")
+        if scenario != "check_installed":
+            argv += ["--trace", trace_file]
+            if use_kubectl:
+                argv.append("--use-kubectl")
+        env = dict(os.environ)
+        env["KUBECONFIG"] = cluster.write_kubeconfig()
+        env["PATH"] = cluster.write_stubs() + os.pathsep + env.get("PATH", "")
+        env["PYTHONPATH"] = SOURCE + os.pathsep + env.get("PYTHONPATH", "")
+        env["XDG_CACHE_HOME"] = os.path.join(workdir, "cache") if cold else args.cache
+        start = time.time()
+        ret = subprocess.run([sys.executable, "-c", "from openaihub.cli import cli; cli()"] + argv, env=env, cwd=workdir,
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        wall = time.time() - start
+        if ret.returncode != 0:
+            raise RuntimeError("%s failed with %s:\n%s" % (" ".join(argv), ret.returncode, ret.stdout.decode()[-4000:]))
+        spawns = 0
+        if os.path.exists(trace_file):
+            with open(trace_file) as f:
+                spawns = len([x for x in json.load(f)["traceEvents"] if x.get("cat") == "run"])
+        stats = dict(cluster.stats)
+        return {"wall": wall, "spawns": spawns,
+                "tools": sum(v for k, v in stats.items() if k.startswith("tool:")),
+                "api": dict((k, v) for k, v in stats.items() if not k.startswith("tool:"))}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def summarize(runs):
+    walls = [x["wall"] for x in runs]
+    last = runs[-1]
+    return {"wall": walls, "median": statistics.median(walls), "min": min(walls),
+            "spawns": last["spawns"], "tools": last["tools"], "api": last["api"],
+            "api_total": sum(last["api"].values())}
+
+def print_table(results):
+    print("%-18s %5s %9s %9s %7s %6s %5s  %s" % ("scenario", "runs", "median s", "min s", "spawns", "tools", "api", "api requests by verb"))
+    for name, x in results.items():
+        verbs = " ".join("%s=%s" % (k, v) for k, v in sorted(x["api"].items()))
+        print("%-18s %5s %9.2f %9.2f %7s %6s %5s  %s" % (name, len(x["wall"]), x["median"], x["min"], x["spawns"], x["tools"], x["api_total"], verbs))
+
+def compare(results, baseline, tolerance):
+    # a regression is a slower median beyond the tolerance or more processes or API requests
+    regressions = []
+    for name, x in results.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]
+        if x["median"] > base["median"] * (1 + tolerance):
+            regressions.append("%s: median %.2fs, was %.2fs" % (name, x["median"], base["median"]))
+        for key in ["spawns", "tools", "api_total"]:
+            if x[key] > base[key]:
+                regressions.append("%s: %s %s, was %s" % (name, key, x[key], base[key]))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark openaihub commands against a fake cluster")
+    parser.add_argument("scenarios", nargs="*", metavar="SCENARIO",
+                        help="%s [default: all]" % ", ".join(sorted(SCENARIOS)))
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="runs per scenario")
+    parser.add_argument("--scale", type=float, default=1.0, help="factor for every simulated latency")
+    parser.add_argument("--latency", action="append", default=[], metavar="NAME=SECONDS",
+                        help="override one simulated latency, e.g. rollout=3")
+    parser.add_argument("--use-kubectl", action="store_true", help="run the commands with --use-kubectl")
+    parser.add_argument("--cold", action="store_true", help="start every run with an empty openaihub cache")
+    parser.add_argument("--json", metavar="FILE", help="write the results to FILE")
+    parser.add_argument("--baseline", metavar="FILE", help="fail on regressions against the results in FILE")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative slowdown of the median")
+    args = parser.parse_args()
+    for x in args.scenarios:
+        if x not in SCENARIOS:
+            parser.error("unknown scenario %s" % x)
+
+    latencies = dict()
+    for x in args.latency:
+        name, _, value = x.partition("=")
+        latencies[name] = float(value)
+    cluster = FakeCluster(args.scale, latencies).start()
+    args.cache = tempfile.mkdtemp(prefix="bench-cache-")
+    results = dict()
+    try:
+        for scenario in args.scenarios or sorted(SCENARIOS):
+            runs = [run_once(cluster, scenario, args, args.use_kubectl, args.cold) for _ in range(args.repeat)]
+            results[scenario] = summarize(runs)
+    finally:
+        cluster.stop()
+        shutil.rmtree(args.cache, ignore_errors=True)
+        shutil.rmtree(cluster.tempdir, ignore_errors=True)
+
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for x in regressions:
+            print("REGRESSION %s" % x)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# Copyright 2019 IBM Corporation 
+# 
+# Licensed under the Apache License, Version 2.0 (the "License"); 
+# you may not use this file except in compliance with the License. 
+# You may obtain a copy of the License at 
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0 
+# 
+# Unless required by applicable law or agreed to in writing, software 
+# distributed under the License is distributed on an "AS IS" BASIS, 
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. 
+# See the License for the specific language governing permissions and 
+# limitations under the License. 
+#
+# Bundle member checks of register.
+#
+#   python benchmarks/bundlemembers.py       check, exit 1 when a bundle is read that should not be
+#   python benchmarks/bundlemembers.py -v    print every case
+#
+# Bundles are streamed into the build context without unpacking them, so
+# catalog.member_path is all that keeps a member from landing outside of its
+# bundle. Every case below is a tgz with one such member, next to a plain
+# bundle that must still be read.
+from __future__ import print_function
+import argparse
+import io
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SOURCE = os.path.dirname(HERE)
+sys.path.insert(0, SOURCE)
+
+# pylint: disable=wrong-import-position
+from openaihub.func import catalog
+
+PACKAGE = b"packageName: example\nchannels:\n- name: alpha\n  currentCSV: example.v0.0.1\n"
+
+def member(name, kind=tarfile.REGTYPE, data=b"", linkname=''):
+    info = tarfile.TarInfo(name)
+    info.type = kind
+    info.linkname = linkname
+    info.size = len(data) if kind == tarfile.REGTYPE else 0
+    return info, io.BytesIO(data) if kind == tarfile.REGTYPE else None
+
+# name, members; the bad member comes last, after a plain package file
+CASES = [
+    ("parent", [member("..", tarfile.DIRTYPE)]),
+    ("absolute", [member("/etc/example.package.yaml", data=PACKAGE)]),
+    ("parent in path", [member("example/../../example.package.yaml", data=PACKAGE)]),
+    ("parent after normpath", [member("example/./../../x", data=PACKAGE)]),
+    ("symlink", [member("example/link", tarfile.SYMTYPE, linkname="/etc/passwd")]),
+    ("symlink to parent", [member("example/up", tarfile.SYMTYPE, linkname="../..")]),
+    ("hardlink", [member("example/hard", tarfile.LNKTYPE, linkname="/etc/passwd")]),
+    ("fifo", [member("example/fifo", tarfile.FIFOTYPE)]),
+    ("character device", [member("example/null", tarfile.CHRTYPE)]),
+]
+
+def write(path, members):
+    with tarfile.open(path, "w:gz") as tf:
+        for info, f in [member("example", tarfile.DIRTYPE), member("example/example.package.yaml", data=PACKAGE)] + members:
+            tf.addfile(info, f)
+
+def read(path):
+    # None when the bundle is read, the error otherwise
+    try:
+        catalog.read_bundle(path)
+    except ValueError as e:
+        return str(e)
+    return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that register rejects bundle members outside of the bundle")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print every case")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    failures = []
+    try:
+        path = os.path.join(workdir, "plain.tgz")
+        write(path, [])
+        error = read(path)
+        if error is not None:
+            failures.append("plain bundle rejected: %s" % error)
+        elif args.verbose:
+            print("%-24s read" % "plain")
+        for name, members in CASES:
+            path = os.path.join(workdir, "%s.tgz" % name.replace(" ", "-"))
+            write(path, members)
+            error = read(path)
+            if error is None:
+                failures.append("%s: the bundle was read" % name)
+            elif args.verbose:
+                print("%-24s rejected, %s" % (name, error[len(path) + len("the file  "):]))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print("%s of %s bundle member checks passed" % (len(CASES) + 1 - len(failures), len(CASES) + 1))
+    for x in failures:
+        print("FAILED %s" % x)
+    if failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,913 @@
+# Copyright 2019 IBM Corporation 
+# 
+# Licensed under the Apache License, Version 2.0 (the "License"); 
+# you may not use this file except in compliance with the License. 
+# You may obtain a copy of the License at 
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0 
+# 
+# Unless required by applicable law or agreed to in writing, software 
+# distributed under the License is distributed on an "AS IS" BASIS, 
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. 
+# See the License for the specific language governing permissions and 
+# limitations under the License. 
+#
+# An in-memory stand-in for the parts of a cluster the installer talks to: a local
+# API server (discovery, CRUD, server-side apply, watch and pod exec over websocket)
+# with a few controllers that play OLM, the deployments and kaniko with configurable
+# latencies, plus kubectl/oc/helm stubs that forward to the same server.
+from __future__ import print_function
+import base64
+import copy
+import hashlib
+import io
+import json
+import os
+import stat
+import struct
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import yaml
+
+# seconds, multiplied by the scale of the cluster
+LATENCIES = {
+    "api": 0.002,           # every API request
+    "tool": 0.05,           # start-up of a kubectl/oc/helm process, on top of the python stub itself
+    "rollout": 1.0,         # a deployment becomes available
+    "operator": 0.5,        # a subscription is resolved into its operator deployment
+    "packagemanifest": 1.0, # a catalog source serves its packages
+    "pod_start": 0.5,       # a pod is scheduled and its first container runs
+    "kaniko": 2.0,          # kaniko builds and pushes the catalog image
+    "storageclass": 0.5,    # the jupyterlab deployment provides the nfs-dynamic storageclass
+    "finalizer": 1.0,       # the finalizers of a deleted CR, PVC or namespace are done
+    "image_pull": 0.3,      # a node pulls one image, the kubelet pulls one after the other
+}
+
+# the nodes of the cluster
+NODES = ["node-1", "node-2", "node-3"]
+
+# (apiVersion, kind, plural, namespaced)
+RESOURCES = [
+    ("v1", "Namespace", "namespaces", False),
+    ("v1", "Node", "nodes", False),
+    ("v1", "ConfigMap", "configmaps", True),
+    ("v1", "Pod", "pods", True),
+    ("v1", "Service", "services", True),
+    ("v1", "ServiceAccount", "serviceaccounts", True),
+    ("v1", "Secret", "secrets", True),
+    ("v1", "PersistentVolumeClaim", "persistentvolumeclaims", True),
+    ("apps/v1", "Deployment", "deployments", True),
+    ("apps/v1", "DaemonSet", "daemonsets", True),
+    ("rbac.authorization.k8s.io/v1", "ClusterRole", "clusterroles", False),
+    ("rbac.authorization.k8s.io/v1", "ClusterRoleBinding", "clusterrolebindings", False),
+    ("rbac.authorization.k8s.io/v1", "Role", "roles", True),
+    ("rbac.authorization.k8s.io/v1", "RoleBinding", "rolebindings", True),
+    ("rbac.authorization.k8s.io/v1beta1", "ClusterRoleBinding", "clusterrolebindings", False),
+    ("storage.k8s.io/v1", "StorageClass", "storageclasses", False),
+    ("apiextensions.k8s.io/v1beta1", "CustomResourceDefinition", "customresourcedefinitions", False),
+    ("operators.coreos.com/v1alpha1", "Subscription", "subscriptions", True),
+    ("operators.coreos.com/v1alpha1", "CatalogSource", "catalogsources", True),
+    ("operators.coreos.com/v1alpha1", "ClusterServiceVersion", "clusterserviceversions", True),
+    ("operators.coreos.com/v1alpha1", "InstallPlan", "installplans", True),
+    ("operators.coreos.com/v1", "OperatorGroup", "operatorgroups", True),
+    ("packages.operators.coreos.com/v1", "PackageManifest", "packagemanifests", True),
+    ("openaihub.ibm.com/v1alpha1", "Jupyterlab", "jupyterlabs", True),
+    ("openaihub.ibm.com/v1alpha1", "Pipelines", "pipelines", True),
+    ("openaihub.ibm.com/v1alpha1", "OpenAIHub", "openaihubs", True),
+    ("openaihub.ibm.com/v1alpha1", "Kubeflow", "kubeflows", True),
+]
+
+# the packages of the openaihub catalog, install waits for 5 of them
+OPENAIHUB_PACKAGES = ["jupyterlab-operator", "pipelines-operator", "openaihub-operator", "kubeflow-operator", "katib-operator"]
+
+SERVER_VERSION = "v1.13.8+fake"
+
+class Resource:
+    def __init__(self, api_version, kind, plural, namespaced):
+        self.api_version = api_version
+        self.kind = kind
+        self.plural = plural
+        self.namespaced = namespaced
+        self.group, _, self.version = api_version.rpartition("/")
+
+    def names(self):
+        # every way kubectl may refer to it, e.g. deployment, deployments, deployment.apps
+        names = [self.kind.lower(), self.plural]
+        return names + ["%s.%s" % (x, self.group) for x in names] if self.group else names
+
+class ApiError(Exception):
+    def __init__(self, code, reason, message):
+        Exception.__init__(self, message)
+        self.code = code
+        self.reason = reason
+        self.message = message
+
+    def status(self):
+        return {"kind": "Status", "apiVersion": "v1", "metadata": {}, "status": "Failure",
+                "message": self.message, "reason": self.reason, "code": self.code}
+
+def merge(target, patch):
+    # json merge patch, also used for strategic merge and apply patches
+    for k, v in patch.items():
+        if v is None:
+            target.pop(k, None)
+        elif isinstance(v, dict) and isinstance(target.get(k), dict):
+            merge(target[k], v)
+        else:
+            target[k] = copy.deepcopy(v)
+    return target
+
+def match_labels(obj, selector):
+    labels = obj["metadata"].get("labels") or {}
+    for term in filter(None, (selector or "").split(",")):
+        key, _, value = term.partition("=")
+        if labels.get(key.strip()) != value.strip():
+            return False
+    return True
+
+def match_fields(obj, selector):
+    for term in filter(None, (selector or "").split(",")):
+        key, _, value = term.partition("=")
+        if key == "metadata.name" and obj["metadata"]["name"] != value:
+            return False
+        if key == "metadata.namespace" and obj["metadata"].get("namespace") != value:
+            return False
+    return True
+
+class Store:
+    # objects and an append-only event log, every write bumps the resourceVersion
+    def __init__(self):
+        self.objects = dict()
+        self.events = []
+        self.revision = 0
+        self.cond = threading.Condition()
+
+    def _key(self, resource, namespace, name):
+        return (resource.kind, resource.group, namespace if resource.namespaced else None, name)
+
+    def get(self, resource, namespace, name):
+        with self.cond:
+            obj = self.objects.get(self._key(resource, namespace, name))
+            return copy.deepcopy(obj) if obj else None
+
+    def list(self, resource, namespace=None, label_selector=None, field_selector=None):
+        with self.cond:
+            return self.revision, [copy.deepcopy(x) for (kind, group, ns, name), x in sorted(self.objects.items())
+                                   if kind == resource.kind and group == resource.group and
+                                   (namespace is None or ns == namespace) and
+                                   match_labels(x, label_selector) and match_fields(x, field_selector)]
+
+    def put(self, resource, obj, status_only=False):
+        meta = obj["metadata"]
+        key = self._key(resource, meta.get("namespace"), meta["name"])
+        with self.cond:
+            old = self.objects.get(key)
+            self.revision += 1
+            obj = copy.deepcopy(obj)
+            obj["apiVersion"], obj["kind"] = resource.api_version, resource.kind
+            meta = obj["metadata"]
+            if not resource.namespaced:
+                meta.pop("namespace", None)
+            meta["resourceVersion"] = str(self.revision)
+            if old is None:
+                meta["uid"] = str(uuid.uuid4())
+                meta["creationTimestamp"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+                meta["generation"] = 1
+            else:
+                meta["uid"] = old["metadata"]["uid"]
+                meta["creationTimestamp"] = old["metadata"]["creationTimestamp"]
+                meta["generation"] = old["metadata"].get("generation", 1)
+                if status_only:
+                    obj = dict(old, status=obj.get("status"), metadata=dict(old["metadata"], resourceVersion=meta["resourceVersion"]))
+                elif old.get("spec") != obj.get("spec"):
+                    meta["generation"] += 1
+                if "status" not in obj and "status" in old:
+                    obj["status"] = old["status"]
+            self.objects[key] = obj
+            self.events.append((self.revision, "ADDED" if old is None else "MODIFIED", resource, copy.deepcopy(obj)))
+            self.cond.notify_all()
+            return copy.deepcopy(obj), old is None
+
+    def delete(self, resource, namespace, name):
+        with self.cond:
+            obj = self.objects.pop(self._key(resource, namespace, name), None)
+            if obj is None:
+                return None
+            self.revision += 1
+            obj["metadata"]["resourceVersion"] = str(self.revision)
+            self.events.append((self.revision, "DELETED", resource, copy.deepcopy(obj)))
+            self.cond.notify_all()
+            return obj
+
+class FakeCluster:
+    def __init__(self, scale=1.0, latencies=None):
+        self.latencies = dict(LATENCIES)
+        self.latencies.update(latencies or {})
+        self.scale = scale
+        self.resources = [Resource(*x) for x in RESOURCES]
+        self.stats = Counter()
+        self.lock = threading.Lock()
+        self.reset()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _handler(self))
+        self.server.daemon_threads = True
+        self.thread = None
+        self.tempdir = tempfile.mkdtemp(prefix="fakecluster-")
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%s" % self.server.server_address[1]
+
+    def delay(self, name):
+        return self.latencies[name] * self.scale
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="fakecluster")
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset(self):
+        # a cluster with OLM installed and rolled out
+        self.store = Store()
+        self.builds = dict()
+        self.stats = Counter()
+        for x in ["default", "kube-system", "olm", "operators"]:
+            self.seed({"apiVersion": "v1", "kind": "Namespace", "metadata": {"name": x}})
+        for x in ["olm-operator", "catalog-operator"]:
+            self.seed(self.deployment(x, "olm", ready=True))
+        for x in NODES:
+            self.seed({"apiVersion": "v1", "kind": "Node", "metadata": {"name": x},
+                       "status": {"conditions": [{"type": "Ready", "status": "True"}]}})
+        self.seed({"apiVersion": "storage.k8s.io/v1", "kind": "StorageClass", "provisioner": "ibm.io/ibmc-file",
+                   "metadata": {"name": "ibmc-file-bronze", "annotations": {"storageclass.kubernetes.io/is-default-class": "true"}}})
+
+    def seed(self, obj):
+        self.store.put(self.resource(obj["apiVersion"], obj["kind"]), obj)
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def resource(self, api_version, kind):
+        for x in self.resources:
+            if x.api_version == api_version and x.kind == kind:
+                return x
+        raise ApiError(404, "NotFound", "the server could not find the requested resource (%s %s)" % (api_version, kind))
+
+    def resource_by_path(self, api_version, plural):
+        for x in self.resources:
+            if x.api_version == api_version and x.plural == plural:
+                return x
+        raise ApiError(404, "NotFound", "the server could not find the requested resource (%s %s)" % (api_version, plural))
+
+    def resource_by_name(self, name):
+        for x in self.resources:
+            if name.lower() in x.names():
+                return x
+        raise ApiError(404, "NotFound", 'the server doesn\'t have a resource type "%s"' % name)
+
+    def later(self, delay, func, *args):
+        timer = threading.Timer(self.delay(delay), func, args)
+        timer.daemon = True
+        timer.start()
+
+    # objects
+
+    def deployment(self, name, namespace, ready=False):
+        obj = {"apiVersion": "apps/v1", "kind": "Deployment", "metadata": {"name": name, "namespace": namespace},
+               "spec": {"replicas": 1, "selector": {"matchLabels": {"name": name}},
+                        "template": {"metadata": {"labels": {"name": name}}, "spec": {"containers": [{"name": name, "image": name}]}}}}
+        if ready:
+            obj["status"] = {"observedGeneration": 1, "replicas": 1, "updatedReplicas": 1, "availableReplicas": 1}
+        return obj
+
+    def seed_install(self, namespace):
+        # the objects of a finished install, the CRs and PVCs with finalizers
+        if namespace not in ("olm", "operators"):
+            # created by install
+            self.seed({"apiVersion": "v1", "kind": "Namespace",
+                       "metadata": {"name": namespace, "annotations": {"openaihub.ibm.com/created-by": "install"}}})
+        self.seed({"apiVersion": "operators.coreos.com/v1alpha1", "kind": "CatalogSource",
+                   "metadata": {"name": "openaihub-catalog", "namespace": "olm"}, "spec": {"sourceType": "grpc"}})
+        for x in OPENAIHUB_PACKAGES:
+            self.seed(self.package_manifest(x, "openaihub-catalog", "olm"))
+        for name, kind in [("jupyterlab", "Jupyterlab"), ("pipelines", "Pipelines"), ("openaihub", "OpenAIHub"), ("kubeflow", "Kubeflow")]:
+            package = "%s-operator" % name
+            self.seed({"apiVersion": "operators.coreos.com/v1alpha1", "kind": "Subscription",
+                       "metadata": {"name": "my-%s" % name, "namespace": "operators"},
+                       "spec": {"name": package, "channel": "alpha", "source": "openaihub-catalog", "sourceNamespace": "olm"},
+                       "status": {"installedCSV": "%s.v0.0.1" % package, "currentCSV": "%s.v0.0.1" % package}})
+            self.seed({"apiVersion": "operators.coreos.com/v1alpha1", "kind": "ClusterServiceVersion",
+                       "metadata": {"name": "%s.v0.0.1" % package, "namespace": "operators"}, "spec": {"displayName": package},
+                       "status": {"phase": "Succeeded"}})
+            self.seed(self.deployment(package, "operators", ready=True))
+            self.seed({"apiVersion": "openaihub.ibm.com/v1alpha1", "kind": kind,
+                       "metadata": {"name": "%s-cr" % name, "namespace": namespace, "finalizers": ["openaihub.ibm.com/operands"]},
+                       "spec": {"size": 1}})
+        self.seed({"apiVersion": "v1", "kind": "ConfigMap", "metadata": {"name": "openaihub-install-config", "namespace": "operators"},
+                   "data": {"KUBECTL_VERSION": SERVER_VERSION}})
+        self.seed({"apiVersion": "rbac.authorization.k8s.io/v1", "kind": "ClusterRoleBinding",
+                   "metadata": {"name": "add-on-cluster-admin-openaihub"},
+                   "roleRef": {"apiGroup": "rbac.authorization.k8s.io", "kind": "ClusterRole", "name": "cluster-admin"},
+                   "subjects": [{"kind": "ServiceAccount", "name": "default", "namespace": namespace}]})
+        for x in ["minio-pvc", "mysql-pvc", "katib-mysql"]:
+            self.seed({"apiVersion": "v1", "kind": "PersistentVolumeClaim",
+                       "metadata": {"name": x, "namespace": namespace, "finalizers": ["kubernetes.io/pvc-protection"]},
+                       "spec": {"storageClassName": "nfs-dynamic"}})
+        self.seed({"apiVersion": "storage.k8s.io/v1", "kind": "StorageClass", "provisioner": "cluster.local/nfs",
+                   "metadata": {"name": "nfs-dynamic", "annotations": {"storageclass.kubernetes.io/is-default-class": "true"}}})
+        self.seed({"apiVersion": "storage.k8s.io/v1", "kind": "StorageClass", "provisioner": "ibm.io/ibmc-file",
+                   "metadata": {"name": "ibmc-file-bronze", "annotations": {"storageclass.kubernetes.io/is-default-class": "false"}}})
+
+    def package_manifest(self, name, catalog, namespace):
+        return {"apiVersion": "packages.operators.coreos.com/v1", "kind": "PackageManifest",
+                "metadata": {"name": name, "namespace": namespace, "labels": {"catalog": catalog}},
+                "status": {"packageName": name, "catalogSource": catalog, "catalogSourceNamespace": namespace,
+                           "defaultChannel": "alpha", "channels": [{"name": "alpha", "currentCSV": "%s.v0.0.1" % name, "currentCSVDesc": {
+                               "displayName": name, "annotations": {"containerImage": "docker.io/ffdlops/%s:v0.0.1" % name},
+                               "relatedImages": [{"name": "operand", "image": "docker.io/ffdlops/%s-operand:v0.0.1" % name}]}}]}}
+
+    # API operations, shared by the HTTP handler and the kubectl stub
+
+    def get(self, resource, namespace, name):
+        if resource.kind == "PackageManifest":
+            # the package server shows global catalogs in every namespace
+            namespace = None
+            objects = [x for x in self.store.list(resource)[1] if x["metadata"]["name"] == name]
+            obj = objects[0] if objects else None
+        else:
+            obj = self.store.get(resource, namespace, name)
+        if obj is None:
+            raise ApiError(404, "NotFound", '%s "%s" not found' % (resource.plural, name))
+        return obj
+
+    def list(self, resource, namespace, label_selector=None, field_selector=None):
+        if resource.kind == "PackageManifest":
+            namespace = None
+        return self.store.list(resource, namespace, label_selector, field_selector)
+
+    def create(self, resource, namespace, obj):
+        obj.setdefault("metadata", {})
+        if resource.namespaced:
+            obj["metadata"]["namespace"] = namespace or obj["metadata"].get("namespace") or "default"
+        if self.store.get(resource, obj["metadata"].get("namespace"), obj["metadata"]["name"]) is not None:
+            raise ApiError(409, "AlreadyExists", '%s "%s" already exists' % (resource.plural, obj["metadata"]["name"]))
+        obj, _ = self.store.put(resource, obj)
+        self.react(resource, obj, "ADDED")
+        return obj
+
+    def patch(self, resource, namespace, name, patch, apply=False):
+        old = self.store.get(resource, namespace, name)
+        if old is None:
+            if not apply:
+                raise ApiError(404, "NotFound", '%s "%s" not found' % (resource.plural, name))
+            return self.create(resource, namespace, patch)
+        obj, _ = self.store.put(resource, merge(old, patch))
+        self.react(resource, obj, "MODIFIED")
+        return obj
+
+    def dry_run(self, resource, namespace, name, obj):
+        # a create or apply with ?dryRun=All: checked like one, nothing is stored
+        if resource.namespaced and self.store.get(self.resource("v1", "Namespace"), None, namespace or "default") is None:
+            raise ApiError(404, "NotFound", 'namespaces "%s" not found' % namespace)
+        old = self.store.get(resource, namespace, name) if name else None
+        return merge(copy.deepcopy(old or {}), obj)
+
+    def delete(self, resource, namespace, name):
+        obj = self.store.get(resource, namespace, name)
+        if obj is None:
+            raise ApiError(404, "NotFound", '%s "%s" not found' % (resource.plural, name))
+        if obj["metadata"].get("finalizers") or resource.kind == "Namespace":
+            # marked for deletion, gone once its finalizers are done
+            if "deletionTimestamp" not in obj["metadata"]:
+                obj["metadata"]["deletionTimestamp"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+                obj, _ = self.store.put(resource, obj)
+                self.later("finalizer", self.finalize, resource, namespace, name)
+            return obj
+        self.finalize(resource, namespace, name)
+        return {"kind": "Status", "apiVersion": "v1", "metadata": {}, "status": "Success"}
+
+    def finalize(self, resource, namespace, name):
+        obj = self.store.delete(resource, namespace, name)
+        if obj is None:
+            return
+        # the garbage collector and OLM clean up after it
+        if resource.kind == "Namespace":
+            for (kind, group, ns, x), child in list(self.store.objects.items()):
+                if ns == name:
+                    self.store.delete(self.resource(child["apiVersion"], kind), ns, x)
+        elif resource.kind == "DaemonSet":
+            pods = self.resource("v1", "Pod")
+            for x in self.store.list(pods, namespace)[1]:
+                if any(o.get("kind") == "DaemonSet" and o.get("name") == name for o in x["metadata"].get("ownerReferences") or []):
+                    self.store.delete(pods, namespace, x["metadata"]["name"])
+        elif resource.kind == "ClusterServiceVersion":
+            self.store.delete(self.resource("apps/v1", "Deployment"), namespace, (obj.get("spec") or {}).get("displayName"))
+        elif resource.kind == "CatalogSource":
+            packages = self.resource("packages.operators.coreos.com/v1", "PackageManifest")
+            for x in self.store.list(packages, namespace, "catalog=%s" % name)[1]:
+                self.store.delete(packages, namespace, x["metadata"]["name"])
+
+    # controllers
+
+    def react(self, resource, obj, event):
+        meta = obj["metadata"]
+        if resource.kind == "Deployment":
+            if (obj.get("status") or {}).get("observedGeneration", 0) < meta.get("generation", 1):
+                self.later("rollout", self.roll_out, resource, meta["namespace"], meta["name"])
+        elif resource.kind == "Subscription" and event == "ADDED":
+            self.later("operator", self.resolve_subscription, obj)
+        elif resource.kind == "CatalogSource":
+            self.later("packagemanifest", self.serve_catalog, obj)
+        elif resource.kind == "DaemonSet" and event == "ADDED":
+            for x in NODES:
+                self.later("pod_start", self.start_daemon_pod, obj, x)
+        elif resource.kind == "Pod" and event == "ADDED":
+            self.later("pod_start", self.start_pod, meta["namespace"], meta["name"])
+        elif resource.kind == "Jupyterlab" and event == "ADDED":
+            self.later("storageclass", self.seed, {"apiVersion": "storage.k8s.io/v1", "kind": "StorageClass",
+                                                   "metadata": {"name": "nfs-dynamic"}, "provisioner": "cluster.local/nfs"})
+
+    def roll_out(self, resource, namespace, name):
+        obj = self.store.get(resource, namespace, name)
+        if obj is None:
+            return
+        replicas = obj.get("spec", {}).get("replicas", 1)
+        obj["status"] = {"observedGeneration": obj["metadata"]["generation"], "replicas": replicas,
+                         "updatedReplicas": replicas, "readyReplicas": replicas, "availableReplicas": replicas}
+        self.store.put(resource, obj, status_only=True)
+
+    def resolve_subscription(self, sub):
+        # the package name is the name of its operator deployment
+        name, namespace = sub["spec"]["name"], sub["metadata"]["namespace"]
+        self.seed({"apiVersion": "operators.coreos.com/v1alpha1", "kind": "ClusterServiceVersion",
+                   "metadata": {"name": "%s.v0.0.1" % name, "namespace": namespace}, "spec": {"displayName": name},
+                   "status": {"phase": "Succeeded"}})
+        try:
+            self.create(self.resource("apps/v1", "Deployment"), namespace, self.deployment(name, namespace))
+        except ApiError:
+            pass
+
+    def serve_catalog(self, source):
+        name, namespace = source["metadata"]["name"], source["metadata"]["namespace"]
+        if name == "openaihub-catalog":
+            packages = OPENAIHUB_PACKAGES
+        elif source.get("spec", {}).get("sourceType") == "configmap":
+            configmap = self.store.get(self.resource("v1", "ConfigMap"), namespace, source["spec"].get("configMap"))
+            packages = [x["packageName"] for x in yaml.safe_load(((configmap or {}).get("data") or {}).get("packages") or "[]")]
+        else:
+            image = source.get("spec", {}).get("image", "")
+            packages = self.builds.get(image.rsplit("@", 1)[-1]) or self.builds.get(image) or []
+        for x in packages:
+            self.seed(self.package_manifest(x, name, namespace))
+
+    def start_daemon_pod(self, daemonset, node):
+        # one pod per node whose images are pulled one after the other
+        meta, template = daemonset["metadata"], daemonset["spec"]["template"]
+        pod = {"apiVersion": "v1", "kind": "Pod",
+               "metadata": {"name": "%s-%s" % (meta["name"], node), "namespace": meta["namespace"],
+                            "labels": template["metadata"].get("labels") or {}, "ownerReferences": [{"kind": "DaemonSet", "name": meta["name"]}]},
+               "spec": dict(template["spec"], nodeName=node)}
+        pod["status"] = {"phase": "Pending", "containerStatuses": [
+            {"name": x["name"], "image": x["image"], "imageID": "", "state": {"waiting": {"reason": "ContainerCreating"}}}
+            for x in pod["spec"]["containers"]]}
+        resource = self.resource("v1", "Pod")
+        self.store.put(resource, pod)
+        for i in range(len(pod["spec"]["containers"])):
+            self.later("image_pull", self.pull_image, meta["namespace"], pod["metadata"]["name"], i)
+
+    def pull_image(self, namespace, name, index):
+        resource = self.resource("v1", "Pod")
+        pod = self.store.get(resource, namespace, name)
+        if pod is None:
+            return
+        # pulled in order, the next one is only done once this one is
+        statuses = pod["status"]["containerStatuses"]
+        if index > 0 and not statuses[index - 1]["imageID"]:
+            return self.later("image_pull", self.pull_image, namespace, name, index)
+        statuses[index].update(imageID="sha256:%s" % hashlib.sha256(statuses[index]["image"].encode()).hexdigest(),
+                               state={"running": {"startedAt": "now"}})
+        if all(x["imageID"] for x in statuses):
+            pod["status"]["phase"] = "Running"
+        self.store.put(resource, pod, status_only=True)
+
+    def start_pod(self, namespace, name):
+        resource = self.resource("v1", "Pod")
+        pod = self.store.get(resource, namespace, name)
+        if pod is None:
+            return
+        init = pod.get("spec", {}).get("initContainers") or []
+        if init:
+            pod["status"] = {"phase": "Pending", "initContainerStatuses": [
+                {"name": init[0]["name"], "state": {"running": {"startedAt": "now"}}}]}
+        else:
+            pod["status"] = {"phase": "Running", "containerStatuses": [
+                {"name": x["name"], "state": {"running": {"startedAt": "now"}}} for x in pod["spec"].get("containers") or []]}
+        self.store.put(resource, pod, status_only=True)
+
+    def exec_command(self, namespace, name, container, command, stdin):
+        # emulates the commands the installer runs in pods, returns the exit code
+        if not any("tar" in x for x in command):
+            return 0
+        try:
+            names = []
+            with tarfile.open(fileobj=io.BytesIO(stdin), mode="r:gz") as tf:
+                for member in tf:
+                    if member.isfile() and member.name.endswith("clusterserviceversion.yaml"):
+                        csv = yaml.safe_load(tf.extractfile(member))
+                        names.append(csv["spec"]["install"]["spec"]["deployments"][0]["name"])
+            rc = 0
+        except (tarfile.TarError, IOError, yaml.YAMLError, KeyError, IndexError, TypeError):
+            names, rc = [], 2
+        if container == "kaniko-init":
+            self.later("kaniko", self.finish_build, namespace, name, names, rc == 0)
+        return rc
+
+    def finish_build(self, namespace, name, names, ok):
+        resource = self.resource("v1", "Pod")
+        pod = self.store.get(resource, namespace, name)
+        if pod is None:
+            return
+        image = ""
+        for x in pod["spec"].get("containers") or []:
+            for arg in x.get("args") or []:
+                if arg.startswith("--destination="):
+                    image = arg[len("--destination="):]
+        digest = "sha256:" + hashlib.sha256((image + ",".join(names)).encode()).hexdigest()
+        if ok:
+            self.builds[digest] = names
+            self.builds[image] = names
+        pod["status"] = {"phase": "Succeeded" if ok else "Failed", "containerStatuses": [
+            {"name": "kaniko", "state": {"terminated": {"exitCode": 0 if ok else 1, "message": digest if ok else "build failed"}}}]}
+        self.store.put(resource, pod, status_only=True)
+
+    # kubectl, oc and helm
+
+    def write_stubs(self):
+        # stubs on PATH that forward every invocation to the fake cluster
+        bindir = os.path.join(self.tempdir, "bin")
+        os.makedirs(bindir, exist_ok=True)
+        for tool in ["kubectl", "oc", "helm"]:
+            path = os.path.join(bindir, tool)
+            with open(path, "w") as f:
+                f.write(STUB % {"python": sys.executable, "tool": tool, "url": self.url})
+            os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+        return bindir
+
+    def write_kubeconfig(self):
+        path = os.path.join(self.tempdir, "kubeconfig")
+        with open(path, "w") as f:
+            yaml.safe_dump({"apiVersion": "v1", "kind": "Config", "current-context": "fake", "preferences": {},
+                            "clusters": [{"name": "fake", "cluster": {"server": self.url}}],
+                            "contexts": [{"name": "fake", "context": {"cluster": "fake", "user": "fake", "namespace": "default"}}],
+                            "users": [{"name": "fake", "user": {"token": "fake"}}]}, f)
+        return path
+
+    def tool(self, tool, argv, stdin, files):
+        # returns (returncode, stdout, stderr) of one kubectl/oc/helm invocation
+        self.count("tool:%s" % tool)
+        time.sleep(self.delay("tool"))
+        try:
+            if tool == "kubectl":
+                return self.kubectl(argv, stdin, files)
+            if tool == "oc" and argv[:1] == ["new-project"]:
+                self.create(self.resource("v1", "Namespace"), None, {"metadata": {"name": argv[1]}})
+            if tool == "helm" and argv[:1] == ["init"]:
+                self.patch(self.resource("apps/v1", "Deployment"), "kube-system", "tiller-deploy",
+                           self.deployment("tiller-deploy", "kube-system"), apply=True)
+            return 0, "", ""
+        except ApiError as e:
+            return 1, "", "Error from server (%s): %s\n" % (e.reason, e.message)
+
+    def kubectl(self, argv, stdin, files):
+        args, options = [], dict()
+        flags = {"-n": "namespace", "--namespace": "namespace", "-o": "output", "-l": "selector", "-f": "filename",
+                 "-p": "patch", "--patch": "patch", "-c": "container"}
+        i = 0
+        while i < len(argv):
+            x = argv[i]
+            if x == "--":
+                options["command"] = argv[i + 1:]
+                break
+            if x in flags:
+                options[flags[x]] = argv[i + 1]
+                i += 2
+                continue
+            if x.startswith("-"):
+                options[x.lstrip("-")] = True
+            else:
+                args.append(x)
+            i += 1
+        verb, args = args[0], args[1:]
+        namespace = options.get("namespace")
+        if verb == "version":
+            return 0, "Client Version: %s\nServer Version: %s\n" % (SERVER_VERSION, SERVER_VERSION), ""
+        if verb == "get" and "/" in args[0]:
+            # kubectl get TYPE/NAME ..., a List of the ones found
+            items = []
+            for x in args:
+                kind, name = x.split("/", 1)
+                try:
+                    items.append(self.get(self.resource_by_name(kind), namespace or "default", name))
+                except ApiError:
+                    if not options.get("ignore-not-found"):
+                        raise
+            return 0, json.dumps({"apiVersion": "v1", "kind": "List", "items": items}) if items else "", ""
+        if verb == "get":
+            resource = self.resource_by_name(args[0])
+            if len(args) > 1:
+                return 0, json.dumps(self.get(resource, namespace or "default", args[1])), ""
+            _, items = self.list(resource, namespace, options.get("selector"))
+            return 0, json.dumps({"apiVersion": "v1", "kind": "List", "items": items}), ""
+        if verb in ("create", "apply"):
+            content = stdin if options.get("filename") == "-" else files.get(options.get("filename"), "")
+            out = []
+            for doc in [x for x in yaml.safe_load_all(content) if x]:
+                try:
+                    resource = self.resource(doc["apiVersion"], doc["kind"])
+                except ApiError:
+                    raise ApiError(404, "NotFound", 'no matches for kind "%s" in version "%s"' % (doc["kind"], doc["apiVersion"]))
+                ns = namespace or doc["metadata"].get("namespace") or "default"
+                if options.get("dry-run=server"):
+                    self.count("dryrun")
+                    self.dry_run(resource, ns, doc["metadata"]["name"], doc)
+                    out.append("%s/%s configured (server dry run)" % (resource.kind.lower(), doc["metadata"]["name"]))
+                elif verb == "create":
+                    self.create(resource, ns, doc)
+                    out.append("%s/%s created" % (resource.kind.lower(), doc["metadata"]["name"]))
+                else:
+                    self.patch(resource, ns, doc["metadata"]["name"], doc, apply=True)
+                    out.append("%s/%s configured" % (resource.kind.lower(), doc["metadata"]["name"]))
+            return 0, "\n".join(out) + "\n", ""
+        if verb == "patch":
+            resource = self.resource_by_name(args[0])
+            self.patch(resource, namespace or "default", args[1], json.loads(options["patch"]))
+            return 0, "%s/%s patched\n" % (resource.kind.lower(), args[1]), ""
+        if verb == "delete":
+            try:
+                self.delete(self.resource_by_name(args[0]), namespace or "default", args[1])
+            except ApiError:
+                if not options.get("ignore-not-found"):
+                    raise
+            return 0, "", ""
+        if verb == "exec":
+            rc = self.exec_command(namespace or "default", args[0], options.get("container"), options.get("command") or [], stdin)
+            return rc, "", "" if rc == 0 else "command terminated with exit code %s\n" % rc
+        return 1, "", "error: unknown command \"%s\" for \"kubectl\"\n" % verb
+
+STUB = '''#!%(python)s
+# %(tool)s stand-in of the fake cluster
+import base64, json, os, sys, urllib.request
+argv = sys.argv[1:]
+stdin = b""
+if "-i" in argv or ("-f" in argv and argv[argv.index("-f") + 1] == "-"):
+    stdin = sys.stdin.buffer.read()
+files = dict()
+if "-f" in argv and argv[argv.index("-f") + 1] != "-":
+    with open(argv[argv.index("-f") + 1]) as f:
+        files[argv[argv.index("-f") + 1]] = f.read()
+body = json.dumps({"tool": "%(tool)s", "argv": argv, "stdin": base64.b64encode(stdin).decode(), "files": files}).encode()
+request = urllib.request.Request("%(url)s/_tool", data=body, headers={"Content-Type": "application/json"})
+result = json.loads(urllib.request.urlopen(request).read())
+sys.stdout.write(result["stdout"])
+sys.stderr.write(result["stderr"])
+sys.exit(result["returncode"])
+'''
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+def _handler(cluster):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, code, body):
+            data = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _body(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            data = self.rfile.read(length) if length else b""
+            if not data:
+                return {}
+            try:
+                return json.loads(data)
+            except ValueError:
+                return yaml.safe_load(data)
+
+        def _route(self):
+            # returns (resource, namespace, name, subresource) or a discovery document
+            url = urlparse(self.path)
+            self.query = dict((k, v[-1]) for k, v in parse_qs(url.query).items())
+            self.query_lists = parse_qs(url.query)
+            parts = [x for x in url.path.split("/") if x]
+            if parts == ["version"]:
+                return {"major": "1", "minor": "13", "gitVersion": SERVER_VERSION, "platform": "linux/amd64"}
+            if parts == ["api"]:
+                return {"kind": "APIVersions", "versions": ["v1"]}
+            if parts == ["apis"]:
+                groups = dict()
+                for x in cluster.resources:
+                    if x.group:
+                        groups.setdefault(x.group, [])
+                        if x.version not in groups[x.group]:
+                            groups[x.group].append(x.version)
+                return {"kind": "APIGroupList", "apiVersion": "v1", "groups": [
+                    {"name": g, "versions": [{"groupVersion": "%s/%s" % (g, v), "version": v} for v in vs],
+                     "preferredVersion": {"groupVersion": "%s/%s" % (g, vs[0]), "version": vs[0]}} for g, vs in groups.items()]}
+            if parts[:1] == ["api"]:
+                api_version, parts = parts[1], parts[2:]
+            elif parts[:1] == ["apis"] and len(parts) >= 3:
+                api_version, parts = "%s/%s" % (parts[1], parts[2]), parts[3:]
+            else:
+                raise ApiError(404, "NotFound", "the server could not find the requested resource")
+            if not parts:
+                resources = [{"name": x.plural, "singularName": x.kind.lower(), "namespaced": x.namespaced, "kind": x.kind,
+                              "verbs": ["create", "delete", "get", "list", "patch", "update", "watch"]}
+                             for x in cluster.resources if x.api_version == api_version]
+                if api_version == "v1":
+                    resources.append({"name": "pods/exec", "singularName": "", "namespaced": True, "kind": "PodExecOptions", "verbs": ["create", "get"]})
+                return {"kind": "APIResourceList", "apiVersion": "v1", "groupVersion": api_version, "resources": resources}
+            namespace = None
+            if parts[0] == "namespaces" and len(parts) >= 3:
+                namespace, parts = parts[1], parts[2:]
+            resource = cluster.resource_by_path(api_version, parts[0])
+            return resource, namespace, parts[1] if len(parts) > 1 else None, parts[2] if len(parts) > 2 else None
+
+        def _handle(self, method):
+            time.sleep(cluster.delay("api"))
+            try:
+                if self.path == "/_tool":
+                    body = self._body()
+                    rc, out, err = cluster.tool(body["tool"], body["argv"], base64.b64decode(body["stdin"]), body["files"])
+                    return self._send(200, {"returncode": rc, "stdout": out, "stderr": err})
+                route = self._route()
+                if isinstance(route, dict):
+                    cluster.count("discovery")
+                    return self._send(200, route)
+                resource, namespace, name, sub = route
+                if method == "GET" and sub == "exec":
+                    cluster.count("exec")
+                    return self._exec(namespace, name)
+                if method == "GET" and name is None and self.query.get("watch") in ("true", "True", "1"):
+                    cluster.count("watch")
+                    return self._watch(resource, namespace)
+                if method == "GET" and name is None:
+                    cluster.count("list")
+                    revision, items = cluster.list(resource, namespace, self.query.get("labelSelector"), self.query.get("fieldSelector"))
+                    return self._send(200, {"apiVersion": resource.api_version, "kind": resource.kind + "List",
+                                            "metadata": {"resourceVersion": str(revision)}, "items": items})
+                if method == "GET":
+                    cluster.count("get")
+                    return self._send(200, cluster.get(resource, namespace, name))
+                if method in ("POST", "PATCH", "PUT") and self.query.get("dryRun"):
+                    cluster.count("dryrun")
+                    body = self._body()
+                    return self._send(200, cluster.dry_run(resource, namespace, name or body["metadata"]["name"], body))
+                if method == "POST":
+                    cluster.count("create")
+                    return self._send(201, cluster.create(resource, namespace, self._body()))
+                if method in ("PATCH", "PUT"):
+                    apply = "apply-patch" in (self.headers.get("Content-Type") or "")
+                    cluster.count("apply" if apply else "patch")
+                    return self._send(200, cluster.patch(resource, namespace, name, self._body(), apply=apply or method == "PUT"))
+                if method == "DELETE":
+                    cluster.count("delete")
+                    self._body()
+                    return self._send(200, cluster.delete(resource, namespace, name))
+                raise ApiError(405, "MethodNotAllowed", "method %s is not allowed" % method)
+            except ApiError as e:
+                return self._send(e.code, e.status())
+
+        def do_GET(self):
+            self._handle("GET")
+
+        def do_POST(self):
+            self._handle("POST")
+
+        def do_PUT(self):
+            self._handle("PUT")
+
+        def do_PATCH(self):
+            self._handle("PATCH")
+
+        def do_DELETE(self):
+            self._handle("DELETE")
+
+        def _chunk(self, data):
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+        def _watch(self, resource, namespace):
+            since = int(self.query.get("resourceVersion") or 0)
+            deadline = time.time() + int(self.query.get("timeoutSeconds") or 300)
+            label_selector, field_selector = self.query.get("labelSelector"), self.query.get("fieldSelector")
+            if resource.kind == "PackageManifest":
+                namespace = None
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            store = cluster.store
+            position = 0
+            try:
+                while time.time() < deadline:
+                    with store.cond:
+                        events = store.events[position:]
+                        position = len(store.events)
+                        if not events:
+                            store.cond.wait(max(0, min(1, deadline - time.time())))
+                            continue
+                    for revision, kind, res, obj in events:
+                        if revision <= since or res.kind != resource.kind or res.group != resource.group:
+                            continue
+                        if namespace is not None and obj["metadata"].get("namespace") != namespace:
+                            continue
+                        if not match_labels(obj, label_selector) or not match_fields(obj, field_selector):
+                            continue
+                        self._chunk(json.dumps({"type": kind, "object": obj}).encode() + b"\n")
+                self._chunk(b"")
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True
+
+        # a websocket server just big enough for one exec session of the channel protocol
+
+        def _ws_read(self):
+            header = self.rfile.read(2)
+            if len(header) < 2:
+                return 8, b""
+            opcode, length = header[0] & 0x0f, header[1] & 0x7f
+            if length == 126:
+                length = struct.unpack(">H", self.rfile.read(2))[0]
+            elif length == 127:
+                length = struct.unpack(">Q", self.rfile.read(8))[0]
+            mask = self.rfile.read(4) if header[1] & 0x80 else None
+            data = self.rfile.read(length)
+            if mask and data:
+                key = (mask * (length // 4 + 1))[:length]
+                data = (int.from_bytes(data, "big") ^ int.from_bytes(key, "big")).to_bytes(length, "big")
+            return opcode, data
+
+        def _ws_write(self, opcode, data):
+            if len(data) < 126:
+                header = struct.pack(">BB", 0x80 | opcode, len(data))
+            elif len(data) < 65536:
+                header = struct.pack(">BBH", 0x80 | opcode, 126, len(data))
+            else:
+                header = struct.pack(">BBQ", 0x80 | opcode, 127, len(data))
+            self.wfile.write(header + data)
+
+        def _exec(self, namespace, name):
+            offered = [x.strip() for x in (self.headers.get("Sec-WebSocket-Protocol") or "").split(",")]
+            protocol = "v5.channel.k8s.io" if "v5.channel.k8s.io" in offered else offered[0]
+            key = self.headers.get("Sec-WebSocket-Key", "")
+            accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+            self.send_response(101)
+            self.send_header("Upgrade", "websocket")
+            self.send_header("Connection", "Upgrade")
+            self.send_header("Sec-WebSocket-Accept", accept)
+            self.send_header("Sec-WebSocket-Protocol", protocol)
+            self.end_headers()
+            self.close_connection = True
+            stdin = bytearray()
+            while True:
+                opcode, data = self._ws_read()
+                if opcode == 8:
+                    break
+                if opcode in (1, 2) and data:
+                    if data[0] == 0:
+                        stdin.extend(data[1:])
+                    elif data[0] == 255 and data[1:2] == b"\x00":
+                        # v5: stdin closed, the command runs to its end
+                        break
+            rc = cluster.exec_command(namespace, name, self.query.get("container"), self.query_lists.get("command") or [], bytes(stdin))
+            if opcode == 8:
+                return
+            if rc == 0:
+                status = {"metadata": {}, "status": "Success"}
+            else:
+                status = {"metadata": {}, "status": "Failure", "reason": "NonZeroExitCode", "message": "command terminated with non-zero exit code",
+                          "details": {"causes": [{"reason": "ExitCode", "message": str(rc)}]}}
+            try:
+                self._ws_write(2, b"\x03" + json.dumps(status).encode())
+                self._ws_write(8, struct.pack(">H", 1000))
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+    return Handler
@@ -0,0 +1,79 @@
+# Copyright 2019 IBM Corporation 
+# 
+# Licensed under the Apache License, Version 2.0 (the "License"); 
+# you may not use this file except in compliance with the License. 
+# You may obtain a copy of the License at 
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0 
+# 
+# Unless required by applicable law or agreed to in writing, software 
+# distributed under the License is distributed on an "AS IS" BASIS, 
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. 
+# See the License for the specific language governing permissions and 
+# limitations under the License. 
+#
+# Startup budget of the openaihub CLI.
+#
+#   python benchmarks/importtime.py                  check the budget, exit 1 when over it
+#   python benchmarks/importtime.py --budget 60 -v   with another budget, print the slowest imports
+#
+# `import openaihub.cli` runs under `python -X importtime` and its cumulative
+# import time (the best of a few runs) must stay under the budget. The heavy
+# dependencies must not be imported at all: --help, --version and usage errors
+# only need click, the commands import what they use.
+from __future__ import print_function
+import argparse
+import os
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SOURCE = os.path.dirname(HERE)
+
+# milliseconds, measured at about 45ms; the headroom is for slower machines
+BUDGET = 100
+
+# modules that the CLI module must leave to the commands
+HEAVY = ["openaihub.func", "yaml", "git", "kubernetes", "openshift", "wget", "tarfile", "urllib3"]
+
+def importtime(module):
+    # {module: (self us, cumulative us)} of one fresh interpreter
+    env = dict(os.environ)
+    env["PYTHONPATH"] = SOURCE + os.pathsep + env.get("PYTHONPATH", "")
+    ret = subprocess.run([sys.executable, "-X", "importtime", "-c", "import %s" % module], env=env,
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if ret.returncode != 0:
+        raise RuntimeError("import %s failed:\n%s" % (module, ret.stderr.decode()[-4000:]))
+    times = dict()
+    for line in ret.stderr.decode().splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = (int(own), int(cumulative))
+    return times
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the import time budget of the openaihub CLI")
+    parser.add_argument("--budget", type=float, default=BUDGET, help="milliseconds allowed for import openaihub.cli")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="runs, the fastest one counts")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print the slowest imports")
+    args = parser.parse_args()
+
+    runs = [importtime("openaihub.cli") for _ in range(args.repeat)]
+    best = min(runs, key=lambda x: x["openaihub.cli"][1])
+    total = best["openaihub.cli"][1] / 1000.0
+    print("import openaihub.cli: %.1fms (budget %.0fms)" % (total, args.budget))
+    if args.verbose:
+        for name, (own, cumulative) in sorted(best.items(), key=lambda x: -x[1][0])[:15]:
+            print("  %8.1fms %8.1fms  %s" % (own / 1000.0, cumulative / 1000.0, name))
+
+    failures = ["%s is imported by openaihub.cli" % x for x in HEAVY if x in best]
+    if total > args.budget:
+        failures.append("import openaihub.cli takes %.1fms, over the budget of %.0fms" % (total, args.budget))
+    for x in failures:
+        print("OVER BUDGET %s" % x)
+    if failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -12,3 +12,4 @@
 # See the License for the specific language governing permissions and 
 # limitations under the License. 
 name = "openaihub"
+version = "0.0.1.dev1"
@@ -15,15 +15,20 @@ from __future__ import print_function
 import logging
 import sys
 import os
-# pylint: disable=wrong-import-position
-import openaihub.func as func
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(stream=sys.stdout, level=logging.INFO)
 
+# pylint: disable=wrong-import-position
 import click
 from click import UsageError
 
+# openaihub.func (and yaml, kubernetes, git, ...) is imported by the commands only, so that
+# --help, --version and usage errors stay fast, see benchmarks/importtime.py
+
+# the profiles of openaihub.func.sizing
+OLM_PROFILES = ["auto", "small", "medium", "large", "xlarge"]
+
 @click.group()
 @click.version_option()
 def cli():
@@ -31,28 +36,52 @@ def cli():
 
 @cli.command()
 @click.version_option(expose_value=False)
-@click.option("--namespace", "-e", metavar="NAMESPACE", default="operators", show_default=True,
-              help="namespace where the operators are installed")
-def check_installed(namespace):
-    func.check_installed(namespace)
+@click.option("--namespace", "-e", metavar="NAMESPACE", multiple=True, default=["operators"], show_default=True,
+              help="namespace where the operators are installed, can be repeated or comma separated")
+@click.option("--all-namespaces", "-A", is_flag=True, default=False,
+              help="check the operators of all namespaces")
+@click.option("--output", "-o", metavar="FORMAT", default="name", type=click.Choice(['name', 'table', 'json', 'yaml']), show_default=True,
+              help="print the names only or the namespace, version, phase and age of each operator")
+@click.option("--watch", "-w", is_flag=True, default=False,
+              help="keep printing the changes of the operators after the first listing")
+def check_installed(namespace, all_namespaces, output, watch):
+    from openaihub import func
+    namespaces = [x for value in namespace for x in value.split(",") if x]
+    func.check_installed(namespaces, all_namespaces, output, watch)
 
 @cli.command()
 @click.version_option(expose_value=False)
 @click.option("--openshift", metavar="PLATFORM", is_flag=True, default=False,
               help="install on openshift or others")
 @click.option("--path", metavar="PATH", required=True,
-              help="path to the operator manifest")
-@click.option("--operator", metavar="NAME", required=True,
-              help="operator name")
+              help="path to the operator manifest: a directory of <operator>.tgz bundles or a single bundle")
+@click.option("--operator", metavar="NAME", multiple=True,
+              help="operator name, can be repeated [default: all bundles in PATH]")
+@click.option("--catalog", metavar="NAME", default='',
+              help="name of the catalog image and source [default: the operator name, or custom for many bundles]")
 @click.option("--logpath", metavar="PATH", default='',
               help="logging path")
 @click.option("--loglevel", "-l", metavar="LOGLEVEL", default="error", type=click.Choice(['info', 'error', 'INFO', 'ERROR']), show_default=True,
               help="logging level (info|error) for openaihub Python CLI")                
 @click.option('--verbose', '-V', is_flag=True, default=False, help="print INFO message, same as setting --loglevel info") 
-def register(path, operator, logpath, loglevel, verbose, openshift):
-    if logpath == '': logpath = path
+@click.option("--manifest-source", metavar="SOURCE", default='',
+              help="git ref, git url[#ref] or local directory to load the manifests from instead of the bundled ones")
+@click.option("--use-kubectl", is_flag=True, default=False,
+              help="run cluster operations through kubectl/oc processes instead of the in-process client")
+@click.option("--build-cache", metavar="MODE", default="local", type=click.Choice(['local', 'cluster', 'off']), show_default=True,
+              help="reuse catalog images built from the same bundles, recorded locally or also in a ConfigMap of the cluster")
+@click.option("--catalog-mode", metavar="MODE", default="image", type=click.Choice(['image', 'configmap']), show_default=True,
+              help="build a catalog image with kaniko, or serve small bundles from a ConfigMap without any build")
+@click.option("--trace", "trace_file", metavar="FILE", default='',
+              help="write a Chrome trace (chrome://tracing, Perfetto) of the steps, commands and waits to FILE")
+def register(path, operator, catalog, logpath, loglevel, verbose, openshift, manifest_source, use_kubectl, build_cache, catalog_mode, trace_file):
+    from openaihub import func
+    if logpath == '': logpath = path if os.path.isdir(path) else os.path.dirname(os.path.abspath(path))
     if verbose: loglevel = "info"
-    func.register(path, operator.lower(), logpath, loglevel, openshift)
+    operators = [x.lower() for x in operator]
+    # a single operator keeps the single result of earlier versions
+    func.register(path, operators[0] if len(operators) == 1 else operators, logpath, loglevel, openshift,
+                  manifest_source, use_kubectl, catalog.lower(), build_cache, trace_file, catalog_mode)
 
 @cli.command()
 @click.version_option(expose_value=False)
@@ -65,24 +94,161 @@ def register(path, operator, logpath, loglevel, verbose, openshift):
 @click.option("--loglevel", "-l", metavar="LOGLEVEL",default="error", type=click.Choice(['info', 'error', 'INFO', 'ERROR']), show_default=True,
               help="logging level [info|error] for openaihub Python CLI")
 @click.option('--verbose', '-V', is_flag=True, default=False, help="print INFO message, same as setting --loglevel info")
-def install(namespace, storage, loglevel, verbose, openshift):
+@click.option("--manifest-source", metavar="SOURCE", default='',
+              help="git ref, git url[#ref] or local directory to load the manifests from instead of the bundled ones")
+@click.option("--workers", "-w", metavar="N", default=4, type=click.IntRange(1), show_default=True,
+              help="maximum number of install steps run at the same time")
+@click.option("--use-kubectl", is_flag=True, default=False,
+              help="run cluster operations through kubectl/oc processes instead of the in-process client")
+@click.option("--trace", "trace_file", metavar="FILE", default='',
+              help="write a Chrome trace (chrome://tracing, Perfetto) of the steps, commands and waits to FILE")
+@click.option("--checkpoints", metavar="MODE", default="local", type=click.Choice(['local', 'cluster', 'off']), show_default=True,
+              help="record finished steps locally or also in a ConfigMap of the namespace, a re-run resumes after them")
+@click.option("--from-step", metavar="STEP", default='',
+              help="redo STEP and the steps after it even if they are recorded as done")
+@click.option("--force", is_flag=True, default=False,
+              help="redo every step, ignoring the recorded ones and the satisfied ones")
+@click.option("--preflight/--no-preflight", default=True, show_default=True,
+              help="validate every manifest with a server dry run before installing anything")
+@click.option("--olm-profile", metavar="PROFILE", default="auto", type=click.Choice(OLM_PROFILES), show_default=True,
+              help="resources of the OLM operators, auto picks the profile that fits the size of the catalogs")
+@click.option("--prepull/--no-prepull", default=True, show_default=True,
+              help="pull the operator images on every node while OLM and the catalog are set up")
+def install(namespace, storage, loglevel, verbose, openshift, manifest_source, workers, use_kubectl, trace_file, checkpoints, from_step, force,
+            preflight, olm_profile, prepull):
+    from openaihub import func
+    if verbose: loglevel = "info"
+    func.install(namespace, storage, loglevel, openshift, manifest_source, workers, use_kubectl, trace_file,
+                 checkpoints, from_step, force, preflight, olm_profile, prepull)
+
+@cli.command()
+@click.version_option(expose_value=False)
+@click.option("--namespace", "-e", metavar="NAMESPACE", default="operators", show_default=True,
+              help="namespace the applications were installed in")
+@click.option("--keep-olm", is_flag=True, default=False,
+              help="keep OLM, only the catalogs and operators of openaihub are deleted")
+@click.option("--keep-storage", is_flag=True, default=False,
+              help="keep the namespace with its PVCs and the default storageclass")
+@click.option("--loglevel", "-l", metavar="LOGLEVEL",default="error", type=click.Choice(['info', 'error', 'INFO', 'ERROR']), show_default=True,
+              help="logging level [info|error] for openaihub Python CLI")
+@click.option('--verbose', '-V', is_flag=True, default=False, help="print INFO message, same as setting --loglevel info")
+@click.option("--manifest-source", metavar="SOURCE", default='',
+              help="git ref, git url[#ref] or local directory to load the manifests from instead of the bundled ones")
+@click.option("--workers", "-w", metavar="N", default=4, type=click.IntRange(1), show_default=True,
+              help="maximum number of uninstall steps run at the same time")
+@click.option("--use-kubectl", is_flag=True, default=False,
+              help="run cluster operations through kubectl/oc processes instead of the in-process client")
+@click.option("--trace", "trace_file", metavar="FILE", default='',
+              help="write a Chrome trace (chrome://tracing, Perfetto) of the steps and deletions to FILE")
+@click.option("--timeout", metavar="SECONDS", default=600, type=click.IntRange(1), show_default=True,
+              help="time each object has to be gone, finalizers included")
+def uninstall(namespace, keep_olm, keep_storage, loglevel, verbose, manifest_source, workers, use_kubectl, trace_file, timeout):
+    """Delete what install and register created, in the reverse order."""
+    from openaihub import func
     if verbose: loglevel = "info"
-    func.install(namespace, storage, loglevel, openshift)
+    func.uninstall(namespace, loglevel, keep_olm, keep_storage, manifest_source, workers, use_kubectl, trace_file, timeout)
+
+@cli.command()
+@click.version_option(expose_value=False)
+@click.option("--profile", metavar="PROFILE", default="auto", type=click.Choice(OLM_PROFILES), show_default=True,
+              help="resources of the OLM operators, auto picks the profile that fits the size of the catalogs")
+@click.option("--dry-run", is_flag=True, default=False,
+              help="only print the sizes of the catalogs and the resources that would change")
+@click.option("--loglevel", "-l", metavar="LOGLEVEL", default="info", type=click.Choice(['info', 'error', 'INFO', 'ERROR']), show_default=True,
+              help="logging level [info|error] for openaihub Python CLI")
+@click.option("--manifest-source", metavar="SOURCE", default='',
+              help="git ref, git url[#ref] or local directory to load the manifests from instead of the bundled ones")
+@click.option("--use-kubectl", is_flag=True, default=False,
+              help="run cluster operations through kubectl/oc processes instead of the in-process client")
+def tune(profile, dry_run, loglevel, manifest_source, use_kubectl):
+    """Size the OLM operators for the catalogs installed now, e.g. after register."""
+    from openaihub import func
+    func.tune(loglevel, profile, dry_run, manifest_source, use_kubectl)
 
 @cli.command()
 @click.version_option(expose_value=False)
 @click.option("--openshift", metavar="PLATFORM", is_flag=True, default=False,
               help="install on openshift or others")
-@click.option("--operator", "-o", metavar="NAME", required=True,
-              help="name of the operator to be installed")
+@click.option("--operator", "-o", metavar="NAME", multiple=True,
+              help="name of the operator to be installed, can be repeated or comma separated")
+@click.option("--operators-file", metavar="FILE", default='',
+              help="yaml list of operators to be installed, each optionally with channel, source, sourceNamespace and startingCSV")
 @click.option("--subscription-file", "-f", metavar="FILE", default='', show_default=True,
-              help="file (with path) of the subscription for the operator")
+              help="file (with path) of the subscription for a single operator")
 @click.option("--logpath", metavar="PATH", default='',
               help="logging path")
 @click.option("--loglevel", "-l", metavar="LOGLEVEL",default="error", type=click.Choice(['info', 'error', 'INFO', 'ERROR']), show_default=True,
               help="logging level [info|error] for openaihub Python CLI")
 @click.option('--verbose', '-V', is_flag=True, default=False, help="print INFO message, same as setting --loglevel info")
-def install_operator(operator, subscription_file, logpath, loglevel, verbose, openshift):
+@click.option("--manifest-source", metavar="SOURCE", default='',
+              help="git ref, git url[#ref] or local directory to load the manifests from instead of the bundled ones")
+@click.option("--use-kubectl", is_flag=True, default=False,
+              help="run cluster operations through kubectl/oc processes instead of the in-process client")
+@click.option("--trace", "trace_file", metavar="FILE", default='',
+              help="write a Chrome trace (chrome://tracing, Perfetto) of the steps, commands and waits to FILE")
+def install_operator(operator, operators_file, subscription_file, logpath, loglevel, verbose, openshift, manifest_source, use_kubectl, trace_file):
+    from openaihub import func
     if logpath == '': logpath = os.getcwd()
     if verbose: loglevel = "info"
-    func.install_operator(operator.lower(), subscription_file, logpath, loglevel, openshift)
+    operators = [x.lower() for value in operator for x in value.split(",") if x]
+    if not operators and not operators_file:
+        raise UsageError("Missing option '--operator' or '--operators-file'.")
+    # a single operator keeps the single result of earlier versions
+    func.install_operator(operators[0] if len(operators) == 1 and not operators_file else operators, subscription_file,
+                          logpath, loglevel, openshift, manifest_source, use_kubectl, trace_file, operators_file)
+
+@cli.command(context_settings={"ignore_unknown_options": True, "allow_interspersed_args": False})
+@click.version_option(expose_value=False)
+@click.option("--context", "-c", metavar="NAME", multiple=True,
+              help="kubeconfig context to run on, can be repeated or comma separated")
+@click.option("--contexts-file", metavar="FILE", default='',
+              help="file with one kubeconfig context per line")
+@click.option("--all-contexts", is_flag=True, default=False,
+              help="run on every context of the kubeconfig")
+@click.option("--concurrency", "-j", metavar="N", default=4, type=click.IntRange(1), show_default=True,
+              help="maximum number of contexts worked on at the same time")
+@click.option("--logdir", metavar="PATH", default='',
+              help="directory for the log of each context [default: openaihub-fleet-<time>]")
+@click.option("--report", "report_file", metavar="FILE", default='',
+              help="also write the result of each context as json to FILE")
+@click.argument("command", type=click.Choice(["install", "install-operator", "register", "tune", "uninstall"]))
+@click.argument("args", nargs=-1, type=click.UNPROCESSED)
+def fleet(context, contexts_file, all_contexts, concurrency, logdir, report_file, command, args):
+    """Run install, install-operator, register, tune or uninstall with ARGS on many clusters.
+
+    \b
+    openaihub fleet -c prod-1,prod-2 -j 8 install --namespace kubeflow
+    """
+    from openaihub import func
+    from openaihub.func import fleet as fleet_
+    try:
+        contexts = fleet_.read_contexts(context, contexts_file, all_contexts)
+    except IOError as e:
+        raise UsageError("unable to read %s: %s" % (contexts_file, e))
+    if not contexts:
+        raise UsageError("no context given, use --context, --contexts-file or --all-contexts")
+    # the options of the command are checked once here rather than in every process
+    cli.commands[command].make_context(command, list(args))
+    func.run_fleet(command, args, contexts, concurrency, logdir, report_file)
+
+@cli.command()
+@click.version_option(expose_value=False)
+@click.option("--host", metavar="ADDRESS", default="127.0.0.1", show_default=True,
+              help="address to listen on, the API has no authentication")
+@click.option("--port", "-p", metavar="PORT", default=8765, type=click.IntRange(0, 65535), show_default=True,
+              help="port to listen on")
+@click.option("--per-cluster", metavar="N", default=1, type=click.IntRange(1), show_default=True,
+              help="maximum number of jobs running on the same context at the same time")
+@click.option("--max-workers", metavar="N", default=8, type=click.IntRange(1), show_default=True,
+              help="maximum number of worker processes over all contexts")
+@click.option("--logdir", metavar="PATH", default='',
+              help="directory for the logs of the workers and jobs [default: openaihub-serve]")
+def serve(host, port, per_cluster, max_workers, logdir):
+    """Run install, install_operator, register, tune and uninstall as jobs of a local HTTP API.
+
+    \b
+    curl -X POST localhost:8765/jobs -d '{"function": "register", "params": {"path": "/data/bundles", "operator": "my-operator"}}'
+    curl localhost:8765/jobs/<id>/events
+    """
+    from openaihub.func import serve as serve_
+    serve_.serve(host, port, per_cluster, max_workers, logdir)
@@ -14,454 +14,954 @@
 from __future__ import print_function
 import logging
 import sys
-import platform
 import subprocess
 import time
-from git import Repo
-import tempfile
 import os
-import tarfile
 import shutil
 import yaml
 import re
+import functools
+import threading
+from openaihub.func import dag
+from openaihub.func import readiness
+from openaihub.func import kube
+from openaihub.func import buildcache
+from openaihub.func import trace
+from openaihub.func import checkpoint
+from openaihub.func import render
+from openaihub.func import bundles
+from openaihub.func import catalog as catalogs
+from openaihub.func import sizing
+from openaihub.func import snapshot as snapshots
+from openaihub.func import teardown
+from openaihub.func import prepull as prepulls
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(stream=sys.stdout, level=logging.INFO)
 
-def find(pattern, path):
-    # pylint: disable=unused-variable
-    for root, dirs, files in os.walk(path):
-        for f in files:
-            if re.search(pattern, f) != None:
-                return os.path.join(root, f)
-
-def clone_repo():
-    # clone the icpd repo
-    openaihub_git_url = "https://github.com/adrian555/icpd.git"
-    tempdir = tempfile.mkdtemp()
-    basedir = os.path.join(tempdir, os.path.basename(openaihub_git_url))
-    Repo.clone_from(openaihub_git_url, basedir)
-    return(basedir)
-
-def run(cmd):
-    ret = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+def open_manifests(manifest_source):
+    # bundled manifests unless a git ref or a local directory is given
+    from openaihub.func import manifests
+    try:
+        return manifests.open_store(manifest_source)
+    except ValueError as e:
+        logger.error("Error: unable to load manifests from %s: %s" % (manifest_source, e))
+        sys.exit(1)
+
+def log_step(step, steps, description):
+    logger.info("### %s/%s ### %s" % (step, steps, description))
+    trace.step(description, step=step)
+
+def run(cmd, input=None):
+    with trace.span(cmd, "run") as span:
+        ret = subprocess.run(cmd, shell=True, input=input, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        span.args["returncode"] = ret.returncode
     logger.info("Command: %s, Returncode: %s" % (ret.args, ret.returncode))
     return(ret)
 
 def check_call(func, args):
-    ret = func(args)
+    with trace.span(args, "check_call") as span:
+        ret = func(args)
+        span.args["returncode"] = ret.returncode
     if ret.returncode != 0:
         logger.error("Command %s failed with Error: %s" % (args, ret.stderr.decode()), exc_info=1)
         sys.exit(ret.returncode)
 
+def _api_call_name(func, args):
+    # e.g. get apps/v1 Deployment olm-operator olm
+    return " ".join([func.__name__] + [x for x in args if isinstance(x, str)])
+
+def check_api(func, *args):
+    # check_call for cluster operations of the kube facade
+    with trace.span(_api_call_name(func, args), "api") as span:
+        try:
+            return func(*args)
+        except kube.ClusterError as e:
+            span.args["returncode"] = 1
+            logger.error("Error: %s" % e, exc_info=1)
+            sys.exit(1)
+
+def try_api(func, *args):
+    # run for cluster operations of the kube facade, failures are only logged
+    with trace.span(_api_call_name(func, args), "api") as span:
+        try:
+            return func(*args)
+        except kube.ClusterError as e:
+            span.args["returncode"] = 1
+            logger.info("Ignored error: %s" % e)
+
+def install_config(kube_version):
+    # ConfigMap to set the kubectl client version for operators
+    return {"apiVersion": "v1", "kind": "ConfigMap", "metadata": {"name": "openaihub-install-config", "namespace": "operators"},
+            "data": {"KUBECTL_VERSION": kube_version}}
+
+def ensure_install_config(cluster):
+    # applied rather than created, a run at the same time may have created it since the get
+    if not cluster.exists("v1", "ConfigMap", "openaihub-install-config", "operators"):
+        check_api(cluster.apply, [install_config(check_api(cluster.server_version))])
+
+def package_index():
+    # the packagemanifests are read and watched in the namespace of the in-process client
+    from openaihub.func import packages
+    return packages.index(kube.api().default_namespace)
+
 def wait_for(operator, namespace):
-    # exit after 600 seconds
-    # pylint: disable=unused-variable
-    for x in range(40):
-        if run("kubectl rollout status deployment/%s-operator -n %s" % (operator, namespace)).returncode != 0:
-            time.sleep(15)
-        else:
-            break
-        
-def check_installed(namespace):
-    from kubernetes import client, config
-    from openshift.dynamic import DynamicClient
-    k8s_client = config.new_client_from_config()
-    dyn_client = DynamicClient(k8s_client)
-    csv = dyn_client.resources.get(api_version='operators.coreos.com/v1alpha1', kind='ClusterServiceVersion')
-    csv_list = csv.get(namespace=namespace)
-    for x in csv_list.items:
-        print(x.metadata.name)
+    # give up after 600 seconds
+    return readiness.wait(readiness.DeploymentAvailable("%s-operator" % operator, namespace), timeout=600)
         
-def install_operator(operator, subscription_file, logpath, loglevel, openshift):
+def check_installed(namespace, all_namespaces=False, output="name", watch=False):
+    # namespace is one namespace or a list of them; the shared client reuses the cached discovery
+    from openaihub.func import installed
+    namespaces = [namespace] if isinstance(namespace, str) else list(namespace)
+    printer = installed.Printer(output, events=watch)
+    if watch:
+        installed.watch_installed(namespaces, all_namespaces, printer)
+        return
+    printer.print(check_api(installed.list_installed, kube.api(), namespaces, all_namespaces))
+
+def run_fleet(command, args, contexts, concurrency=4, logdir='', report_file=''):
+    # the command on every context, exits non-zero when it failed on any of them
+    from openaihub.func import fleet
+    start = time.time()
+    results = fleet.run(contexts, command, args, concurrency, logdir)
+    elapsed = time.time() - start
+    fleet.print_report(results, elapsed)
+    if report_file:
+        fleet.write_report(report_file, results, elapsed)
+    if any(x["returncode"] != 0 for x in results):
+        sys.exit(1)
+    return results
+
+def install_operator(operator, subscription_file, logpath, loglevel, openshift, manifest_source='', use_kubectl=False, trace_file='',
+                     operators_file=''):
+    with trace.export(trace_file):
+        return _install_operator(operator, subscription_file, logpath, loglevel, openshift, manifest_source, use_kubectl, operators_file)
+
+def read_operators_file(path):
+    # a yaml list of operator names or {name, channel, source, sourceNamespace, startingCSV}
+    # entries, or a mapping from the operator name to those overrides
+    with open(path) as f:
+        content = yaml.safe_load(f) or []
+    if isinstance(content, dict):
+        content = [dict(v or {}, name=k) for k, v in content.items()]
+    operators = []
+    for x in content:
+        x = {"name": x} if isinstance(x, str) else dict(x)
+        operators.append((str(x.pop("name")).lower(), x))
+    return operators
+
+def _install_operator(operator, subscription_file, logpath, loglevel, openshift, manifest_source='', use_kubectl=False,
+                      operators_file=''):
     logger.setLevel(loglevel.upper())
-    logger.addHandler(logging.FileHandler(os.path.join(logpath, "openaihub-%s.log" % operator)))
 
-    # clone repo
-    basedir = clone_repo()
+    # one operator as before, or many with optional overrides, all installed together
+    requested = [(x, {}) for x in ([operator] if isinstance(operator, str) else operator)]
+    if operators_file:
+        try:
+            requested += read_operators_file(operators_file)
+        except (IOError, yaml.YAMLError, KeyError, TypeError, AttributeError) as e:
+            logger.error("Error: unable to read the operators from %s: %s" % (operators_file, e))
+            sys.exit(1)
+    if not requested:
+        logger.error("Error: no operator given.")
+        sys.exit(1)
+    if subscription_file and len(requested) > 1:
+        logger.error("Error: a subscription file can only be given for a single operator.")
+        sys.exit(1)
+    names = [x for x, _ in requested]
+
+    if logpath:
+        logger.addHandler(logging.FileHandler(os.path.join(logpath, "openaihub-%s.log" % (names[0] if len(names) == 1 else "operators"))))
+
+    kube.configure(shell=use_kubectl)
+    cluster = kube.cluster()
 
-    steps = 8
+    # templates are rendered in memory, the manifests are read in place
+    basedir = open_manifests(manifest_source).root
 
-    # check whether the operator is registered
+    steps = 3
+
+    # check whether the operators are registered, from the packagemanifest index
     step = 1
-    logger.info("### %s/%s ### Check if the operator is registered..." % (step, steps))
-    check_call(run, "kubectl get packagemanifest %s" % operator)
+    log_step(step, steps, "Check if the operators are registered...")
+    packages = check_api(package_index().lookup, cluster, names)
+    missing = [x for x in names if packages[x] is None]
+    if missing:
+        logger.error("Error: the operator %s is not registered." % ", ".join(missing))
+        sys.exit(1)
 
-    # generate subscription file if not provided
+    # generate the subscriptions from the details of the operators if not provided
     if subscription_file == '':
-        subscription_path = "%s/src/registry/subscription" % basedir
-        subscription_file = os.path.join(subscription_path, operator + ".yaml")
-        run("sed 's/OPERATOR/%s/g' %s/template.yaml > %s" % (operator, subscription_path, subscription_file))
-
-        # retrieve details of this operator
-        run("kubectl get packagemanifest %s -o yaml > %s/%s.package.yaml" % (operator, subscription_path, operator))
-        package_yaml = yaml.safe_load(open("%s/%s.package.yaml" % (subscription_path, operator)))
-        channel = package_yaml['status']['channels'][0]['name']
-        package_name = package_yaml['status']['packageName']
-        source = package_yaml['status']['catalogSource']
-        run("sed -i %s 's/CHANNEL/%s/' %s" % ("''" if platform.system() == 'Darwin' else '', channel, subscription_file))
-        run("sed -i %s 's/PACKAGE/%s/' %s" % ("''" if platform.system() == 'Darwin' else '', package_name, subscription_file))
-        run("sed -i %s 's/SOURCE/%s/' %s" % ("''" if platform.system() == 'Darwin' else '', source, subscription_file))
-
-    # install the operator
+        subscriptions = []
+        for name, overrides in requested:
+            package = packages[name]
+            docs = render.render("%s/registry/subscription/template.yaml" % basedir, {
+                "OPERATOR": name,
+                "CHANNEL": overrides.get("channel") or package['channels'][0]['name'],
+                "PACKAGE": package['packageName'],
+                "SOURCE": overrides.get("source") or package['catalogSource']})
+            for doc in docs:
+                doc["spec"].update((k, overrides[k]) for k in ["sourceNamespace", "startingCSV"] if k in overrides)
+            subscriptions += docs
+    else:
+        subscriptions = render.load(subscription_file)
+
+    # the CSV each subscription resolves to: its starting CSV or the head of its channel
+    csvs = []
+    errors = []
+    for doc in subscriptions:
+        spec = doc["spec"]
+        channels = dict((x["name"], x["currentCSV"]) for x in (package_index().get(spec["name"]) or {}).get("channels", []))
+        if spec.get("channel") not in channels:
+            errors.append("channel %s not found for operator %s" % (spec.get("channel"), spec["name"]))
+        csvs.append(spec.get("startingCSV") or channels.get(spec.get("channel")))
+    if errors:
+        for x in errors:
+            logger.error("Error: %s" % x)
+        sys.exit(1)
+
+    # install the operators
     step += 1
-    logger.info("### %s/%s ### Install the operator..." % (step, steps))
-    
-    # create ConfigMap to set the kubectl client version for operators
-    if run("kubectl get configmap openaihub-install-config -n operators").returncode != 0:
-        kube_version = run("kubectl version --short|grep Server|awk '{ print $3;exit}'|cut -d'+' -f1").stdout.decode().rstrip()
-        check_call(run, "kubectl create configmap openaihub-install-config --from-literal=KUBECTL_VERSION=%s -n operators" % kube_version)
+    log_step(step, steps, "Install the operators...")
 
-    check_call(run, "kubectl apply -f %s" % subscription_file)
+    ensure_install_config(cluster)
 
-    # remove temp
-    shutil.rmtree(basedir, ignore_errors=True)
+    check_api(cluster.apply, subscriptions)
+
+    # wait for all the CSVs with one watch
+    step += 1
+    log_step(step, steps, "Wait for the operators to be installed...")
+    namespace = subscriptions[0]["metadata"].get("namespace", "operators")
+    if not readiness.wait(readiness.CSVsSucceeded(namespace, [x for x in csvs if x]), timeout=600):
+        logger.error("Error: the operators %s were not installed." % ", ".join(names))
+        sys.exit(1)
 
     logger.info("Done.")
 
-    return CompletedOperator(operator, 0)
+    if isinstance(operator, str) and len(names) == 1:
+        return CompletedOperator(operator, 0)
+    return [CompletedOperator(x, 0) for x in names]
 
 class CompletedOperator:
     def __init__(self, operator_name, returncode):
         self.operator_name = operator_name
         self.returncode = returncode
 
-def register(path, operator, logpath, loglevel, openshift):
-    logger.setLevel(loglevel.upper())
-
-    logger.addHandler(logging.FileHandler(os.path.join(logpath, "openaihub-%s.log" % operator)))
+def find_bundles(path, operators):
+    # a single <operator>.tgz, the named <operator>.tgz files in a directory or all of them
+    if os.path.isfile(path):
+        return [(re.sub(r"\.(tgz|tar\.gz)$", "", os.path.basename(path)).lower(), path)]
+    if operators:
+        return [(x, os.path.join(path, x + ".tgz")) for x in operators]
+    if not os.path.isdir(path):
+        return []
+    return [(x[:-len(".tgz")].lower(), os.path.join(path, x)) for x in sorted(os.listdir(path)) if x.endswith(".tgz")]
+
+def read_bundles(bundles, prefix=''):
+    # reads and validates every bundle, streamed from its tgz; returns the operator (deployment) names,
+    # the contents and the package names, or reports every invalid bundle at once and exits
+    operator_names = []
+    contents = []
+    packages = dict()
+    errors = []
+    for name, tgz in bundles:
+        try:
+            content = catalogs.read_bundle(tgz, "%s/%s" % (prefix, name) if prefix else '')
+            operator_names.append(catalogs.validate(tgz, content))
+            contents.append(content)
+            for x in content[catalogs.PACKAGES]:
+                if x["packageName"] in packages:
+                    errors.append("the package %s is in both %s and %s" % (x["packageName"], packages[x["packageName"]], tgz))
+                packages[x["packageName"]] = tgz
+        except ValueError as e:
+            errors.append(str(e))
+    if errors:
+        for x in errors:
+            logger.error("Error: %s" % x)
+        sys.exit(1)
+    return operator_names, contents, list(packages)
 
-    # clone repo
-    basedir = clone_repo()
+def register(path, operator, logpath, loglevel, openshift, manifest_source='', use_kubectl=False, catalog='', build_cache="local", trace_file='',
+             catalog_mode="image"):
+    with trace.export(trace_file):
+        return _register(path, operator, logpath, loglevel, openshift, manifest_source, use_kubectl, catalog, build_cache, catalog_mode)
 
-    steps = 8
+def _register(path, operator, logpath, loglevel, openshift, manifest_source='', use_kubectl=False, catalog='', build_cache="local",
+              catalog_mode="image"):
+    logger.setLevel(loglevel.upper())
 
-    # unpack operator tgz files to src/registry/operators
-    step = 1
-    logger.info("### %s/%s ### Unpack operator tgz..." % (step, steps))
-    kaniko_path = os.path.join(basedir, "src/registry/kaniko")
-    operator_path = os.path.join(kaniko_path, "operators", operator)
-    os.makedirs(operator_path, exist_ok=True)
-    tf = tarfile.open(os.path.join(path, operator + ".tgz"), "r:gz")
-    tf.extractall(operator_path)
-
-    # search for clusterserviceversion yaml file and get operator name
-    csv_yaml = find("clusterserviceversion.yaml", operator_path)
-    if csv_yaml == None:
-        logger.error("Error: the file %s/%s.tgz does not contain valid operator." % (path, operator))
+    # one or many bundles, all of them are built into one catalog image
+    bundles = find_bundles(path, [operator] if isinstance(operator, str) else operator)
+    if not bundles:
+        logger.error("Error: no operator bundle (.tgz) found in %s." % path)
         sys.exit(1)
-    csv_parsed = yaml.safe_load(open(csv_yaml))
-    operator_name = csv_parsed['spec']['install']['spec']['deployments'][0]['name']
+    catalog = catalog or (bundles[0][0] if len(bundles) == 1 else "custom")
 
-    # create context.tgz
-    step += 1
-    logger.info("### %s/%s ### Create build-context..." % (step, steps))
-    kaniko_tgz = os.path.join(basedir, "kaniko.tgz")
-    tf = tarfile.open(kaniko_tgz, "w:gz")
-    tf.add(os.path.join(kaniko_path, "Dockerfile"), arcname="Dockerfile")
-    tf.add(os.path.join(kaniko_path, "operators"), arcname="operators")
-    tf.close()
+    logger.addHandler(logging.FileHandler(os.path.join(logpath, "openaihub-%s.log" % catalog)))
 
-    # create docker-config ConfigMap
-    step += 1
-    logger.info("### %s/%s ### Create docker config..." % (step, steps))
-    if run("kubectl get configmap docker-config").returncode != 0:
-        check_call(run, "kubectl create configmap docker-config --from-file=%s/config.json" % kaniko_path)
+    kube.configure(shell=use_kubectl)
+    cluster = kube.cluster()
 
-    # modify kaniko.yaml with operator destination
-    step += 1
-    kaniko_pod = "kaniko-" + operator
-    logger.info("### %s/%s ### Create kaniko pod..." % (step, steps))
-    run("sed -i %s 's/IMAGETAG/docker.io\/ffdlops\/%s-catalog:v0.0.1/' %s/kaniko.yaml" % ("''" if platform.system() == 'Darwin' else '', operator, kaniko_path))
-    run("sed -i %s 's/OPERATOR/%s/' %s/kaniko.yaml" % ("''" if platform.system() == 'Darwin' else '', operator, kaniko_path))
+    if catalog_mode == "configmap":
+        operator_names = register_configmap(cluster, bundles, catalog, manifest_source)
+    else:
+        operator_names = register_image(cluster, bundles, catalog, manifest_source, build_cache)
 
-    # create kaniko pod
-    check_call(run, "kubectl apply -f %s/kaniko.yaml" % kaniko_path)
+    logger.info("Done.")
 
-    # wait for the pod to be ready
-    time.sleep(60)
+    if isinstance(operator, str):
+        return CompletedOperator(operator_names[0], 0)
+    return [CompletedOperator(x, 0) for x in operator_names]
 
-    # copy build context to kaniko container
-    step += 1
-    logger.info("### %s/%s ### Set up kaniko job..." % (step, steps))
-    run("kubectl cp %s %s:/tmp/context.tar.gz -c kaniko-init" % (kaniko_tgz, kaniko_pod))
-    run("kubectl exec %s -c kaniko-init -- tar -zxf /tmp/context.tar.gz -C /kaniko/build-context" % kaniko_pod)
-    run("kubectl exec %s -c kaniko-init -- touch /tmp/complete" % kaniko_pod)
+def register_configmap(cluster, bundles, catalog, manifest_source=''):
+    # the bundles are read in memory and served by OLM from a configmap, no image is built or pulled
+    steps = 3
 
-    # now wait for the image to be built and ready
-    step += 1
-    logger.info("### %s/%s ### Wait for the image to be ready..." % (step, steps))
-    # pylint: disable=unused-variable
-    for x in range(40):
-        if run("kubectl get pod/%s|grep %s|awk '{ print $3;exit}'" % (kaniko_pod, kaniko_pod)).stdout.decode() != "Completed\n" :
-            time.sleep(15)
-        else:
-            break
+    step = 1
+    log_step(step, steps, "Read operator tgz...")
+    operator_names, contents, packages = read_bundles(bundles)
+    configmap_name = "%s-catalog" % catalog
+    try:
+        configmap = catalogs.configmap(configmap_name, "olm", contents)
+    except ValueError as e:
+        logger.error("Error: %s" % e)
+        sys.exit(1)
 
-    # delete the kaniko pod
+    # the configmap and its catalog source in one apply
     step += 1
-    logger.info("### %s/%s ### Delete the kaniko pod..." % (step, steps))
-    run("kubectl delete -f %s/kaniko.yaml" % kaniko_path)
+    log_step(step, steps, "Deploy the catalog...")
+    basedir = open_manifests(manifest_source).root
+    check_api(cluster.apply, [configmap] + render.render("%s/registry/catalog_source/configmap.catalogsource.yaml" % basedir,
+                                                         {"REPLACE_OPERATOR": catalog, "REPLACE_CONFIGMAP": configmap_name}))
 
-    # generate catalog source yaml
     step += 1
-    logger.info("### %s/%s ### Deploy the catalog..." % (step, steps))
-    run("sed -i %s 's/REPLACE_OPERATOR/%s/' %s/catalogsource.yaml" % ("''" if platform.system() == 'Darwin' else '', operator, kaniko_path))
-    run("sed -i %s 's/REPLACE_IMAGE/docker.io\/ffdlops\/%s-catalog:v0.0.1/' %s/catalogsource.yaml" % ("''" if platform.system() == 'Darwin' else '', operator, kaniko_path))
+    log_step(step, steps, "Wait for the packagemanifests...")
+    package_index().wait(lambda index: all(x in index.packages for x in packages),
+                         "packagemanifests %s" % ", ".join(packages), timeout=600)
+    return operator_names
 
-    # deploy the catalog
-    check_call(run, "kubectl apply -f %s/catalogsource.yaml" % kaniko_path)
+def register_image(cluster, bundles, catalog, manifest_source='', build_cache="local"):
+    # the manifests are read in place, the bundles are never unpacked to disk
+    basedir = open_manifests(manifest_source).root
 
-    # wait until the operator is showing in the packagemanifest
-    # pylint: disable=unused-variable
-    for x in range(40):
-        if run("kubectl get packagemanifest %s" % operator_name).returncode != 0 :
-            time.sleep(15)
-        else:
-            break
-
-    # remove temp
-    shutil.rmtree(basedir, ignore_errors=True)
+    steps = 7
 
-    logger.info("Done.")
-
-    return CompletedOperator(operator_name, 0)
-
-def install(namespace, storage, loglevel, openshift):
-    logger.setLevel(loglevel.upper())
-
-    # clone repo
-    basedir = clone_repo()
-    
-    steps = 14 if storage == "nfs" else 13
-
-    # prereq: helm must be installed already
-    # init helm tiller service account
+    # read the operator tgz files as streams, as they would be laid out in registry/kaniko/operators
     step = 1
-    logger.info("### %s/%s ### Init helm tiller..." % (step, steps))
-    run("kubectl apply -f %s/src/requirement/helm-tiller.yaml" % basedir)
-    run("helm init --service-account tiller --upgrade")
-
-    openaihub_namespace = namespace
-    openaihub_catalog_path = "%s/src/registry/catalog_source" % basedir
-    openaihub_subscription_path = "%s/src/registry/subscription" % basedir
-    openaihub_cr_path = "%s/src/registry/cr_samples" % basedir
-    openaihub_patch_path = "%s/src/patch" %basedir
+    log_step(step, steps, "Read operator tgz...")
+    kaniko_path = os.path.join(basedir, "registry/kaniko")
+    operator_names, contents, packages = read_bundles(bundles, "operators")
+
+    # the image is tagged with the hash of its build context, unchanged bundles reuse the pushed image
+    dockerfile = os.path.join(kaniko_path, "Dockerfile")
+    context_key = buildcache.digests_hash([("Dockerfile", buildcache.file_digest(dockerfile))] +
+                                          [x for content in contents for x in content[catalogs.DIGESTS]])
+    image = "docker.io/ffdlops/%s-catalog:%s" % (catalog, buildcache.image_tag(context_key))
+    cache = buildcache.BuildCache(cluster, configmap=build_cache == "cluster")
+    entry = cache.lookup(context_key) if build_cache != "off" else None
+    if entry is not None:
+        logger.info("The build context %s was built before as %s, skipping the build." % (context_key, buildcache.image_reference(entry)))
+        step = steps - 1
+    else:
+        entry = build_catalog_image(cluster, cache, context_key, image, kaniko_path, bundles, catalog, step, steps)
+        step = steps - 1
 
-    # install OLM
+    # deploy the catalog
     step += 1
-    logger.info("### %s/%s ### Install OLM if not installed..." % (step, steps))
-    olm_operator_status = run("kubectl rollout status deployment/olm-operator -n olm").returncode
-    catalog_operator_status = run("kubectl rollout status deployment/catalog-operator -n olm").returncode
-    if olm_operator_status != 0 or catalog_operator_status != 0:
-        olm_version = "0.11.0"
-        import wget
-        wget.download("https://github.com/operator-framework/operator-lifecycle-manager/releases/download/%s/install.sh" % olm_version, out="%s/install.sh" % basedir)
-        run("bash %s/install.sh %s" % (basedir, olm_version))
-        wait_for("olm", "olm")
-        wait_for("catalog", "olm")
-        
-        # TODO: investigate the memory increase problem in OLM and provide proper fix, for now, limit the memory
-        check_call(run, "kubectl patch deployment olm-operator --patch \"$(cat %s/olm-patch.yaml)\" -n olm" % openaihub_patch_path)
-        check_call(run, "kubectl patch deployment catalog-operator --patch \"$(cat %s/catalog-patch.yaml)\" -n olm" % openaihub_patch_path)
+    log_step(step, steps, "Deploy the catalog...")
+    check_api(cluster.apply, render.render(os.path.join(kaniko_path, "catalogsource.yaml"),
+                                           {"REPLACE_OPERATOR": catalog, "REPLACE_IMAGE": buildcache.image_reference(entry)}))
 
-        # install olm-console
-        run("kubectl apply -f %s/src/requirement/olm-console.yaml" % basedir)
-    else:
-        logger.info("OLM already exists.")
+    # wait until the packages are showing in the packagemanifest, all with one watch
+    package_index().wait(lambda index: all(x in index.packages for x in packages),
+                         "packagemanifests %s" % ", ".join(packages), timeout=600)
+    return operator_names
 
-    # add openaihub catalog
+def build_catalog_image(cluster, cache, context_key, image, kaniko_path, bundles, catalog, step, steps):
+    # create docker-config ConfigMap
     step += 1
-    logger.info("### %s/%s ### Add OpenAIHub operators catalog..." % (step, steps))
-    check_call(run, "kubectl apply -f %s/openaihub.catalogsource.yaml" % openaihub_catalog_path)
-    # pylint: disable=unused-variable
-    for x in range(40):
-        if run("kubectl get packagemanifest|grep OpenAIHub|wc -l").stdout.decode().lstrip().rstrip() != "5":
-            time.sleep(15)
-        else:
-            break
+    log_step(step, steps, "Create docker config...")
+    if not cluster.exists("v1", "ConfigMap", "docker-config"):
+        with open(os.path.join(kaniko_path, "config.json")) as f:
+            check_api(cluster.create_configmap, "docker-config", None, {"config.json": f.read()})
 
-    # create namespace
+    # create the kaniko pod with the operator destination
     step += 1
-    logger.info("### %s/%s ### Create namespace and add cluster admin..." % (step, steps))
-    if run("kubectl get namespace %s" % openaihub_namespace).returncode != 0:
-        if openshift:
-            check_call(run, "oc new-project %s" % openaihub_namespace)
-        else:
-            check_call(run, "kubectl create namespace %s" % openaihub_namespace)
+    kaniko_pod = "kaniko-" + catalog
+    log_step(step, steps, "Create kaniko pod...")
+    check_api(cluster.apply, render.render(os.path.join(kaniko_path, "kaniko.yaml"), {"IMAGETAG": image, "OPERATOR": catalog}))
 
-    # add cluster-admin to default service account for registration and installation of other operators
-    if run("kubectl get clusterrolebinding add-on-cluster-admin-openaihub").returncode != 0:
-        if openshift:
-            check_call(run, "oc adm policy add-cluster-role-to-user cluster-admin -z default")
-        else:
-            check_call(run, "kubectl create clusterrolebinding add-on-cluster-admin-openaihub --clusterrole=cluster-admin --serviceaccount=%s:default" % openaihub_namespace)
+    # stream the build context into the init container as soon as it runs
+    step += 1
+    log_step(step, steps, "Send build-context to kaniko...")
+    if not readiness.wait(readiness.ContainerRunning(kube.api().default_namespace, kaniko_pod, "kaniko-init"), timeout=600):
+        logger.error("Error: the kaniko pod %s did not start" % kaniko_pod)
+        sys.exit(1)
 
-    # create ConfigMap to set the kubectl client version for operators
-    if run("kubectl get configmap openaihub-install-config -n operators").returncode != 0:
-        kube_version = run("kubectl version --short|grep Server|awk '{ print $3;exit}'|cut -d'+' -f1").stdout.decode().rstrip()
-        check_call(run, "kubectl create configmap openaihub-install-config --from-literal=KUBECTL_VERSION=%s -n operators" % kube_version)
+    def send_context(stdin):
+        # the archive is gzipped on the fly, the bundle members are copied over from their tgz
+        # stream to stream, nothing is written to disk
+        import tarfile
+        with tarfile.open(fileobj=stdin, mode="w|gz") as tf:
+            tf.add(os.path.join(kaniko_path, "Dockerfile"), arcname="Dockerfile")
+            for name, tgz in bundles:
+                catalogs.copy_bundle(tgz, tf, "operators/%s" % name)
 
-    # special handling for openshift
-    if openshift:
-        run("oc adm policy add-scc-to-user privileged -z default")
-        run("oc adm policy add-scc-to-user anyuid -z ambassador")
-        run("oc adm policy add-scc-to-user anyuid -z default")
-        run("oc adm policy add-scc-to-group anyuid system:authenticated")
-        run("oc adm policy add-scc-to-group privileged system:serviceaccounts:kubeflow")
+    # release the init container even if the context is broken, kaniko then fails right away
+    check_api(cluster.exec_stdin, kaniko_pod, "kaniko-init",
+              ["sh", "-c", "tar -zxf - -C /kaniko/build-context; rc=$?; touch /tmp/complete; exit $rc"], send_context)
 
-    # create jupyterlab operator
+    # now wait for the image to be built and ready
     step += 1
-    logger.info("### %s/%s ### Deploy Jupyterlab operator..." % (step, steps))
-    check_call(run, "kubectl apply -f %s/%s-operator.yaml" % (openaihub_subscription_path, "jupyterlab"))
+    log_step(step, steps, "Wait for the image to be ready...")
+    if not readiness.wait(readiness.PodPhase(kube.api().default_namespace, "Succeeded", name=kaniko_pod), timeout=600):
+        logger.error("Error: the catalog image for %s was not built, see kubectl logs %s -c kaniko" % (catalog, kaniko_pod))
+        sys.exit(1)
+    entry = cache.record(context_key, image, buildcache.pod_digest(check_api(cluster.get, "v1", "Pod", kaniko_pod)))
 
-    # wait until jupyterlab operator is available
+    # delete the kaniko pod
     step += 1
-    logger.info("### %s/%s ### Wait until Jupyterlab operator is available..." % (step, steps))
-    wait_for("jupyterlab", "operators")
+    log_step(step, steps, "Delete the kaniko pod...")
+    try_api(cluster.delete, "v1", "Pod", kaniko_pod)
+
+    return(entry)
+
+def size_olm(cluster, patch_path, profile="auto", dry_run=False):
+    # patch the OLM deployments with the resources of the profile that fits the catalogs they serve,
+    # returns the profile name and whether anything changed
+    counts = check_api(sizing.measure, cluster, package_index())
+    try:
+        name, resources = sizing.profile(counts, profile)
+    except ValueError as e:
+        logger.error("Error: %s" % e)
+        sys.exit(1)
+    logger.info("Catalogs: %s packages, %s bundles, %s CRDs, profile %s" % (counts["packages"], counts["bundles"], counts["crds"], name))
+    changed = False
+    for x in sizing.OPERATORS:
+        old = check_api(sizing.current, cluster, x)
+        if old is None:
+            logger.info("Deployment %s not found, not sized." % x)
+            continue
+        if not sizing.changed(old, resources[x]):
+            logger.info("%s: %s, unchanged" % (x, sizing.describe(old)))
+            continue
+        logger.info("%s: %s, was %s" % (x, sizing.describe(resources[x]), sizing.describe(old)))
+        changed = True
+        if not dry_run:
+            check_api(cluster.patch, "apps/v1", "Deployment", x,
+                      render.render("%s/%s-patch.yaml" % (patch_path, x.split("-")[0]), sizing.params(resources[x]))[0], "olm")
+    return name, changed
+
+def tune(loglevel, profile="auto", dry_run=False, manifest_source='', use_kubectl=False):
+    logger.setLevel(loglevel.upper())
 
-    # create jupyterlab cr
-    step += 1
-    logger.info("### %s/%s ### Create Jupyterlab deployment..." % (step, steps))
-    check_call(run, "kubectl apply -f %s/openaihub_v1alpha1_%s_cr.yaml -n %s" % (openaihub_cr_path, "jupyterlab", openaihub_namespace))
+    kube.configure(shell=use_kubectl)
+    cluster = kube.cluster()
+    basedir = open_manifests(manifest_source).root
 
-    # switch default storageclass to nfs-dynamic
-    if not openshift:
-        if storage == "nfs":
-            step += 1
-            logger.info("### %s/%s ### Wait for nfs-dynamic storageclass to be ready and set as default..." % (step, steps))
-            # pylint: disable=unused-variable
-            for x in range(40):
-                if run("kubectl get storageclass |grep nfs-dynamic").stdout.decode() == '':
-                    time.sleep(15)
-                else:
-                    break
-            run("kubectl patch storageclass ibmc-file-bronze -p '{\"metadata\": {\"annotations\":{\"storageclass.kubernetes.io/is-default-class\":\"false\"}}}'")
-            check_call(run, "kubectl patch storageclass nfs-dynamic -p '{\"metadata\": {\"annotations\":{\"storageclass.kubernetes.io/is-default-class\":\"true\"}}}'")
-
-    # create pipelines operator
-    step += 1
-    logger.info("### %s/%s ### Deploy Pipelines operator..." % (step, steps))
-    check_call(run, "kubectl apply -f %s/%s-operator.yaml" % (openaihub_subscription_path, "pipelines"))
+    steps = 2
 
-    # wait until pipelines operator is available
-    step += 1
-    logger.info("### %s/%s ### Wait until Pipelines operator is available..." % (step, steps))
-    wait_for("pipelines", "operators")
+    step = 1
+    log_step(step, steps, "Size the OLM deployments for the catalogs...")
+    name, changed = size_olm(cluster, "%s/patch" % basedir, profile, dry_run)
 
-    # create pipelines cr
     step += 1
-    logger.info("### %s/%s ### Create Pipelines deployment..." % (step, steps))
-    check_call(run, "kubectl apply -f %s/openaihub_v1alpha1_%s_cr.yaml -n %s" % (openaihub_cr_path, "pipelines", openaihub_namespace))
+    log_step(step, steps, "Wait for the OLM deployments to roll out...")
+    if changed and not dry_run:
+        wait_for("olm", "olm")
+        wait_for("catalog", "olm")
 
-    if openshift:
-        # pylint: disable=unused-variable
-        for x in range(80):
-            if run("oc get pods -o=jsonpath='{range .items[*]}{@.metadata.name}{\" \"}{@.status.phase}{\"\\n\"}' |grep argo-ui|cut -d' ' -f2").stdout.decode().rstrip() != "Running" :
-                time.sleep(15)
-            else:
-                break
-        run("oc adm policy add-scc-to-user anyuid -z pipeline-runner")
-        run("oc adm policy add-cluster-role-to-user cluster-admin -z pipeline-runner")
-        
-        run("oc get clusterrole argo -o yaml > %s/argo.yaml" % openaihub_patch_path)
-        argo_patch(os.path.join(openaihub_patch_path, "argo.yaml"))
-        run("oc apply -f %s/argo.yaml" % openaihub_patch_path)
+    logger.info("Done.")
+    return name
+
+# the operators install deploys, in the order of their steps
+OPERATORS = [("jupyterlab", "Jupyterlab"), ("pipelines", "Pipelines"), ("openaihub", "OpenAIHub"), ("kubeflow", "Kubeflow")]
+
+def install_files(basedir):
+    # the manifest files of install: helm, the catalog, and the subscription and CR of each operator
+    registry = "%s/registry" % basedir
+    return {"helm": "%s/requirement/helm-tiller.yaml" % basedir,
+            "catalog": "%s/catalog_source/openaihub.catalogsource.yaml" % registry,
+            "subscriptions": dict((x, "%s/subscription/%s-operator.yaml" % (registry, x)) for x, _ in OPERATORS),
+            "crs": dict((x, "%s/cr_samples/openaihub_v1alpha1_%s_cr.yaml" % (registry, x)) for x, _ in OPERATORS)}
+
+def install_phases(files, namespace, openshift, config):
+    # (name, documents) of each phase of install, shared with uninstall
+    phases = [("helm", render.load(files["helm"])),
+              ("catalog", render.load(files["catalog"])),
+              ("namespace", bundles.namespace_bundle(namespace, openshift, config)),
+              ("subscriptions", [x for operator, _ in OPERATORS for x in render.load(files["subscriptions"][operator])])]
+    phases += [("%s-cr" % operator, bundles.in_namespace(render.load(files["crs"][operator]), namespace))
+               for operator, _ in OPERATORS]
+    return phases
+
+def install(namespace, storage, loglevel, openshift, manifest_source='', workers=4, use_kubectl=False, trace_file='',
+            checkpoints="local", from_step='', force=False, preflight=True, olm_profile="auto", prepull=True):
+    with trace.export(trace_file):
+        return _install(namespace, storage, loglevel, openshift, manifest_source, workers, use_kubectl, checkpoints, from_step, force,
+                        preflight, olm_profile, prepull)
+
+def _install(namespace, storage, loglevel, openshift, manifest_source='', workers=4, use_kubectl=False,
+             checkpoints="local", from_step='', force=False, preflight=True, olm_profile="auto", prepull=True):
+    logger.setLevel(loglevel.upper())
 
-        run("oc get deployment minio -o yaml > %s/minio.yaml" % openaihub_patch_path)
-        run("sed -i '/subPath: minio/d' %s/minio.yaml" % openaihub_patch_path)
-        run("oc apply -f %s/minio.yaml" % openaihub_patch_path)
+    kube.configure(shell=use_kubectl)
+    cluster = kube.cluster()
 
-    # create openaihub operator
-    step += 1
-    logger.info("### %s/%s ### Deploy OpenAIHub operator..." % (step, steps))
-    check_call(run, "kubectl apply -f %s/%s-operator.yaml" % (openaihub_subscription_path, "openaihub"))
+    # templates and patches are applied from memory, the manifests are read in place
+    basedir = open_manifests(manifest_source).root
 
-    # wait until openaihub operator is available
-    step += 1
-    logger.info("### %s/%s ### Wait until OpenAIHub operator is available..." % (step, steps))
-    wait_for("openaihub", "operators")
+    openaihub_namespace = namespace
+    openaihub_patch_path = "%s/patch" %basedir
+
+    # the manifests of each phase are one bundle, applied with one cluster.apply
+    operators = OPERATORS
+    files = install_files(basedir)
+    helm_file = files["helm"]
+    catalog_file = files["catalog"]
+    subscription_file = files["subscriptions"].get
+    cr_file = files["crs"].get
+
+    # the kubectl version of the install config is the server version of the snapshot
+    config = install_config(None)
+    phases = install_phases(files, openaihub_namespace, openshift, config)
+    bundle = dict(phases)
+
+    # the state every step decides on, read up front with concurrent gets instead of a probe per step
+    deployments = [("tiller-deploy", "kube-system"), ("olm-operator", "olm"), ("catalog-operator", "olm")]
+    deployments += [("%s-operator" % x, "operators") for x, _ in operators]
+    storageclasses = ["nfs-dynamic", "ibmc-file-bronze"]
+    refs = [x for _, docs in phases for x in snapshots.doc_refs(docs)]
+    refs += [("apps/v1", "Deployment", x, ns) for x, ns in deployments]
+    refs += [("storage.k8s.io/v1", "StorageClass", x, None) for x in storageclasses]
+    refs += [("v1", "Namespace", openaihub_namespace, None)]
+    if openshift:
+        # the objects the openshift patches record
+        refs += [("rbac.authorization.k8s.io/v1", "ClusterRole", x, None) for x in ["argo", "studyjob-controller"]]
+        refs += [("apps/v1", "Deployment", x, openaihub_namespace) for x in ["minio", "openaihub-ui"]]
+    def counts(cluster):
+        # None before OLM is installed, the olm-resources step measures then
+        try:
+            return sizing.measure(cluster, package_index())
+        except kube.KindNotServed:
+            return None
+    snapshot = snapshots.Snapshot(cluster)
+    check_api(snapshot.collect, refs, {"counts": counts})
+    config["data"]["KUBECTL_VERSION"] = snapshot.server_version
+
+    if preflight:
+        logger.info("Preflight: server dry run of %s objects..." % sum(len(x) for _, x in phases))
+        errors = bundles.preflight(cluster, phases, snapshot.namespaces)
+        if errors:
+            for x in errors:
+                logger.error("Error: %s" % x)
+            logger.error("Error: the preflight found %s errors, nothing was installed" % len(errors))
+            sys.exit(1)
+
+    graph = dag.Graph()
+
+    # every step returns the cluster objects it produced (checkpoint.ref), a re-run skips
+    # the steps whose inputs did not change and whose objects are still there
 
-    # create openaihub cr
-    step += 1
-    logger.info("### %s/%s ### Create OpenAIHub deployment..." % (step, steps))
-    check_call(run, "kubectl apply -f %s/openaihub_v1alpha1_%s_cr.yaml -n %s" % (openaihub_cr_path, "openaihub", openaihub_namespace))
+    # prereq: helm must be installed already
+    # init helm tiller service account
+    def init_helm():
+        try_api(cluster.apply, bundle["helm"])
+        run("helm init --service-account tiller --upgrade")
+        return checkpoint.refs(bundle["helm"]) + [checkpoint.ref("apps/v1", "Deployment", "tiller-deploy", "kube-system")]
+    graph.add("helm", "Init helm tiller...", init_helm, inputs=[helm_file])
 
-    # special handling for openshift
-    if openshift:
-        # pylint: disable=unused-variable
-        for x in range(80):
-            if run("oc get pods -o=jsonpath='{range .items[*]}{@.metadata.name}{\" \"}{@.status.phase}{\"\\n\"}' |grep openaihub-ui|cut -d' ' -f2").stdout.decode().rstrip() != "Running" :
-                time.sleep(15)
-            else:
-                break
+    # install OLM
+    def install_olm():
+        if not snapshot.available("olm-operator", "olm") or not snapshot.available("catalog-operator", "olm"):
+            olm_version = "0.11.0"
+            import wget
+            import tempfile
+            tempdir = tempfile.mkdtemp(prefix="openaihub-")
+            wget.download("https://github.com/operator-framework/operator-lifecycle-manager/releases/download/%s/install.sh" % olm_version, out="%s/install.sh" % tempdir)
+            run("bash %s/install.sh %s" % (tempdir, olm_version))
+            shutil.rmtree(tempdir, ignore_errors=True)
+            wait_for("olm", "olm")
+            wait_for("catalog", "olm")
+
+            # install olm-console
+            try_api(cluster.apply_file, "%s/requirement/olm-console.yaml" % basedir)
+        else:
+            logger.info("OLM already exists.")
+        return [checkpoint.ref("apps/v1", "Deployment", x, "olm", available=True) for x in ["olm-operator", "catalog-operator"]]
+    graph.add("olm", "Install OLM if not installed...", install_olm)
 
+    # add openaihub catalog
+    def add_catalog():
+        check_api(cluster.apply, bundle["catalog"])
+        # the catalog serves 5 packages
+        package_index().wait(lambda index: len(index.catalog("openaihub-catalog")) >= 5,
+                             "5 packagemanifests of openaihub-catalog", timeout=600)
+        return checkpoint.refs(bundle["catalog"])
+    graph.add("catalog", "Add OpenAIHub operators catalog...", add_catalog, after=["olm"], inputs=[catalog_file])
+
+    # the memory OLM needs grows with its catalogs, size it once the openaihub catalog is served;
+    # openaihub tune does it again after register
+    def size_resources():
+        size_olm(cluster, openaihub_patch_path, olm_profile)
+        return [checkpoint.ref("apps/v1", "Deployment", x, "olm", available=True) for x in sizing.OPERATORS]
+    graph.add("olm-resources", "Size OLM for the catalogs...", size_resources, after=["catalog"],
+              inputs=["%s/%s" % (openaihub_patch_path, x) for x in ["olm-patch.yaml", "catalog-patch.yaml"]])
+
+    # the operator and operand images are pulled on every node while OLM is sized and the
+    # operators are subscribed, so that their rollouts do not wait on cold nodes; the pulls run
+    # beside the steps rather than in a worker of their own and stop once the operators are ready
+    pulled = dict()
+    stop_prepull = threading.Event()
+
+    def pull():
+        try:
+            images = prepulls.images(package_index(), bundle["subscriptions"])
+            pulled.update(images=images, nodes=try_api(prepulls.run, cluster, images, "olm", prepulls.TIMEOUT, stop_prepull) or {})
+        # pylint: disable=broad-except
+        except Exception as e:
+            logger.info("Ignored error: pre-pull: %s" % e)
+
+    def prepull_images():
+        thread = threading.Thread(target=pull, name="prepull")
+        thread.daemon = True
+        thread.start()
+        pulled["thread"] = thread
+        return []
+    if prepull:
+        graph.add("prepull", "Pre-pull the operator images on every node...", prepull_images, after=["catalog"])
+
+    # create namespace, add cluster-admin to its default service account for registration and installation
+    # of other operators, and on openshift grant the SCCs and roles of the operands, all in one bundle
+    def create_namespace():
+        created = openaihub_namespace not in snapshot.namespaces
+        if openshift and created:
+            check_api(cluster.create_namespace, openaihub_namespace, openshift)
+        check_api(cluster.apply, bundle["namespace"])
+        if created:
+            check_api(cluster.patch, "v1", "Namespace", openaihub_namespace,
+                      {"metadata": {"annotations": {bundles.CREATED_BY: "install"}}})
+        projects = [checkpoint.ref("v1", "Namespace", openaihub_namespace)] if openshift else []
+        return projects + checkpoint.refs(bundle["namespace"])
+    # the operators namespace comes with OLM
+    graph.add("namespace", "Create namespace and add cluster admin...", create_namespace, after=["olm"])
+
+    # the operators are subscribed together as soon as the catalog is served, and the CR of each
+    # is created once that operator is rolled out; operators do not wait for each other
+    def subscribe():
+        check_api(cluster.apply, bundle["subscriptions"])
+        return checkpoint.refs(bundle["subscriptions"])
+
+    def wait_operator(operator):
+        wait_for(operator, "operators")
+        return [checkpoint.ref("apps/v1", "Deployment", "%s-operator" % operator, "operators", available=True)]
+
+    def create_cr(operator):
+        check_api(cluster.apply, bundle["%s-cr" % operator])
+        return checkpoint.refs(bundle["%s-cr" % operator])
+
+    # switch default storageclass to nfs-dynamic
+    def set_default_storage():
+        readiness.wait(readiness.ObjectExists("storage.k8s.io/v1", "StorageClass", "nfs-dynamic"), timeout=600)
+        try_api(cluster.patch, "storage.k8s.io/v1", "StorageClass", "ibmc-file-bronze",
+                {"metadata": {"annotations": {"storageclass.kubernetes.io/is-default-class": "false"}}})
+        check_api(cluster.patch, "storage.k8s.io/v1", "StorageClass", "nfs-dynamic",
+                  {"metadata": {"annotations": {"storageclass.kubernetes.io/is-default-class": "true"}}})
+        return [checkpoint.ref("storage.k8s.io/v1", "StorageClass", "nfs-dynamic")]
+
+    def wait_for_pod(name):
+        readiness.wait(readiness.PodPhase(openaihub_namespace, "Running", name_contains=name), timeout=1200)
+
+    def patch_pipelines():
+        wait_for_pod("argo-ui")
+        patch_object(cluster, "rbac.authorization.k8s.io/v1", "ClusterRole", "argo", None, render.argo_patch)
+        patch_object(cluster, "apps/v1", "Deployment", "minio", openaihub_namespace,
+                     functools.partial(render.drop_sub_path, sub_path="minio"))
+        return [checkpoint.ref("rbac.authorization.k8s.io/v1", "ClusterRole", "argo"),
+                checkpoint.ref("apps/v1", "Deployment", "minio", openaihub_namespace)]
+
+    def patch_openaihub():
+        wait_for_pod("openaihub-ui")
         public_ip = os.getenv("PUBLIC_IP")
-        run("oc get deployment openaihub-ui -o yaml > %s/openaihub-ui.yaml" % openaihub_patch_path)
-        run("sed -i 's/<none>/%s/g' %s/openaihub-ui.yaml" % (public_ip, openaihub_patch_path))
-        run("oc apply -f %s/openaihub-ui.yaml" % openaihub_patch_path)
+        if not public_ip:
+            logger.info("PUBLIC_IP is not set, openaihub-ui keeps <none> for its address.")
+        else:
+            patch_object(cluster, "apps/v1", "Deployment", "openaihub-ui", openaihub_namespace,
+                         functools.partial(render.substitute, params={"<none>": public_ip}))
+        return [checkpoint.ref("apps/v1", "Deployment", "openaihub-ui", openaihub_namespace)]
 
-    # create kubeflow operator
-    step += 1
-    logger.info("### %s/%s ### Deploy Kubeflow operator..." % (step, steps))
-    check_call(run, "kubectl apply -f %s/%s-operator.yaml" % (openaihub_subscription_path, "kubeflow"))
+    # update clusterrole
+    def patch_kubeflow():
+        wait_for_pod("studyjob-controller")
+        patch_object(cluster, "rbac.authorization.k8s.io/v1", "ClusterRole", "studyjob-controller", None, render.studyjob_patch)
+        return [checkpoint.ref("rbac.authorization.k8s.io/v1", "ClusterRole", "studyjob-controller")]
+
+    openshift_patches = {"pipelines": patch_pipelines, "openaihub": patch_openaihub, "kubeflow": patch_kubeflow}
+
+    graph.add("subscriptions", "Deploy the operators...", subscribe, after=["catalog", "namespace"],
+              inputs=[subscription_file(x) for x, _ in operators])
+    for operator, title in operators:
+        graph.add("%s-ready" % operator, "Wait until %s operator is available..." % title,
+                  functools.partial(wait_operator, operator), after=["subscriptions"])
+        after = ["%s-ready" % operator, "namespace"]
+        # the nfs-dynamic storageclass is provided by the jupyterlab deployment and has
+        # to be the default before the other deployments create their pvcs
+        if "storage" in graph.steps:
+            after.append("storage")
+        graph.add("%s-cr" % operator, "Create %s deployment..." % title,
+                  functools.partial(create_cr, operator), after=after, inputs=[cr_file(operator)])
+        if operator == "jupyterlab" and not openshift and storage == "nfs":
+            graph.add("storage", "Wait for nfs-dynamic storageclass to be ready and set as default...",
+                      set_default_storage, after=["jupyterlab-cr"])
+        if openshift and operator in openshift_patches:
+            graph.add("%s-patch" % operator, "Patch %s deployment for openshift..." % title,
+                      openshift_patches[operator], after=["%s-cr" % operator])
+
+    if from_step and from_step not in graph.steps:
+        logger.error("Error: unknown step %s, the steps are %s" % (from_step, ", ".join(graph.steps)))
+        sys.exit(1)
+    state = None
+    if checkpoints != "off":
+        state = checkpoint.Checkpoints(cluster, openaihub_namespace, configmap=checkpoints == "cluster")
+        done = state.plan(graph, {"namespace": namespace, "storage": storage, "openshift": openshift}, from_step, force,
+                          get=snapshot.get)
+        if done:
+            logger.info("Resuming, %s of %s steps are done already: %s" % (len(done), len(graph.steps), ", ".join(done)))
+
+    # the steps whose result the snapshot shows in the cluster already are not run again
+    def olm_sized():
+        if snapshot.extra["counts"] is None:
+            return False
+        _, resources = sizing.profile(snapshot.extra["counts"], olm_profile)
+        return not any(sizing.changed(sizing.resources_of(snapshot.get("apps/v1", "Deployment", x, "olm"), x), resources[x])
+                       for x in sizing.OPERATORS)
+
+    def default_storage():
+        def is_default(name):
+            obj = snapshot.get("storage.k8s.io/v1", "StorageClass", name)
+            annotations = (obj or {}).get("metadata", {}).get("annotations") or {}
+            return annotations.get("storageclass.kubernetes.io/is-default-class") == "true"
+        return is_default("nfs-dynamic") and not is_default("ibmc-file-bronze")
+
+    satisfied = {
+        "helm": lambda: snapshot.satisfied(bundle["helm"]) and snapshot.available("tiller-deploy", "kube-system"),
+        "olm": lambda: snapshot.available("olm-operator", "olm") and snapshot.available("catalog-operator", "olm"),
+        "catalog": lambda: snapshot.satisfied(bundle["catalog"]),
+        "olm-resources": olm_sized,
+        "namespace": lambda: openaihub_namespace in snapshot.namespaces and snapshot.satisfied(bundle["namespace"]),
+        "subscriptions": lambda: snapshot.satisfied(bundle["subscriptions"]),
+        "storage": default_storage,
+        # the operators run already, so do their images
+        "prepull": lambda: all(snapshot.available("%s-operator" % x, "operators") for x, _ in operators)}
+    for operator, _ in operators:
+        satisfied["%s-ready" % operator] = functools.partial(snapshot.available, "%s-operator" % operator, "operators")
+        satisfied["%s-cr" % operator] = functools.partial(snapshot.satisfied, bundle["%s-cr" % operator])
+    rerun = checkpoint.downstream(graph, from_step) if from_step else set()
+    for step in graph.steps.values():
+        if step.skip or force or step.name in rerun or step.name not in satisfied:
+            continue
+        if all(graph.steps[x].skip for x in step.after) and satisfied[step.name]():
+            step.skip = True
+            step.skip_reason = "already satisfied"
+
+    dag.print_plan(graph)
+
+    ready = set("%s-ready" % x for x, _ in operators)
+
+    def on_done(step):
+        if state:
+            state.record(step)
+        if step.name in ready and all(graph.steps[x].end is not None or graph.steps[x].skip for x in ready):
+            stop_prepull.set()
+
+    try:
+        elapsed = dag.execute(graph, workers, on_done=on_done)
+    finally:
+        stop_prepull.set()
+        if "thread" in pulled:
+            pulled["thread"].join()
+
+    dag.print_summary(graph, elapsed)
+    if pulled.get("nodes"):
+        prepulls.print_report(pulled["nodes"], pulled["images"])
 
-    # wait until kubeflow operator is available
-    step += 1
-    logger.info("### %s/%s ### Wait until Kubeflow operator is available..." % (step, steps))
-    wait_for("kubeflow", "operators")
+    logger.info("Done.")
 
-    # give permssion for kubeflow-operator
-    if openshift:
-        run("oc adm policy add-cluster-role-to-user cluster-admin -z kubeflow-operator -n operators")
+def patch_object(cluster, api_version, kind, name, namespace, transform):
+    # get, change in memory and apply the object, no file or sed in between
+    obj = check_api(cluster.get, api_version, kind, name, namespace)
+    if obj is None:
+        logger.info("%s %s not found, not patched." % (kind, name))
+        return
+    try_api(cluster.apply, [transform(kube.strip_object(obj))])
+
+def uninstall(namespace, loglevel, keep_olm=False, keep_storage=False, manifest_source='', workers=4, use_kubectl=False,
+              trace_file='', timeout=600):
+    with trace.export(trace_file):
+        return _uninstall(namespace, loglevel, keep_olm, keep_storage, manifest_source, workers, use_kubectl, timeout)
+
+def _uninstall(namespace, loglevel, keep_olm=False, keep_storage=False, manifest_source='', workers=4, use_kubectl=False,
+               timeout=600):
+    logger.setLevel(loglevel.upper())
 
-    # create kubeflow cr
-    step += 1
-    logger.info("### %s/%s ### Create Kubeflow deployment..." % (step, steps))
-    check_call(run, "kubectl apply -f %s/openaihub_v1alpha1_%s_cr.yaml -n %s" % (openaihub_cr_path, "kubeflow", openaihub_namespace))
+    kube.configure(shell=use_kubectl)
+    cluster = kube.cluster()
+    basedir = open_manifests(manifest_source).root
+    # register builds in the namespace of the in-process client, like its waits
+    build_namespace = kube.api().default_namespace
+
+    # the objects of install, the namespace bundle of both flavours since either may have been installed
+    files = install_files(basedir)
+    config = install_config(None)
+    bundle = dict(install_phases(files, namespace, False, config))
+    namespace_docs = bundle["namespace"] + [x for x in bundles.namespace_bundle(namespace, True, config) if x not in bundle["namespace"]]
+    namespace_refs = snapshots.doc_refs(namespace_docs) + [("v1", "ConfigMap", checkpoint.CONFIGMAP_NAME, namespace)]
+    kaniko_refs = [("v1", "ConfigMap", "docker-config", build_namespace),
+                   ("v1", "ConfigMap", buildcache.CONFIGMAP_NAME, buildcache.CONFIGMAP_NAMESPACE),
+                   ("apps/v1", "DaemonSet", prepulls.NAME, "olm")]
+    # what the OLM release manifests and olm-console create outside of the olm and operators namespaces
+    olm_refs = [("v1", "Namespace", x, None) for x in ["olm", "operators"]]
+    olm_refs += [("apiregistration.k8s.io/v1", "APIService", "v1.packages.operators.coreos.com", None),
+                 ("rbac.authorization.k8s.io/v1", "ClusterRole", "system:controller:operator-lifecycle-manager", None),
+                 ("rbac.authorization.k8s.io/v1", "ClusterRoleBinding", "olm-operator-binding-olm", None)]
+    olm_refs += [x for x in snapshots.doc_refs(render.load("%s/requirement/olm-console.yaml" % basedir)) if x[3] is None]
+    storageclasses = [("storage.k8s.io/v1", "StorageClass", x, None) for x in ["nfs-dynamic", "ibmc-file-bronze"]]
+
+    def listed(api_version, kind, ns=None):
+        def items(cluster):
+            try:
+                return cluster.list(api_version, kind, ns)
+            except kube.KindNotServed:
+                return []
+        return items
+
+    # what is there, read up front with concurrent calls; the lists find what install and register
+    # created under names of their own (CSVs, PVCs, registered catalogs, kaniko pods)
+    refs = [x for name, docs in bundle.items() if name != "namespace" for x in snapshots.doc_refs(docs)]
+    refs += namespace_refs + kaniko_refs + olm_refs + storageclasses
+    snapshot = snapshots.Snapshot(cluster)
+    check_api(snapshot.collect, refs, {
+        "subscriptions": listed("operators.coreos.com/v1alpha1", "Subscription", "operators"),
+        "catalogs": listed("operators.coreos.com/v1alpha1", "CatalogSource", "olm"),
+        "pods": listed("v1", "Pod", build_namespace),
+        "pvcs": listed("v1", "PersistentVolumeClaim", namespace),
+        "crds": lambda cluster: cluster.list_crds()})
+
+    def present(refs):
+        return [x for x in refs if snapshot.get(*x) is not None]
+
+    # the namespace goes only when install created it; olm and operators belong to OLM and go
+    # with the olm step
+    annotations = ((snapshot.get("v1", "Namespace", namespace) or {}).get("metadata") or {}).get("annotations") or {}
+    if namespace in ("olm", "operators"):
+        kept = "it belongs to OLM" if keep_olm else None
+    elif keep_storage:
+        kept = "its PVCs are kept"
+    else:
+        kept = "install did not create it" if annotations.get(bundles.CREATED_BY) != "install" else None
+    if namespace in ("olm", "operators") or kept:
+        namespace_refs.remove(("v1", "Namespace", namespace, None))
+    if kept and snapshot.exists("v1", "Namespace", namespace):
+        logger.info("Keeping the namespace %s, %s" % (namespace, kept))
+
+    def ref(api_version, kind, obj):
+        # list items of built-in kinds come without their apiVersion and kind
+        return (api_version, kind, obj["metadata"]["name"], obj["metadata"].get("namespace"))
+
+    # the openaihub catalog and the catalogs of register, which all have this display name
+    sources = dict((x["metadata"]["name"], x) for x in snapshot.extra["catalogs"]
+                   if x["metadata"]["name"] == "openaihub-catalog" or (x.get("spec") or {}).get("displayName") == "Custom Operators")
+    install_subscriptions = set(x["metadata"]["name"] for x in bundle["subscriptions"])
+    subscriptions = [x for x in snapshot.extra["subscriptions"]
+                     if x["metadata"]["name"] in install_subscriptions or x["spec"].get("source") in sources]
+
+    # install in reverse: the CRs while their operators still handle the finalizers, then the
+    # operators, then the catalogs and OLM; the jupyterlab CR provides the nfs storage, so it goes
+    # after the PVCs the other CRs used
+    graph = dag.Graph()
+    deletion = teardown.Teardown(cluster, timeout)
+    objects = dict()
+
+    def add(name, description, refs, after=(), func=None):
+        objects[name] = refs
+        step = graph.add(name, description, func or (lambda: deletion.delete(name, refs)), after=after)
+        if not refs and func is None:
+            step.skip = True
+            step.skip_reason = "nothing to delete"
+        return step
+
+    for operator, title in OPERATORS[1:]:
+        add("%s-cr" % operator, "Delete the %s deployment..." % title, present(snapshots.doc_refs(bundle["%s-cr" % operator])))
+    after = []
+    if not keep_storage:
+        pvcs = [ref("v1", "PersistentVolumeClaim", x) for x in snapshot.extra["pvcs"]]
+
+        def is_default(name):
+            annotations = (snapshot.get("storage.k8s.io/v1", "StorageClass", name) or {}).get("metadata", {}).get("annotations") or {}
+            return annotations.get("storageclass.kubernetes.io/is-default-class") == "true"
+
+        def delete_storage():
+            deletion.delete("storage", pvcs)
+            if is_default("nfs-dynamic") and snapshot.exists("storage.k8s.io/v1", "StorageClass", "ibmc-file-bronze"):
+                # ibmc-file-bronze is the default again, as before install
+                try_api(cluster.patch, "storage.k8s.io/v1", "StorageClass", "nfs-dynamic",
+                        {"metadata": {"annotations": {"storageclass.kubernetes.io/is-default-class": "false"}}})
+                check_api(cluster.patch, "storage.k8s.io/v1", "StorageClass", "ibmc-file-bronze",
+                          {"metadata": {"annotations": {"storageclass.kubernetes.io/is-default-class": "true"}}})
+            return pvcs
+
+        step = add("storage", "Delete the PVCs and restore the default storageclass...", pvcs,
+                   after=["%s-cr" % x for x, _ in OPERATORS[1:]], func=delete_storage)
+        if not pvcs and not is_default("nfs-dynamic"):
+            step.skip = True
+            step.skip_reason = "nothing to delete"
+        after = ["storage"]
+    add("jupyterlab-cr", "Delete the Jupyterlab deployment...", present(snapshots.doc_refs(bundle["jupyterlab-cr"])), after=after)
+
+    # an operator goes with its subscription and the CSV the subscription installed
+    operator_steps = []
+    for sub in subscriptions:
+        package = sub["spec"]["name"]
+        csv = (sub.get("status") or {}).get("installedCSV") or (sub.get("status") or {}).get("currentCSV")
+        refs = [ref("operators.coreos.com/v1alpha1", "Subscription", sub)]
+        if csv:
+            refs.append(("operators.coreos.com/v1alpha1", "ClusterServiceVersion", csv, sub["metadata"]["namespace"]))
+        # prefixed, a package may be named like one of the fixed steps
+        name = "package:%s" % package
+        if name in graph.steps:
+            name = "%s-%s" % (name, sub["metadata"]["name"])
+        crs = [x for x, _ in OPERATORS if package == "%s-operator" % x]
+        add(name, "Delete the %s operator..." % package, refs, after=["%s-cr" % x for x in crs])
+        operator_steps.append(name)
+
+    configmaps = [("v1", "ConfigMap", x["spec"]["configMap"], x["metadata"]["namespace"])
+                  for x in sources.values() if (x.get("spec") or {}).get("configMap")]
+    add("catalog", "Delete the catalogs...",
+        [ref("operators.coreos.com/v1alpha1", "CatalogSource", x) for x in sources.values()] + present(configmaps), after=operator_steps)
+    kaniko_pods = [ref("v1", "Pod", x) for x in snapshot.extra["pods"] if x["metadata"]["name"].startswith("kaniko-")]
+    add("kaniko", "Delete the kaniko pods, the build configmaps and a left over pre-pull...", kaniko_pods + present(kaniko_refs))
+    add("namespace", "Delete the namespace and its cluster admin...", present(namespace_refs),
+        after=["%s-cr" % x for x, _ in OPERATORS] + operator_steps + after)
+    if not keep_olm:
+        crd_version, crd_items = snapshot.extra["crds"]
+        crds = [ref(crd_version, "CustomResourceDefinition", x) for x in crd_items
+                if x["spec"]["group"].endswith("operators.coreos.com")]
+        add("olm", "Delete OLM...", present(olm_refs) + crds, after=["catalog", "kaniko", "namespace"])
+
+    dag.print_plan(graph, lambda step: "%s to delete" % ", ".join(teardown.describe(x) for x in objects[step.name]))
+
+    try:
+        elapsed = dag.execute(graph, workers)
+    except kube.ClusterError as e:
+        teardown.print_report(deletion, graph)
+        logger.error("Error: %s" % e)
+        sys.exit(1)
 
-    # update clusterrole
-    if openshift:
-        # pylint: disable=unused-variable
-        for x in range(80):
-            if run("oc get pods -o=jsonpath='{range .items[*]}{@.metadata.name}{\" \"}{@.status.phase}{\"\\n\"}' |grep studyjob-controller|cut -d' ' -f2").stdout.decode().rstrip() != "Running" :
-                time.sleep(15)
-            else:
-                break        
-        run("oc get clusterrole studyjob-controller -o yaml > %s/studyjob.yaml" % openaihub_patch_path)
-        studyjob_patch(os.path.join(openaihub_patch_path, "studyjob.yaml"))
-        run("oc apply -f %s/studyjob.yaml" % openaihub_patch_path)
-
-    # remove temp
-    shutil.rmtree(basedir, ignore_errors=True)
+    checkpoint.Checkpoints(cluster, namespace).clear()
+
+    dag.print_summary(graph, elapsed)
+    teardown.print_report(deletion, graph)
 
     logger.info("Done.")
 
-def argo_patch(path):
-  y = yaml.safe_load(open(path))
-  del y["metadata"]
-  y["metadata"] = dict()
-  y["metadata"]["labels"] = dict()
-  y["metadata"]["labels"]["app"] = "argo"
-  y["metadata"]["name"] = "argo"
-  for x in y["rules"]:
-    if "pods" in x["resources"]:
-      x["verbs"].append('delete')
-    elif "workflows" in x["resources"]:
-      x["resources"].append('workflows/finalizers')
-  yaml.dump(y, open(path,'w'), default_flow_style=False)
-
-def studyjob_patch(path):
-  y = yaml.safe_load(open(path))
-  del y["metadata"]
-  y["metadata"] = dict()
-  y["metadata"]["name"] = "studyjob-controller"
-  for x in y["rules"]:
-    if "jobs" in x["resources"]:
-      x["resources"].append('jobs/finalizers')
-    elif "tfjobs" in x["resources"]:
-      x["resources"].append('tfjobs/finalizers')
-      x["resources"].append('pytorchjobs/finalizers')
-  yaml.dump(y, open(path,'w'), default_flow_style=False)
-
-__all__ = ["install", "install_operator", "register"]
+__all__ = ["install", "install_operator", "register", "tune", "uninstall"]
@@ -0,0 +1,151 @@
+# Copyright 2019 IBM Corporation 
+# 
+# Licensed under the Apache License, Version 2.0 (the "License"); 
+# you may not use this file except in compliance with the License. 
+# You may obtain a copy of the License at 
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0 
+# 
+# Unless required by applicable law or agreed to in writing, software 
+# distributed under the License is distributed on an "AS IS" BASIS, 
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. 
+# See the License for the specific language governing permissions and 
+# limitations under the License. 
+from __future__ import print_function
+import logging
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import yaml
+from openaihub.func import kube
+from openaihub.func.manifests import cache_dir
+
+logger = logging.getLogger(__name__)
+
+CONFIGMAP_NAME = "openaihub-build-cache"
+CONFIGMAP_NAMESPACE = "olm"
+
+# parsed yaml files keyed by the sha256 of their content
+_parsed = dict()
+_parsed_lock = threading.Lock()
+
+def parse_yaml(content):
+    # memoized by content, so re-registering an unchanged bundle parses its CSV once per process;
+    # the documents are shared, callers must not change them
+    key = hashlib.sha256(content).hexdigest()
+    with _parsed_lock:
+        if key not in _parsed:
+            _parsed[key] = [x for x in yaml.safe_load_all(content) if x is not None]
+        return _parsed[key]
+
+def load_yaml(path):
+    with open(path, "rb") as f:
+        return parse_yaml(f.read())
+
+def yaml_digest(docs):
+    # yaml is hashed by its parsed form, so comments, key order and formatting do not change the hash
+    return hashlib.sha256(json.dumps(docs, sort_keys=True, default=str).encode()).digest()
+
+def file_digest(path):
+    if re.search(r"\.ya?ml$", path):
+        try:
+            return yaml_digest(load_yaml(path))
+        except yaml.YAMLError:
+            pass
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).digest()
+
+def digests_hash(digests):
+    # hash of (relative path, digest) pairs, in path order
+    h = hashlib.sha256()
+    for path, digest in sorted(digests):
+        h.update(path.encode() + b"\0")
+        h.update(digest)
+    return h.hexdigest()
+
+def image_tag(key):
+    return key[:16]
+
+def image_reference(entry):
+    # pin the catalog to the pushed digest when kaniko reported one
+    if entry.get("digest"):
+        return "%s@%s" % (entry["image"].rsplit(":", 1)[0], entry["digest"])
+    return entry["image"]
+
+def pod_digest(pod, container="kaniko"):
+    # kaniko writes the digest of the pushed image to its termination message (--digest-file)
+    for x in (pod or {}).get("status", {}).get("containerStatuses") or []:
+        if x.get("name") == container:
+            message = ((x.get("state") or {}).get("terminated") or {}).get("message") or ""
+            match = re.search(r"sha256:[0-9a-f]{64}", message)
+            if match:
+                return match.group(0)
+    return None
+
+class BuildCache:
+    # hash -> {image, digest, built}, kept in a local json index and optionally
+    # mirrored in a ConfigMap so every user of the cluster shares it
+    def __init__(self, cluster=None, configmap=False):
+        self.path = os.path.join(cache_dir(), "builds.json")
+        self.cluster = cluster
+        self.configmap = configmap
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return dict()
+
+    def lookup(self, key):
+        entry = self._load().get(key)
+        if entry is None and self.configmap:
+            entry = self._lookup_shared(key)
+            if entry is not None:
+                self._save_local(key, entry)
+        return entry
+
+    def _lookup_shared(self, key):
+        # the entry of the ConfigMap, None when it cannot be read; the cache only saves a build
+        try:
+            cm = self.cluster.get("v1", "ConfigMap", CONFIGMAP_NAME, CONFIGMAP_NAMESPACE) or {}
+        except kube.ClusterError as e:
+            logger.info("Unable to read the shared build cache: %s" % e)
+            return None
+        if key not in (cm.get("data") or {}):
+            return None
+        try:
+            entry = json.loads(cm["data"][key])
+        except ValueError as e:
+            logger.info("Ignoring the shared build cache entry %s: %s" % (key, e))
+            return None
+        if not isinstance(entry, dict) or not entry.get("image"):
+            logger.info("Ignoring the shared build cache entry %s: no image" % key)
+            return None
+        return entry
+
+    def _save_local(self, key, entry):
+        index = self._load()
+        index[key] = entry
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(index, f, indent=2, sort_keys=True)
+        os.replace(self.path + ".tmp", self.path)
+
+    def record(self, key, image, digest):
+        entry = {"image": image, "digest": digest, "built": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
+        self._save_local(key, entry)
+        if self.configmap:
+            try:
+                if self.cluster.exists("v1", "ConfigMap", CONFIGMAP_NAME, CONFIGMAP_NAMESPACE):
+                    self.cluster.patch("v1", "ConfigMap", CONFIGMAP_NAME, {"data": {key: json.dumps(entry)}}, CONFIGMAP_NAMESPACE)
+                else:
+                    self.cluster.create_configmap(CONFIGMAP_NAME, CONFIGMAP_NAMESPACE, {key: json.dumps(entry)})
+            except kube.ClusterError as e:
+                logger.info("Unable to share the build cache entry: %s" % e)
+        return entry
+
+__all__ = ["BuildCache", "digests_hash", "file_digest", "yaml_digest", "image_tag", "image_reference", "pod_digest", "load_yaml", "parse_yaml"]
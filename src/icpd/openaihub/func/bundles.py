@@ -0,0 +1,115 @@
+# Copyright 2019 IBM Corporation 
+# 
+# Licensed under the Apache License, Version 2.0 (the "License"); 
+# you may not use this file except in compliance with the License. 
+# You may obtain a copy of the License at 
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0 
+# 
+# Unless required by applicable law or agreed to in writing, software 
+# distributed under the License is distributed on an "AS IS" BASIS, 
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. 
+# See the License for the specific language governing permissions and 
+# limitations under the License. 
+from __future__ import print_function
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from openaihub.func import kube
+
+logger = logging.getLogger(__name__)
+
+RBAC = "rbac.authorization.k8s.io/v1"
+
+def service_account(name, namespace):
+    return {"kind": "ServiceAccount", "name": name, "namespace": namespace}
+
+def group(name):
+    return {"kind": "Group", "apiGroup": "rbac.authorization.k8s.io", "name": name}
+
+def binding(name, cluster_role, subjects, namespace=None):
+    # a RoleBinding in namespace, or a ClusterRoleBinding without one
+    metadata = {"name": name}
+    if namespace:
+        metadata["namespace"] = namespace
+    return {"apiVersion": RBAC, "kind": "RoleBinding" if namespace else "ClusterRoleBinding", "metadata": metadata,
+            "roleRef": {"apiGroup": "rbac.authorization.k8s.io", "kind": "ClusterRole", "name": cluster_role},
+            "subjects": subjects}
+
+def scc_role(scc):
+    # the use of a SecurityContextConstraints is granted through RBAC, same as oc adm policy add-scc-to-*
+    return {"apiVersion": RBAC, "kind": "ClusterRole", "metadata": {"name": "openaihub-scc-%s" % scc},
+            "rules": [{"apiGroups": ["security.openshift.io"], "resources": ["securitycontextconstraints"],
+                       "resourceNames": [scc], "verbs": ["use"]}]}
+
+def in_namespace(docs, namespace):
+    # the documents of a namespaced template placed in namespace
+    return [dict(x, metadata=dict(x["metadata"], namespace=namespace)) for x in docs]
+
+# set on the namespace when install created it, uninstall deletes no other namespace
+CREATED_BY = "openaihub.ibm.com/created-by"
+
+def namespace_bundle(namespace, openshift, install_config):
+    # the namespace, the cluster-admin of its default service account and the install config of
+    # the operators; on openshift also the SCCs and roles the operands need
+    docs = []
+    if not openshift:
+        # openshift projects are requested instead, see create_namespace
+        docs.append({"apiVersion": "v1", "kind": "Namespace", "metadata": {"name": namespace}})
+    docs.append(binding("add-on-cluster-admin-openaihub", "cluster-admin", [service_account("default", namespace)]))
+    docs.append(install_config)
+    if openshift:
+        docs += [scc_role("privileged"), scc_role("anyuid"),
+                 binding("openaihub-scc-privileged", "openaihub-scc-privileged", [service_account("default", namespace)], namespace),
+                 binding("openaihub-scc-anyuid", "openaihub-scc-anyuid",
+                         [service_account(x, namespace) for x in ["ambassador", "default", "pipeline-runner"]], namespace),
+                 binding("openaihub-scc-anyuid-authenticated", "openaihub-scc-anyuid", [group("system:authenticated")]),
+                 binding("openaihub-scc-privileged-kubeflow", "openaihub-scc-privileged", [group("system:serviceaccounts:kubeflow")]),
+                 binding("openaihub-pipeline-runner-%s" % namespace, "cluster-admin", [service_account("pipeline-runner", namespace)]),
+                 binding("openaihub-kubeflow-operator", "cluster-admin", [service_account("kubeflow-operator", "operators")])]
+    return docs
+
+def preflight(cluster, bundles, existing=None):
+    # server dry run of every object of the bundles, all errors are returned at once; objects of
+    # kinds an operator registers later and in namespaces the install creates are skipped;
+    # existing is the set of namespaces when known already
+    namespaces = set(x["metadata"].get("namespace") for _, docs in bundles for x in docs) - set([None])
+    if existing is None:
+        existing = set(x for x in namespaces if cluster.exists("v1", "Namespace", x))
+    missing = namespaces - set(existing)
+    checks = []
+    for name, docs in bundles:
+        kept = []
+        for doc in docs:
+            if doc["metadata"].get("namespace") in missing:
+                logger.info("Preflight of %s %s skipped, namespace %s does not exist yet" %
+                            (doc["kind"], doc["metadata"]["name"], doc["metadata"]["namespace"]))
+            else:
+                kept.append(doc)
+        if kept:
+            checks.append((name, kept))
+
+    def check_one(name, doc):
+        try:
+            cluster.apply([doc], dry_run=True)
+        except kube.KindNotServed as e:
+            logger.info("Preflight of %s %s skipped: %s" % (doc["kind"], doc["metadata"]["name"], e))
+        except kube.ClusterError as e:
+            return "%s: %s" % (name, e)
+        return None
+
+    def check(item):
+        # a bundle in one dry run (one kubectl process), object by object only to tell which failed
+        name, docs = item
+        try:
+            cluster.apply(docs, dry_run=True)
+            return []
+        except kube.ClusterError:
+            pass
+        return [x for x in (check_one(name, doc) for doc in docs) if x]
+
+    if not checks:
+        return []
+    with ThreadPoolExecutor(max_workers=min(8, len(checks))) as pool:
+        return [x for errors in pool.map(check, checks) for x in errors]
+
+__all__ = ["namespace_bundle", "in_namespace", "binding", "scc_role", "service_account", "group", "preflight"]
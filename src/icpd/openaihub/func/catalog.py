@@ -0,0 +1,146 @@
+# Copyright 2019 IBM Corporation 
+# 
+# Licensed under the Apache License, Version 2.0 (the "License"); 
+# you may not use this file except in compliance with the License. 
+# You may obtain a copy of the License at 
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0 
+# 
+# Unless required by applicable law or agreed to in writing, software 
+# distributed under the License is distributed on an "AS IS" BASIS, 
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. 
+# See the License for the specific language governing permissions and 
+# limitations under the License. 
+from __future__ import print_function
+import logging
+import hashlib
+import os
+import posixpath
+import zlib
+import yaml
+
+logger = logging.getLogger(__name__)
+
+# the keys of a configmap catalog, as read by the OLM configmap registry
+PACKAGES = "packages"
+CSVS = "clusterServiceVersions"
+CRDS = "customResourceDefinitions"
+# the (path, digest) pairs of the files of a bundle
+DIGESTS = "digests"
+
+# the API server refuses objects over 1MiB, leave some room for the metadata
+CONFIGMAP_LIMIT = 1000 * 1000
+
+# yaml members up to this size are parsed, larger ones (and every other file) are hashed in chunks
+YAML_LIMIT = 16 * 1024 * 1024
+CHUNK_SIZE = 1024 * 1024
+
+def member_path(tgz, member):
+    # the relative path of a member, ValueError for one that would land outside the bundle
+    # or is not a plain file or directory
+    path = posixpath.normpath(member.name)
+    if path.startswith("/") or path == ".." or path.startswith("../"):
+        raise ValueError("the file %s has a member outside of the bundle: %s" % (tgz, member.name))
+    if not (member.isfile() or member.isdir()):
+        raise ValueError("the file %s has a link or special file: %s" % (tgz, member.name))
+    return path
+
+def members(tgz):
+    # (path, member, file object) of every member of a bundle, read as one gzip stream without
+    # unpacking; the file object of a member is only valid until the next one is read
+    import tarfile
+    if not os.path.isfile(tgz):
+        raise ValueError("the file %s does not exist" % tgz)
+    try:
+        with tarfile.open(tgz, "r|gz") as tf:
+            for member in tf:
+                path = member_path(tgz, member)
+                yield path, member, tf.extractfile(member) if member.isfile() else None
+    except (tarfile.TarError, IOError, EOFError, zlib.error) as e:
+        raise ValueError("the file %s is not a valid tgz: %s" % (tgz, e))
+
+def read_bundle(tgz, prefix=''):
+    # the packages, CSVs and CRDs of an operator bundle and the digest of each of its files
+    # (by prefix/path, the same digest buildcache.file_digest gives the file once unpacked); only
+    # the yaml documents are kept in memory, raises ValueError for an unreadable archive
+    from openaihub.func import buildcache
+    bundle = {PACKAGES: [], CSVS: [], CRDS: [], DIGESTS: []}
+    for path, member, f in members(tgz):
+        if f is None:
+            continue
+        name = posixpath.join(prefix, path) if prefix else path
+        docs = None
+        if path.endswith((".yaml", ".yml")) and member.size <= YAML_LIMIT:
+            try:
+                docs = buildcache.parse_yaml(f.read())
+            except yaml.YAMLError as e:
+                raise ValueError("the file %s has an invalid yaml %s: %s" % (tgz, path, e))
+            bundle[DIGESTS].append((name, buildcache.yaml_digest(docs)))
+        else:
+            h = hashlib.sha256()
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                h.update(chunk)
+            bundle[DIGESTS].append((name, h.digest()))
+        for doc in docs or []:
+            if not isinstance(doc, dict):
+                continue
+            if "packageName" in doc:
+                bundle[PACKAGES].append(doc)
+            elif doc.get("kind") == "ClusterServiceVersion":
+                bundle[CSVS].append(doc)
+            elif doc.get("kind") == "CustomResourceDefinition":
+                bundle[CRDS].append(doc)
+    return bundle
+
+def copy_bundle(tgz, tf, prefix):
+    # every member of a bundle into the open tarfile tf under prefix, copied from stream to
+    # stream in blocks; the members were checked by read_bundle
+    for path, member, f in members(tgz):
+        if path == ".":
+            continue
+        member.name = posixpath.join(prefix, path)
+        tf.addfile(member, f)
+
+def validate(tgz, bundle):
+    # returns the operator (deployment) name, raises ValueError with every problem of the bundle
+    problems = []
+    if not bundle[CSVS]:
+        problems.append("no clusterserviceversion")
+    if not bundle[PACKAGES]:
+        problems.append("no package yaml")
+    csvs = dict((x.get("metadata", {}).get("name"), x) for x in bundle[CSVS])
+    crds = set(x.get("metadata", {}).get("name") for x in bundle[CRDS])
+    for package in bundle[PACKAGES]:
+        for channel in package.get("channels") or []:
+            if channel.get("currentCSV") not in csvs:
+                problems.append("channel %s of package %s points to the missing CSV %s" %
+                                (channel.get("name"), package["packageName"], channel.get("currentCSV")))
+        if not package.get("channels"):
+            problems.append("package %s has no channels" % package["packageName"])
+    for name, csv in csvs.items():
+        owned = ((csv.get("spec") or {}).get("customresourcedefinitions") or {}).get("owned") or []
+        for x in owned:
+            if x.get("name") not in crds:
+                problems.append("CSV %s owns the missing CRD %s" % (name, x.get("name")))
+    deployments = []
+    for csv in bundle[CSVS]:
+        try:
+            deployments.append(csv["spec"]["install"]["spec"]["deployments"][0]["name"])
+        except (KeyError, IndexError, TypeError):
+            problems.append("CSV %s has no deployment" % csv.get("metadata", {}).get("name"))
+    if problems:
+        raise ValueError("the file %s is not a valid operator bundle: %s" % (tgz, "; ".join(problems)))
+    return deployments[0]
+
+def configmap(name, namespace, bundles):
+    # one configmap with the documents of all bundles; raises ValueError when they do not fit
+    data = dict((key, yaml.safe_dump([x for bundle in bundles for x in bundle[key]], default_flow_style=False))
+                for key in [PACKAGES, CSVS, CRDS])
+    size = sum(len(x.encode()) for x in data.values())
+    if size > CONFIGMAP_LIMIT:
+        raise ValueError("the bundles take %s bytes, more than a configmap holds (%s), use --catalog-mode image" %
+                         (size, CONFIGMAP_LIMIT))
+    logger.info("The configmap catalog %s takes %s bytes" % (name, size))
+    return {"apiVersion": "v1", "kind": "ConfigMap", "metadata": {"name": name, "namespace": namespace}, "data": data}
+
+__all__ = ["read_bundle", "copy_bundle", "members", "validate", "configmap"]
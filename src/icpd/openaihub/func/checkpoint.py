@@ -0,0 +1,141 @@
+# Copyright 2019 IBM Corporation 
+# 
+# Licensed under the Apache License, Version 2.0 (the "License"); 
+# you may not use this file except in compliance with the License. 
+# You may obtain a copy of the License at 
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0 
+# 
+# Unless required by applicable law or agreed to in writing, software 
+# distributed under the License is distributed on an "AS IS" BASIS, 
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. 
+# See the License for the specific language governing permissions and 
+# limitations under the License. 
+from __future__ import print_function
+import logging
+import hashlib
+import json
+import os
+import time
+from openaihub.func import kube
+from openaihub.func import readiness
+from openaihub.func.manifests import cache_dir
+
+logger = logging.getLogger(__name__)
+
+CONFIGMAP_NAME = "openaihub-install-state"
+
+def ref(api_version, kind, name, namespace=None, available=False):
+    # a cluster object produced by a step; available deployments are also checked for their rollout
+    return {"apiVersion": api_version, "kind": kind, "name": name, "namespace": namespace, "available": available}
+
+def refs(docs, namespace=None):
+    return [ref(x["apiVersion"], x["kind"], x["metadata"]["name"], namespace or x["metadata"].get("namespace"))
+            for x in docs]
+
+def step_hash(step, options, hashes):
+    # the step, the install options, the content of its input files and the hashes of its dependencies
+    h = hashlib.sha256()
+    h.update(step.name.encode() + b"\0")
+    h.update(json.dumps(options, sort_keys=True).encode() + b"\0")
+    for path in step.inputs:
+        h.update(os.path.basename(path).encode() + b"\0")
+        with open(path, "rb") as f:
+            h.update(hashlib.sha256(f.read()).digest())
+    for x in step.after:
+        h.update(hashes[x].encode())
+    return h.hexdigest()
+
+def downstream(graph, name):
+    # the step and every step depending on it, directly or not
+    names = set([name])
+    for x in graph.steps.values():
+        if any(d in names for d in x.after):
+            names.add(x.name)
+    return names
+
+class Checkpoints:
+    # step name -> {inputs, objects, finished}, kept in a local json file and optionally
+    # mirrored in a ConfigMap of the target namespace so that another machine can resume
+    def __init__(self, cluster, namespace, configmap=False):
+        self.cluster = cluster
+        self.namespace = namespace
+        self.configmap = configmap
+        key = hashlib.sha1(("%s/%s" % (kube.current_context(), namespace)).encode()).hexdigest()
+        self.path = os.path.join(cache_dir(), "installs", "%s.json" % key)
+        self.hashes = dict()
+        self.state = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            pass
+        if self.configmap:
+            try:
+                cm = self.cluster.get("v1", "ConfigMap", CONFIGMAP_NAME, self.namespace) or {}
+                return json.loads((cm.get("data") or {}).get("state", "{}"))
+            except (kube.ClusterError, ValueError) as e:
+                logger.info("Unable to read the install state from the cluster: %s" % e)
+        return dict()
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(self.state, f, indent=2, sort_keys=True)
+        os.replace(self.path + ".tmp", self.path)
+        # the ConfigMap can only be written once the namespace is there
+        if self.configmap and "namespace" in self.state:
+            try:
+                self.cluster.apply([{"apiVersion": "v1", "kind": "ConfigMap",
+                                     "metadata": {"name": CONFIGMAP_NAME, "namespace": self.namespace},
+                                     "data": {"state": json.dumps(self.state, sort_keys=True)}}])
+            except kube.ClusterError as e:
+                logger.info("Unable to share the install state: %s" % e)
+
+    def _valid(self, name, get):
+        # the recorded objects must still be there (and rolled out)
+        for x in self.state[name]["objects"]:
+            obj = get(x["apiVersion"], x["kind"], x["name"], x["namespace"])
+            if obj is None:
+                logger.info("Step %s is redone, %s %s is gone" % (name, x["kind"], x["name"]))
+                return False
+            if x["available"] and not readiness.DeploymentAvailable(x["name"], x["namespace"]).check({x["name"]: obj}):
+                logger.info("Step %s is redone, %s %s is not available" % (name, x["kind"], x["name"]))
+                return False
+        return True
+
+    def plan(self, graph, options, from_step='', force=False, get=None):
+        # mark the steps that are done already; a step is redone with any of its dependencies;
+        # get looks the recorded objects up, one cluster get each by default
+        get = get or self.cluster.get
+        rerun = downstream(graph, from_step) if from_step else set()
+        for step in graph.steps.values():
+            self.hashes[step.name] = step_hash(step, options, self.hashes)
+            if force or step.name in rerun or not all(graph.steps[x].skip for x in step.after):
+                continue
+            entry = self.state.get(step.name)
+            if entry is None or entry["inputs"] != self.hashes[step.name]:
+                continue
+            try:
+                step.skip = self._valid(step.name, get)
+            except kube.ClusterError as e:
+                logger.info("Step %s is redone: %s" % (step.name, e))
+        return [x.name for x in graph.steps.values() if x.skip]
+
+    def clear(self):
+        # forget the install, the ConfigMap goes with its namespace
+        self.state = dict()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def record(self, step):
+        self.state[step.name] = {"inputs": self.hashes[step.name], "objects": step.result or [],
+                                 "finished": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                                 "duration": round(step.duration, 1)}
+        self._save()
+
+__all__ = ["Checkpoints", "ref", "refs"]
@@ -0,0 +1,188 @@
+# Copyright 2019 IBM Corporation 
+# 
+# Licensed under the Apache License, Version 2.0 (the "License"); 
+# you may not use this file except in compliance with the License. 
+# You may obtain a copy of the License at 
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0 
+# 
+# Unless required by applicable law or agreed to in writing, software 
+# distributed under the License is distributed on an "AS IS" BASIS, 
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. 
+# See the License for the specific language governing permissions and 
+# limitations under the License. 
+from __future__ import print_function
+import logging
+import queue
+import sys
+import threading
+import time
+from collections import OrderedDict
+from openaihub.func import trace
+
+logger = logging.getLogger(__name__)
+
+# set while a failed run stops its other steps; the waits of the steps check it
+_cancel = threading.Event()
+
+class Cancelled(Exception):
+    pass
+
+def check_cancelled():
+    # raises Cancelled in a step of a run that is stopping
+    if _cancel.is_set():
+        raise Cancelled("another step failed")
+
+class Step:
+    def __init__(self, name, description, func, after, inputs):
+        self.name = name
+        self.description = description
+        self.func = func
+        self.after = list(after)
+        # files the step reads, for checkpoints
+        self.inputs = list(inputs)
+        # set for steps that are done already, with the reason shown in the plan
+        self.skip = False
+        self.skip_reason = "done before"
+        self.result = None
+        self.start = None
+        self.end = None
+
+    @property
+    def duration(self):
+        return self.end - self.start if self.end is not None else 0.0
+
+class Graph:
+    def __init__(self):
+        self.steps = OrderedDict()
+
+    def add(self, name, description, func, after=(), inputs=()):
+        # dependencies must be declared first, which also keeps the graph acyclic
+        if name in self.steps:
+            raise ValueError("step %s is already declared" % name)
+        for x in after:
+            if x not in self.steps:
+                raise ValueError("step %s depends on undeclared step %s" % (name, x))
+        self.steps[name] = Step(name, description, func, after, inputs)
+        return self.steps[name]
+
+    def critical_path(self):
+        # walk back from the step finishing last through the dependency finishing last
+        finished = [x for x in self.steps.values() if x.end is not None]
+        if not finished:
+            return []
+        path = [max(finished, key=lambda x: x.end)]
+        while True:
+            after = [self.steps[x] for x in path[-1].after if self.steps[x].end is not None]
+            if not after:
+                break
+            path.append(max(after, key=lambda x: x.end))
+        return list(reversed(path))
+
+def execute(graph, workers=4, on_done=None):
+    # run every step as soon as its dependencies are done, at most `workers` at a time;
+    # on_done is called with each finished step, one at a time; when a step fails, the steps
+    # still running are cancelled and waited for before its error is raised
+    slots = threading.BoundedSemaphore(max(1, workers))
+    events = queue.Queue()
+    counter = [0]
+    lock = threading.Lock()
+
+    def worker(step):
+        with slots:
+            if _cancel.is_set():
+                events.put((step, Cancelled("another step failed")))
+                return
+            with lock:
+                counter[0] += 1
+                number = counter[0]
+            logger.info("### %s/%s ### %s" % (number, len(graph.steps), step.description))
+            step.start = time.time()
+            try:
+                with trace.span(step.name, "step", step=number, description=step.description):
+                    step.result = step.func()
+                error = None
+            # pylint: disable=broad-except
+            except BaseException as e:
+                error = e
+            step.end = time.time()
+        events.put((step, error))
+
+    _cancel.clear()
+    started = time.time()
+    pending = OrderedDict(graph.steps)
+    done = set()
+    running = 0
+    while pending or running:
+        skipped = False
+        for step in [x for x in pending.values() if all(d in done for d in x.after)]:
+            del pending[step.name]
+            if step.skip:
+                with lock:
+                    counter[0] += 1
+                    number = counter[0]
+                logger.info("### %s/%s ### %s (%s, skipped)" % (number, len(graph.steps), step.description, step.skip_reason))
+                done.add(step.name)
+                skipped = True
+                continue
+            running += 1
+            # daemon threads, so that an interrupt does not wait for the steps
+            thread = threading.Thread(target=worker, args=(step,), name=step.name)
+            thread.daemon = True
+            thread.start()
+        if skipped:
+            # their dependents may be ready now
+            continue
+        step, error = events.get()
+        running -= 1
+        if error is not None:
+            logger.error("Step %s failed after %.1fs" % (step.name, step.duration))
+            _stop(events, running)
+            raise error
+        done.add(step.name)
+        if on_done is not None:
+            on_done(step)
+    return(time.time() - started)
+
+def _stop(events, running):
+    # the steps that are still running must not change the cluster after the run failed, which
+    # matters in processes that outlive the run (openaihub serve)
+    _cancel.set()
+    try:
+        if running:
+            logger.info("Stopping %s running steps..." % running)
+        for _ in range(running):
+            step, error = events.get()
+            if error is not None and not isinstance(error, Cancelled):
+                logger.error("Step %s failed after %.1fs" % (step.name, step.duration))
+    finally:
+        _cancel.clear()
+
+def name_width(graph):
+    # the column of the step names, as wide as the longest
+    return max([24] + [len(x) for x in graph.steps])
+
+def print_plan(graph, describe=None):
+    # what a run is going to do, before anything is changed; describe(step) tells what a step changes
+    print("Plan:")
+    width = name_width(graph)
+    for x in graph.steps.values():
+        print("    %-*s  %s" % (width, x.name, x.skip_reason if x.skip else describe(x) if describe else "will change"))
+    sys.stdout.flush()
+
+def print_summary(graph, elapsed):
+    path = graph.critical_path()
+    names = set(x.name for x in path)
+    serial = sum(x.duration for x in graph.steps.values())
+    skipped = len([x for x in graph.steps.values() if x.skip])
+    print("Finished %s steps in %.1fs (%.1fs if run one after another)%s." % (len(graph.steps) - skipped, elapsed, serial,
+                                                                          ", %s skipped" % skipped if skipped else ""))
+    print("Critical path (*):")
+    width = name_width(graph)
+    for x in graph.steps.values():
+        if x.skip:
+            print("    %-*s  skipped, %s" % (width, x.name, x.skip_reason))
+        else:
+            print("  %s %-*s %8.1fs" % ("*" if x.name in names else " ", width, x.name, x.duration))
+
+__all__ = ["Graph", "Cancelled", "execute", "check_cancelled", "print_plan", "print_summary", "name_width"]
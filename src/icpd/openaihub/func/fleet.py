@@ -0,0 +1,131 @@
+# Copyright 2019 IBM Corporation 
+# 
+# Licensed under the Apache License, Version 2.0 (the "License"); 
+# you may not use this file except in compliance with the License. 
+# You may obtain a copy of the License at 
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0 
+# 
+# Unless required by applicable law or agreed to in writing, software 
+# distributed under the License is distributed on an "AS IS" BASIS, 
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. 
+# See the License for the specific language governing permissions and 
+# limitations under the License. 
+from __future__ import print_function
+import logging
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+from openaihub.func import kube
+
+logger = logging.getLogger(__name__)
+
+def read_contexts(contexts, contexts_file='', all_contexts=False):
+    # repeated or comma separated names, one name per line of a file (# for comments) or every
+    # context of the kubeconfig; in this order and without duplicates
+    names = [x for value in contexts for x in value.split(",") if x.strip()]
+    if contexts_file:
+        with open(contexts_file) as f:
+            names += [x.split("#")[0].strip() for x in f if x.split("#")[0].strip()]
+    if all_contexts:
+        names += kube.list_contexts()
+    unique = []
+    for x in names:
+        if x.strip() not in unique:
+            unique.append(x.strip())
+    return unique
+
+def context_dir(logdir, context):
+    # context names may be ARNs or contain slashes
+    return os.path.join(logdir, re.sub(r"[^\w.@-]", "_", context))
+
+class _LastError(logging.Handler):
+    # keeps the last error message for the report
+    def __init__(self):
+        logging.Handler.__init__(self, logging.ERROR)
+        self.message = ''
+
+    def emit(self, record):
+        self.message = record.getMessage().splitlines()[0]
+
+def run_context(context, command, args, logdir):
+    # runs in a pool process of its own: everything it prints goes to <logdir>/<context>/openaihub.log
+    start = time.time()
+    path = context_dir(logdir, context)
+    os.makedirs(path, exist_ok=True)
+    log = os.path.join(path, "openaihub.log")
+    sys.stdout.flush()
+    sys.stderr.flush()
+    with open(log, "a") as f:
+        os.dup2(f.fileno(), 1)
+        os.dup2(f.fileno(), 2)
+    # the commands parse their own options, the per-operator log file goes next to the context log
+    from openaihub.cli import cli
+    last_error = _LastError()
+    logging.getLogger().addHandler(last_error)
+    kube.use_context(context, os.path.join(path, "kubeconfig"))
+    argv = [command] + list(args)
+    if command in ("install-operator", "register"):
+        argv += ["--logpath", path]
+    returncode = 0
+    try:
+        cli.main(argv, prog_name="openaihub", standalone_mode=False)
+    except SystemExit as e:
+        returncode = e.code if isinstance(e.code, int) else 1
+    except Exception as e: # pylint: disable=broad-except
+        logger.error("Error: %s" % e, exc_info=1)
+        returncode = 1
+    sys.stdout.flush()
+    sys.stderr.flush()
+    return {"context": context, "returncode": returncode, "duration": round(time.time() - start, 1),
+            "log": log, "error": last_error.message if returncode else ''}
+
+def _run_context(job):
+    return run_context(*job)
+
+def run(contexts, command, args, concurrency=4, logdir=''):
+    # one fresh process per context, at most concurrency of them at a time; a slow or hanging
+    # cluster only takes its own slot, results are reported in the order they finish
+    logdir = logdir or "openaihub-fleet-%s" % time.strftime("%Y%m%d-%H%M%S")
+    os.makedirs(logdir, exist_ok=True)
+    logger.info("Running %s on %s contexts, %s at a time, logs in %s" % (command, len(contexts), concurrency, logdir))
+    results = []
+    pool = multiprocessing.get_context("spawn").Pool(min(concurrency, len(contexts)), maxtasksperchild=1)
+    try:
+        jobs = [(x, command, list(args), os.path.abspath(logdir)) for x in contexts]
+        for result in pool.imap_unordered(_run_context, jobs):
+            results.append(result)
+            logger.info("[%s/%s] %s %s in %ss%s" % (len(results), len(contexts), result["context"],
+                                                   "succeeded" if result["returncode"] == 0 else "failed",
+                                                   result["duration"], ": %s" % result["error"] if result["error"] else ""))
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    # the report keeps the order of the contexts as given
+    order = dict((x, i) for i, x in enumerate(contexts))
+    return sorted(results, key=lambda x: order[x["context"]])
+
+def print_report(results, elapsed):
+    width = max([len("CONTEXT")] + [len(x["context"]) for x in results])
+    print("%-*s  %-9s %9s  %s" % (width, "CONTEXT", "STATUS", "DURATION", "LOG"))
+    for x in results:
+        status = "ok" if x["returncode"] == 0 else "failed(%s)" % x["returncode"]
+        print("%-*s  %-9s %8.1fs  %s" % (width, x["context"], status, x["duration"], x["log"]))
+    failed = [x for x in results if x["returncode"] != 0]
+    print("%s succeeded, %s failed in %.1fs" % (len(results) - len(failed), len(failed), elapsed))
+    for x in failed:
+        if x["error"]:
+            print("  %s: %s" % (x["context"], x["error"]))
+    sys.stdout.flush()
+
+def write_report(path, results, elapsed):
+    with open(path, "w") as f:
+        json.dump({"elapsed": round(elapsed, 1), "results": results}, f, indent=2, sort_keys=True)
+
+__all__ = ["read_contexts", "run", "print_report", "write_report"]
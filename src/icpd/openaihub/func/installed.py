@@ -0,0 +1,163 @@
+# Copyright 2019 IBM Corporation 
+# 
+# Licensed under the Apache License, Version 2.0 (the "License"); 
+# you may not use this file except in compliance with the License. 
+# You may obtain a copy of the License at 
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0 
+# 
+# Unless required by applicable law or agreed to in writing, software 
+# distributed under the License is distributed on an "AS IS" BASIS, 
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. 
+# See the License for the specific language governing permissions and 
+# limitations under the License. 
+from __future__ import print_function
+import logging
+import calendar
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import yaml
+from openaihub.func import kube
+from openaihub.func import readiness
+
+logger = logging.getLogger(__name__)
+
+CSV_API_VERSION = "operators.coreos.com/v1alpha1"
+CSV_KIND = "ClusterServiceVersion"
+
+# more namespaces than this are listed with one cluster-scoped call and filtered here
+CLUSTER_SCOPE_THRESHOLD = 8
+
+COLUMNS = [("NAMESPACE", "namespace"), ("NAME", "name"), ("VERSION", "version"), ("PHASE", "phase"), ("AGE", "age")]
+
+def age(timestamp, now=None):
+    # same short form as kubectl, e.g. 45s, 12m, 5h, 3d
+    if not timestamp:
+        return "<unknown>"
+    seconds = int((now or time.time()) - calendar.timegm(time.strptime(timestamp, "%Y-%m-%dT%H:%M:%SZ")))
+    for unit, size in [("d", 86400), ("h", 3600), ("m", 60)]:
+        if seconds >= size:
+            return "%s%s" % (seconds // size, unit)
+    return "%ss" % max(0, seconds)
+
+def row(csv):
+    meta = csv.get("metadata", {})
+    status = csv.get("status") or {}
+    return {"namespace": meta.get("namespace"), "name": meta.get("name"),
+            "displayName": csv.get("spec", {}).get("displayName"), "version": csv.get("spec", {}).get("version"),
+            "phase": status.get("phase"), "reason": status.get("reason"),
+            "created": meta.get("creationTimestamp"), "age": age(meta.get("creationTimestamp"))}
+
+def scopes(namespaces, all_namespaces):
+    # None stands for one cluster-scoped list or watch
+    if all_namespaces or len(namespaces) > CLUSTER_SCOPE_THRESHOLD:
+        return [None]
+    return list(namespaces)
+
+def list_installed(cluster, namespaces, all_namespaces=False):
+    wanted = None if all_namespaces else set(namespaces)
+    targets = scopes(namespaces, all_namespaces)
+    if targets == [None]:
+        try:
+            items = cluster.list(CSV_API_VERSION, CSV_KIND)
+            return sorted((row(x) for x in items if wanted is None or x["metadata"].get("namespace") in wanted),
+                          key=lambda x: (x["namespace"], x["name"]))
+        except kube.ClusterError as e:
+            if all_namespaces:
+                raise
+            # not allowed to list cluster-wide, fall back to the namespaces one by one
+            logger.info("Listing in all namespaces failed, listing each namespace: %s" % e)
+            targets = list(namespaces)
+    with ThreadPoolExecutor(max_workers=min(16, len(targets))) as pool:
+        lists = list(pool.map(lambda ns: cluster.list(CSV_API_VERSION, CSV_KIND, ns), targets))
+    return sorted((row(x) for items in lists for x in items), key=lambda x: (x["namespace"], x["name"]))
+
+class Printer:
+    def __init__(self, output, events=False):
+        self.output = output
+        self.events = events
+        self.lock = threading.Lock()
+        self.widths = None
+
+    def _table(self, rows):
+        columns = ([("EVENT", "event")] if self.events else []) + COLUMNS
+        # the columns of later events keep the widths of the first listing
+        widths = self.widths or [max([len(title)] + [len(str(x.get(key) or "")) for x in rows]) for title, key in columns]
+        lines = []
+        if not self.widths:
+            lines.append("   ".join(title.ljust(w) for (title, key), w in zip(columns, widths)).rstrip())
+            self.widths = widths
+        for x in rows:
+            lines.append("   ".join(str(x.get(key) or "").ljust(w) for (title, key), w in zip(columns, widths)).rstrip())
+        return lines
+
+    def print(self, rows):
+        with self.lock:
+            if self.output == "name":
+                lines = [x["name"] for x in rows]
+            elif self.output == "json" and self.events:
+                # one object per line, so the stream can be read line by line
+                lines = [json.dumps(x, sort_keys=True) for x in rows]
+            elif self.output == "json":
+                lines = [json.dumps(rows, indent=2, sort_keys=True)]
+            elif self.output == "yaml" and self.events:
+                lines = ["---\n" + yaml.safe_dump(x, default_flow_style=False).rstrip() for x in rows]
+            elif self.output == "yaml":
+                lines = [yaml.safe_dump(rows, default_flow_style=False).rstrip()]
+            else:
+                lines = self._table(rows) if rows or not self.events else []
+            for x in lines:
+                print(x)
+            sys.stdout.flush()
+
+class Changes(readiness.Condition):
+    # a condition that never holds: it prints what changed in the watched CSVs at every event
+    api_version = CSV_API_VERSION
+    kind = CSV_KIND
+
+    def __init__(self, namespace, wanted, printer):
+        readiness.Condition.__init__(self, namespace=namespace)
+        self.wanted = wanted
+        self.printer = printer
+        self.seen = dict()
+
+    def check(self, objects):
+        current = dict((key, row(x)) for key, x in objects.items() if self.wanted is None or key[0] in self.wanted)
+        changes = []
+        for key, x in sorted(current.items()):
+            previous = self.seen.get(key)
+            if previous is None:
+                changes.append(dict(x, event="ADDED"))
+            elif dict(previous, age=None) != dict(x, age=None):
+                changes.append(dict(x, event="MODIFIED"))
+        for key in sorted(set(self.seen) - set(current)):
+            changes.append(dict(self.seen[key], event="DELETED"))
+        self.seen = current
+        if changes:
+            self.printer.print(changes)
+        return False
+
+    def __str__(self):
+        return "changes of clusterserviceversions in %s" % (self.namespace or "all namespaces")
+
+def watch_installed(namespaces, all_namespaces, printer):
+    wanted = None if all_namespaces else set(namespaces)
+    threads = []
+    for x in scopes(namespaces, all_namespaces):
+        waiter = readiness.Waiter(Changes(x, wanted, printer))
+        # runs until interrupted
+        thread = threading.Thread(target=waiter.wait, args=(10 * 365 * 86400,), name="watch-%s" % (x or "all"))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    try:
+        while any(x.is_alive() for x in threads):
+            for x in threads:
+                x.join(1)
+    except KeyboardInterrupt:
+        pass
+
+__all__ = ["list_installed", "watch_installed", "Printer", "row", "age"]
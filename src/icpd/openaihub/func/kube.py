@@ -0,0 +1,477 @@
+# Copyright 2019 IBM Corporation 
+# 
+# Licensed under the Apache License, Version 2.0 (the "License"); 
+# you may not use this file except in compliance with the License. 
+# You may obtain a copy of the License at 
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0 
+# 
+# Unless required by applicable law or agreed to in writing, software 
+# distributed under the License is distributed on an "AS IS" BASIS, 
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. 
+# See the License for the specific language governing permissions and 
+# limitations under the License. 
+from __future__ import print_function
+import logging
+import hashlib
+import json
+import os
+import shlex
+import subprocess
+import threading
+import time
+import yaml
+
+logger = logging.getLogger(__name__)
+
+FIELD_MANAGER = "openaihub"
+
+# seconds the on-disk API discovery of a cluster is reused
+DISCOVERY_TTL = int(os.getenv("OPENAIHUB_DISCOVERY_TTL", "600"))
+
+# kinds applied before the rest of a bundle
+APPLY_FIRST = ["Namespace", "CustomResourceDefinition", "ServiceAccount", "ClusterRole", "Role"]
+
+# the CRD API, v1 from 1.16 on and v1beta1 before
+CRD_API_VERSIONS = ["apiextensions.k8s.io/v1", "apiextensions.k8s.io/v1beta1"]
+
+# server-populated fields that must not be sent back when applying an object read from the cluster
+READ_ONLY_METADATA = ["managedFields", "resourceVersion", "uid", "creationTimestamp", "generation", "selfLink"]
+
+class ClusterError(Exception):
+    pass
+
+class KindNotServed(ClusterError):
+    # the API of the kind is not registered (yet), e.g. a CRD installed by an operator
+    pass
+
+def load_documents(path):
+    with open(path) as f:
+        return [x for x in yaml.safe_load_all(f) if x]
+
+def split_api_version(api_version):
+    group, _, version = api_version.rpartition("/")
+    return(group, version)
+
+def strip_object(doc):
+    doc = dict(doc)
+    doc.pop("status", None)
+    doc["metadata"] = dict((k, v) for k, v in doc.get("metadata", {}).items() if k not in READ_ONLY_METADATA)
+    return(doc)
+
+class _ExecStdin:
+    # write-only file object over the stdin channel of an exec session, sent in chunks
+    def __init__(self, resp, chunk_size=64 * 1024):
+        self.resp = resp
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer.extend(data)
+        while len(self.buffer) >= self.chunk_size:
+            self._send(bytes(self.buffer[:self.chunk_size]))
+            del self.buffer[:self.chunk_size]
+        return len(data)
+
+    def flush(self):
+        if self.buffer:
+            self._send(bytes(self.buffer))
+            self.buffer = bytearray()
+
+    def _send(self, data):
+        if not self.resp.is_open():
+            raise IOError("the exec session was closed: %s" % self.resp.read_stderr().decode(errors="replace"))
+        self.resp.write_stdin(data)
+        # take in whatever the command printed so far, the server never blocks on us
+        self.resp.update(timeout=0)
+
+class Cluster:
+    # operations shared by both backends, built on get/create/apply/patch/delete
+
+    def exists(self, api_version, kind, name, namespace=None):
+        return self.get(api_version, kind, name, namespace) is not None
+
+    def apply_file(self, path, namespace=None):
+        return self.apply(load_documents(path), namespace)
+
+    def create_namespace(self, name, openshift=False):
+        if openshift:
+            # same as oc new-project, the project request sets up the default service accounts and roles
+            self.create({"apiVersion": "project.openshift.io/v1", "kind": "ProjectRequest", "metadata": {"name": name}})
+        else:
+            self.create({"apiVersion": "v1", "kind": "Namespace", "metadata": {"name": name}})
+
+    def create_configmap(self, name, namespace, data):
+        metadata = {"name": name}
+        if namespace:
+            metadata["namespace"] = namespace
+        self.create({"apiVersion": "v1", "kind": "ConfigMap", "metadata": metadata, "data": data})
+
+    def list_crds(self):
+        # the apiVersion the server serves CRDs with and the CRDs, (None, []) when it serves none
+        for x in CRD_API_VERSIONS:
+            try:
+                return x, self.list(x, "CustomResourceDefinition")
+            except KindNotServed:
+                continue
+        return None, []
+
+class ApiCluster(Cluster):
+    # one ApiClient (and so one urllib3 connection pool) and one DynamicClient whose
+    # API discovery is cached on disk, shared by every command of the process
+    def __init__(self, context=None):
+        from kubernetes import client, config
+        from openshift.dynamic import DynamicClient
+        self.context = context
+        configuration = client.Configuration()
+        config.load_kube_config(context=context, client_configuration=configuration)
+        # room for the concurrent calls of apply and the snapshot, and the watches of uninstall
+        configuration.connection_pool_maxsize = 32
+        self.api_client = client.ApiClient(configuration)
+        # pylint: disable=unused-variable
+        contexts, active = config.list_kube_config_contexts()
+        if context:
+            active = [x for x in contexts if x["name"] == context][0]
+        self.default_namespace = active.get("context", {}).get("namespace", "default")
+        self.dynamic = DynamicClient(self.api_client, cache_file=self._discovery_cache())
+        self._resources = dict()
+        self._lock = threading.Lock()
+        self.server_side_apply = True
+
+    def _discovery_cache(self):
+        from openaihub.func.manifests import cache_dir
+        path = os.path.join(cache_dir(), "discovery")
+        os.makedirs(path, exist_ok=True)
+        host = hashlib.sha1(self.api_client.configuration.host.encode()).hexdigest()
+        path = os.path.join(path, "%s.json" % host)
+        # discovery older than the TTL is redone, the cluster may serve new APIs (e.g. from a new operator)
+        try:
+            if time.time() - os.path.getmtime(path) > DISCOVERY_TTL:
+                os.remove(path)
+        except OSError:
+            pass
+        return path
+
+    def resource(self, api_version, kind):
+        # every discovery lookup goes through the lock, a miss refreshes the discovery cache the
+        # lookups of the other threads read
+        key = (api_version, kind)
+        with self._lock:
+            if key not in self._resources:
+                self._resources[key] = self.dynamic.resources.get(api_version=api_version, kind=kind)
+            return self._resources[key]
+
+    def _namespace(self, resource, namespace, doc=None):
+        if not resource.namespaced:
+            return None
+        return namespace or (doc or {}).get("metadata", {}).get("namespace") or self.default_namespace
+
+    def _error(self, action, kind, name, e):
+        message = getattr(e, "summary", lambda: None)() or getattr(e, "reason", None) or str(e)
+        return ClusterError("%s %s %s: %s" % (action, kind, name, message))
+
+    def get(self, api_version, kind, name, namespace=None):
+        from kubernetes.dynamic.exceptions import NotFoundError, DynamicApiError, ResourceNotFoundError
+        try:
+            resource = self.resource(api_version, kind)
+            return resource.get(name=name, namespace=self._namespace(resource, namespace)).to_dict()
+        except NotFoundError:
+            return None
+        except ResourceNotFoundError:
+            raise KindNotServed("get %s %s: the server does not serve %s" % (kind, name, api_version))
+        except DynamicApiError as e:
+            raise self._error("get", kind, name, e)
+
+    def list(self, api_version, kind, namespace=None, label_selector=None):
+        from kubernetes.dynamic.exceptions import DynamicApiError, ResourceNotFoundError
+        try:
+            resource = self.resource(api_version, kind)
+            namespace = namespace if resource.namespaced else None
+            return resource.get(namespace=namespace, label_selector=label_selector).to_dict().get("items") or []
+        except ResourceNotFoundError:
+            raise KindNotServed("list %s: the server does not serve %s" % (kind, api_version))
+        except DynamicApiError as e:
+            raise self._error("list", kind, label_selector or "", e)
+
+    def create(self, doc, namespace=None):
+        from kubernetes.dynamic.exceptions import DynamicApiError, ResourceNotFoundError
+        try:
+            resource = self.resource(doc["apiVersion"], doc["kind"])
+            return self.dynamic.create(resource, body=doc, namespace=self._namespace(resource, namespace, doc)).to_dict()
+        except ResourceNotFoundError:
+            raise KindNotServed("create %s %s: the server does not serve %s" % (doc["kind"], doc["metadata"]["name"], doc["apiVersion"]))
+        except DynamicApiError as e:
+            raise self._error("create", doc["kind"], doc["metadata"]["name"], e)
+
+    def _apply(self, doc, namespace=None, dry_run=False):
+        from kubernetes.dynamic.exceptions import DynamicApiError, NotFoundError, ResourceNotFoundError
+        doc = strip_object(doc)
+        name = doc["metadata"]["name"]
+        options = {"dry_run": "All"} if dry_run else {}
+        try:
+            resource = self.resource(doc["apiVersion"], doc["kind"])
+            ns = self._namespace(resource, namespace, doc)
+            if self.server_side_apply:
+                try:
+                    return self.dynamic.server_side_apply(resource, body=doc, name=name, namespace=ns,
+                                                          field_manager=FIELD_MANAGER, force_conflicts=True, **options).to_dict()
+                except DynamicApiError as e:
+                    # servers before 1.16 do not know the apply patch type
+                    if e.status != 415:
+                        raise
+                    logger.info("Server-side apply is not supported, falling back to create or merge patch")
+                    self.server_side_apply = False
+            try:
+                return self.dynamic.patch(resource, body=doc, name=name, namespace=ns,
+                                          content_type="application/merge-patch+json", **options).to_dict()
+            except NotFoundError:
+                return self.dynamic.create(resource, body=doc, namespace=ns, **options).to_dict()
+        except ResourceNotFoundError:
+            raise KindNotServed("apply %s %s: the server does not serve %s" % (doc["kind"], name, doc["apiVersion"]))
+        except DynamicApiError as e:
+            raise self._error("apply", doc["kind"], name, e)
+
+    def apply(self, docs, namespace=None, dry_run=False):
+        # a bundle in two waves of concurrent requests: the objects others live in or refer to, then the rest
+        from concurrent.futures import ThreadPoolExecutor
+        docs = list(docs)
+        applied = [None] * len(docs)
+        for wave in [[i for i, x in enumerate(docs) if x["kind"] in APPLY_FIRST],
+                     [i for i, x in enumerate(docs) if x["kind"] not in APPLY_FIRST]]:
+            if len(wave) == 1:
+                applied[wave[0]] = self._apply(docs[wave[0]], namespace, dry_run)
+            elif wave:
+                with ThreadPoolExecutor(max_workers=min(8, len(wave))) as pool:
+                    for i, result in zip(wave, pool.map(lambda i: self._apply(docs[i], namespace, dry_run), wave)):
+                        applied[i] = result
+        return applied
+
+    def patch(self, api_version, kind, name, body, namespace=None):
+        from kubernetes.dynamic.exceptions import DynamicApiError
+        try:
+            resource = self.resource(api_version, kind)
+            return self.dynamic.patch(resource, body=body, name=name, namespace=self._namespace(resource, namespace),
+                                      content_type="application/strategic-merge-patch+json").to_dict()
+        except DynamicApiError as e:
+            raise self._error("patch", kind, name, e)
+
+    def delete(self, api_version, kind, name, namespace=None):
+        # returns once the deletion is accepted, objects with finalizers are gone only later
+        from kubernetes.dynamic.exceptions import DynamicApiError, NotFoundError, ResourceNotFoundError
+        try:
+            resource = self.resource(api_version, kind)
+            self.dynamic.delete(resource, name=name, namespace=self._namespace(resource, namespace))
+        except NotFoundError:
+            pass
+        except ResourceNotFoundError:
+            raise KindNotServed("delete %s %s: the server does not serve %s" % (kind, name, api_version))
+        except DynamicApiError as e:
+            raise self._error("delete", kind, name, e)
+
+    def server_version(self):
+        # e.g. v1.13.8 for v1.13.8+IKS
+        return self.dynamic.version["kubernetes"]["gitVersion"].split("+")[0]
+
+    def exec_stdin(self, name, container, command, produce, namespace=None, timeout=600):
+        # run command in the container with produce(f) streamed to its stdin, all in one exec session
+        from kubernetes import client
+        from kubernetes.client.rest import ApiException
+        from kubernetes.stream import stream
+        try:
+            from kubernetes.stream.ws_client import STDIN_CHANNEL, V5_CHANNEL_PROTOCOL
+        except ImportError:
+            # clients before 36.0.0 cannot close stdin or send binary stdin, kubectl can
+            logger.info("The kubernetes client has no v5 exec protocol, running %s with kubectl" % command)
+            return ShellCluster().exec_stdin(name, container, command, produce, namespace or self.default_namespace, timeout)
+        # stream() swaps the request method of the client it is given, so the session gets a client of its own
+        core = client.CoreV1Api(client.ApiClient(self.api_client.configuration))
+        try:
+            resp = stream(core.connect_get_namespaced_pod_exec, name, namespace or self.default_namespace,
+                          container=container, command=command, stdin=True, stdout=True, stderr=True, tty=False,
+                          binary=True, _preload_content=False)
+        except ApiException as e:
+            raise self._error("exec", "Pod", name, e)
+        try:
+            stdin = _ExecStdin(resp)
+            produce(stdin)
+            stdin.flush()
+            if resp.subprotocol != V5_CHANNEL_PROTOCOL:
+                # before v5 stdin cannot be half-closed, closing the session is what ends it
+                logger.info("Exec protocol %s has no stdin close, the exit code of %s is not known" % (resp.subprotocol, command))
+                return None
+            resp.close_channel(STDIN_CHANNEL)
+            resp.run_forever(timeout=timeout)
+            if resp.is_open():
+                raise ClusterError("exec %s in pod %s: no exit after %ss" % (command, name, timeout))
+            if resp.returncode != 0:
+                raise ClusterError("exec %s in pod %s failed with Error: %s" % (command, name, resp.read_stderr().decode(errors="replace")))
+            return resp.returncode
+        except IOError as e:
+            raise ClusterError("exec %s in pod %s: %s" % (command, name, e))
+        finally:
+            resp.close()
+
+class ShellCluster(Cluster):
+    # the former kubectl code path, one process per call
+    def __init__(self):
+        self.default_namespace = None
+
+    def _run(self, cmd, input=None):
+        from openaihub.func import run
+        ret = run(cmd, input=input)
+        if ret.returncode != 0:
+            raise ClusterError("Command %s failed with Error: %s" % (cmd, ret.stderr.decode()))
+        return ret.stdout.decode()
+
+    def _type(self, api_version, kind):
+        group, _ = split_api_version(api_version)
+        return "%s.%s" % (kind.lower(), group) if group else kind.lower()
+
+    def _ns(self, namespace):
+        return " -n %s" % namespace if namespace else ""
+
+    def get(self, api_version, kind, name, namespace=None):
+        from openaihub.func import run
+        ret = run("kubectl get %s %s -o json%s" % (self._type(api_version, kind), name, self._ns(namespace)))
+        return json.loads(ret.stdout.decode()) if ret.returncode == 0 else None
+
+    def get_many(self, refs):
+        # (apiVersion, kind, name, namespace) -> object or None, one kubectl get per namespace
+        objects = dict((x, None) for x in refs)
+        groups = dict()
+        for x in refs:
+            groups.setdefault(x[3], []).append(x)
+        for namespace, group in groups.items():
+            names = " ".join("%s/%s" % (self._type(api_version, kind), name) for api_version, kind, name, _ in group)
+            try:
+                out = self._run("kubectl get %s -o json --ignore-not-found%s" % (names, self._ns(namespace)))
+            except ClusterError:
+                # e.g. a kind that is not served yet fails the whole get, ask for each on its own
+                for x in group:
+                    objects[x] = self.get(*x)
+                continue
+            data = json.loads(out) if out.strip() else {"items": []}
+            found = dict(((x["kind"], x["metadata"]["name"]), x) for x in (data["items"] if "items" in data else [data]))
+            for x in group:
+                objects[x] = found.get((x[1], x[2]))
+        return objects
+
+    def _run_kind(self, cmd):
+        # _run, KindNotServed when the server does not know the kind
+        try:
+            return self._run(cmd)
+        except ClusterError as e:
+            if "doesn't have a resource type" in str(e):
+                raise KindNotServed(str(e))
+            raise
+
+    def list(self, api_version, kind, namespace=None, label_selector=None):
+        selector = " -l %s" % label_selector if label_selector else ""
+        out = self._run_kind("kubectl get %s -o json%s%s" % (self._type(api_version, kind), self._ns(namespace), selector))
+        return json.loads(out)["items"]
+
+    def list_crds(self):
+        # kubectl asks for the version the server serves, the items tell which one it was
+        crds = self.list(CRD_API_VERSIONS[0], "CustomResourceDefinition")
+        return (crds[0]["apiVersion"] if crds else CRD_API_VERSIONS[0]), crds
+
+    def create(self, doc, namespace=None):
+        if doc["kind"] == "ProjectRequest":
+            return self._run("oc new-project %s" % doc["metadata"]["name"])
+        return self._run("kubectl create -f -%s" % self._ns(namespace), input=yaml.safe_dump(doc).encode())
+
+    def apply(self, docs, namespace=None, dry_run=False):
+        # the whole bundle in one kubectl process
+        try:
+            return self._run("kubectl apply -f -%s%s" % (self._ns(namespace), " --dry-run=server" if dry_run else ""),
+                             input=yaml.safe_dump_all([strip_object(x) for x in docs]).encode())
+        except ClusterError as e:
+            if "no matches for kind" in str(e):
+                raise KindNotServed(str(e))
+            raise
+
+    def apply_file(self, path, namespace=None):
+        return self._run("kubectl apply -f %s%s" % (path, self._ns(namespace)))
+
+    def patch(self, api_version, kind, name, body, namespace=None):
+        return self._run("kubectl patch %s %s --patch '%s'%s" % (self._type(api_version, kind), name, json.dumps(body), self._ns(namespace)))
+
+    def delete(self, api_version, kind, name, namespace=None):
+        # same as the API, kubectl would otherwise block until the finalizers are done
+        return self._run_kind("kubectl delete %s %s --ignore-not-found --wait=false%s" % (self._type(api_version, kind), name, self._ns(namespace)))
+
+    def exec_stdin(self, name, container, command, produce, namespace=None, timeout=600):
+        cmd = "kubectl exec -i %s -c %s%s -- %s" % (name, container, self._ns(namespace), " ".join(shlex.quote(x) for x in command))
+        proc = subprocess.Popen(cmd, shell=True, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        try:
+            produce(proc.stdin)
+            proc.stdin.close()
+        except IOError:
+            # the command ended early, its error output tells why
+            pass
+        try:
+            stderr = proc.stderr.read()
+            proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            raise ClusterError("Command %s did not exit after %ss" % (cmd, timeout))
+        logger.info("Command: %s, Returncode: %s" % (cmd, proc.returncode))
+        if proc.returncode != 0:
+            raise ClusterError("Command %s failed with Error: %s" % (cmd, stderr.decode()))
+        return proc.returncode
+
+    def server_version(self):
+        return self._run("kubectl version --short|grep Server|awk '{ print $3;exit}'|cut -d'+' -f1").rstrip()
+
+_api = None
+_shell = False
+_context = None
+_lock = threading.Lock()
+
+def configure(shell=False):
+    global _shell
+    _shell = shell
+
+def use_context(context, path):
+    # run the rest of the process against another kubeconfig context: the in-process client is
+    # created for it, and kubectl, oc and helm read it from the file at path, put first in KUBECONFIG
+    global _api, _context
+    with open(path, "w") as f:
+        yaml.safe_dump({"apiVersion": "v1", "kind": "Config", "current-context": context}, f, default_flow_style=False)
+    kubeconfig = os.getenv("KUBECONFIG") or os.path.expanduser("~/.kube/config")
+    os.environ["KUBECONFIG"] = os.pathsep.join([os.path.abspath(path), kubeconfig])
+    with _lock:
+        _api = None
+        _context = context
+
+def list_contexts():
+    from kubernetes import config
+    # pylint: disable=unused-variable
+    contexts, active = config.list_kube_config_contexts()
+    return [x["name"] for x in contexts]
+
+def api():
+    # the in-process client; waits and watches always go through it
+    global _api
+    with _lock:
+        if _api is None:
+            _api = ApiCluster(_context)
+        return _api
+
+def cluster():
+    # the backend for cluster operations, kubectl only when asked for
+    return ShellCluster() if _shell else api()
+
+def current_context():
+    # the active kubeconfig context, without connecting to its cluster
+    from kubernetes import config
+    try:
+        # pylint: disable=unused-variable
+        contexts, active = config.list_kube_config_contexts()
+        if _context:
+            active = [x for x in contexts if x["name"] == _context][0]
+        return "%s@%s" % (active["name"], active.get("context", {}).get("cluster", ""))
+    except (config.ConfigException, IOError, IndexError, KeyError, TypeError):
+        return _context or "default"
+
+__all__ = ["Cluster", "ApiCluster", "ShellCluster", "ClusterError", "KindNotServed", "CRD_API_VERSIONS", "configure", "use_context", "list_contexts", "api", "cluster", "current_context", "load_documents"]
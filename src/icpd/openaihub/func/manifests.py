@@ -0,0 +1,145 @@
+# Copyright 2019 IBM Corporation 
+# 
+# Licensed under the Apache License, Version 2.0 (the "License"); 
+# you may not use this file except in compliance with the License. 
+# You may obtain a copy of the License at 
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0 
+# 
+# Unless required by applicable law or agreed to in writing, software 
+# distributed under the License is distributed on an "AS IS" BASIS, 
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. 
+# See the License for the specific language governing permissions and 
+# limitations under the License. 
+from __future__ import print_function
+import logging
+import os
+import re
+import json
+import shutil
+import tempfile
+import time
+import openaihub
+
+logger = logging.getLogger(__name__)
+
+OPENAIHUB_GIT_URL = "https://github.com/adrian555/icpd.git"
+
+# manifests shipped with the package, laid out like src/ of the icpd repo
+BUNDLED_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "manifests")
+
+# the directories of src/ that the installer reads
+MANIFEST_DIRS = ["registry", "requirement", "patch"]
+
+# seconds a ref resolved by this process is used without another ls-remote, for long-lived processes
+REF_TTL = int(os.getenv("OPENAIHUB_REF_TTL", "300"))
+
+# url#ref -> (commit, time resolved)
+_resolved = dict()
+
+def cache_dir():
+    return os.path.join(os.getenv("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "openaihub")
+
+class ManifestStore:
+    def __init__(self, root, version, source):
+        self.root = root
+        self.version = version
+        self.source = source
+
+    def path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+def bundled_store():
+    return ManifestStore(BUNDLED_PATH, openaihub.version, "bundled")
+
+def local_store(path):
+    # accept the repo root, its src/ directory or a directory laid out like the bundled manifests
+    for root in (os.path.join(path, "src"), path):
+        if all(os.path.isdir(os.path.join(root, x)) for x in MANIFEST_DIRS):
+            return ManifestStore(os.path.abspath(root), "local", path)
+    raise ValueError("directory %s does not contain %s" % (path, ", ".join(MANIFEST_DIRS)))
+
+def parse_git_source(source):
+    # <ref>, <url> or <url>#<ref>
+    if "://" in source or source.startswith("git@") or source.endswith(".git") or "#" in source:
+        url, _, ref = source.partition("#")
+        return(url or OPENAIHUB_GIT_URL, ref or "HEAD")
+    return(OPENAIHUB_GIT_URL, source)
+
+def _ref_index_path():
+    return os.path.join(cache_dir(), "manifests", "refs.json")
+
+def _load_ref_index():
+    try:
+        with open(_ref_index_path()) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return dict()
+
+def _save_ref_index(index):
+    path = _ref_index_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump(index, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+def resolve_ref(url, ref):
+    if re.match(r"^[0-9a-f]{40}$", ref):
+        return(ref)
+    from git import Git, GitCommandError
+    key = "%s#%s" % (url, ref)
+    if key in _resolved and time.time() - _resolved[key][1] < REF_TTL:
+        return(_resolved[key][0])
+    index = _load_ref_index()
+    try:
+        # ls-remote only exchanges refs, no objects are fetched
+        out = Git().ls_remote(url, ref)
+    except GitCommandError as e:
+        if key in index:
+            logger.info("Unable to reach %s, using cached commit %s for %s" % (url, index[key], ref))
+            return(index[key])
+        raise ValueError("unable to resolve %s at %s: %s" % (ref, url, e))
+    lines = [x.split("\t") for x in out.splitlines() if x]
+    if not lines:
+        raise ValueError("ref %s not found at %s" % (ref, url))
+    # prefer the peeled commit of an annotated tag
+    commit = dict((name, sha) for sha, name in lines).get("refs/tags/%s^{}" % ref, lines[0][0])
+    index[key] = commit
+    _save_ref_index(index)
+    _resolved[key] = (commit, time.time())
+    return(commit)
+
+def git_store(source):
+    url, ref = parse_git_source(source)
+    commit = resolve_ref(url, ref)
+    basedir = os.path.join(cache_dir(), "manifests", commit)
+    if not os.path.isdir(basedir):
+        from git import Repo
+        logger.info("Cloning %s at %s into the manifest cache..." % (url, commit))
+        os.makedirs(os.path.dirname(basedir), exist_ok=True)
+        # clone next to the cache entry so that it can be renamed into place
+        tempdir = tempfile.mkdtemp(prefix="clone-", dir=os.path.dirname(basedir))
+        try:
+            repo = Repo.clone_from(url, os.path.join(tempdir, "repo"), no_checkout=True)
+            repo.git.checkout(commit)
+            staging = os.path.join(tempdir, "src")
+            for x in MANIFEST_DIRS:
+                shutil.copytree(os.path.join(repo.working_tree_dir, "src", x), os.path.join(staging, x))
+            try:
+                os.rename(staging, basedir)
+            except OSError:
+                # another process cached the same commit first
+                if not os.path.isdir(basedir):
+                    raise
+        finally:
+            shutil.rmtree(tempdir, ignore_errors=True)
+    return ManifestStore(basedir, commit, source)
+
+def open_store(source=''):
+    if source == '':
+        return bundled_store()
+    if os.path.isdir(source):
+        return local_store(source)
+    return git_store(source)
+
+__all__ = ["ManifestStore", "open_store", "bundled_store", "local_store", "git_store"]
@@ -0,0 +1,160 @@
+# Copyright 2019 IBM Corporation 
+# 
+# Licensed under the Apache License, Version 2.0 (the "License"); 
+# you may not use this file except in compliance with the License. 
+# You may obtain a copy of the License at 
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0 
+# 
+# Unless required by applicable law or agreed to in writing, software 
+# distributed under the License is distributed on an "AS IS" BASIS, 
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. 
+# See the License for the specific language governing permissions and 
+# limitations under the License. 
+from __future__ import print_function
+import logging
+import hashlib
+import json
+import os
+import threading
+import time
+from openaihub.func import kube
+from openaihub.func import readiness
+from openaihub.func.manifests import cache_dir
+
+logger = logging.getLogger(__name__)
+
+API_VERSION = "packages.operators.coreos.com/v1"
+KIND = "PackageManifest"
+
+# seconds a saved index is used without asking the package-server
+PACKAGE_TTL = int(os.getenv("OPENAIHUB_PACKAGE_TTL", "300"))
+
+def images(desc):
+    # the operator image and the related (operand) images a CSV description names
+    desc = desc or {}
+    found = [(desc.get("annotations") or {}).get("containerImage")]
+    found += [x.get("image") if isinstance(x, dict) else x for x in desc.get("relatedImages") or []]
+    return sorted(set(x for x in found if x))
+
+def summary(obj):
+    # the part of a packagemanifest the commands use, without the icons and descriptions
+    status = obj.get("status") or {}
+    return {"name": obj["metadata"]["name"], "namespace": obj["metadata"].get("namespace"),
+            "labels": obj["metadata"].get("labels") or {},
+            "packageName": status.get("packageName", obj["metadata"]["name"]),
+            "catalogSource": status.get("catalogSource"), "catalogSourceNamespace": status.get("catalogSourceNamespace"),
+            "provider": (status.get("provider") or {}).get("name"),
+            "defaultChannel": status.get("defaultChannel"),
+            "channels": [{"name": x["name"], "currentCSV": x.get("currentCSV"), "images": images(x.get("currentCSVDesc"))}
+                         for x in status.get("channels") or []]}
+
+class PackageIndex:
+    # the packagemanifests of a namespace by name, catalog source, provider and default channel;
+    # filled with one list, kept current by the watches of wait() and saved for PACKAGE_TTL seconds
+    def __init__(self, namespace, ttl=PACKAGE_TTL):
+        self.namespace = namespace
+        self.ttl = ttl
+        key = hashlib.sha1(("%s/%s" % (kube.current_context(), namespace)).encode()).hexdigest()
+        self.path = os.path.join(cache_dir(), "packages", "%s.json" % key)
+        self.packages = dict()
+        self.by_catalog = dict()
+        self.by_provider = dict()
+        self.by_channel = dict()
+        # when this process last listed or watched the cluster, the index read from disk is older
+        self.listed = None
+        self._lock = threading.RLock()
+        self._load()
+
+    def _load(self):
+        try:
+            if time.time() - os.path.getmtime(self.path) > self.ttl:
+                return
+            with open(self.path) as f:
+                self._replace(json.load(f))
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path + ".tmp", "w") as f:
+                json.dump(sorted(self.packages.values(), key=lambda x: x["name"]), f, sort_keys=True)
+            os.replace(self.path + ".tmp", self.path)
+        except (IOError, OSError) as e:
+            logger.info("Unable to save the packagemanifest index: %s" % e)
+
+    def _replace(self, summaries):
+        with self._lock:
+            self.packages = dict((x["name"], x) for x in summaries)
+            self.by_catalog, self.by_provider, self.by_channel = dict(), dict(), dict()
+            for x in self.packages.values():
+                self.by_catalog.setdefault(x["catalogSource"], set()).add(x["name"])
+                self.by_provider.setdefault(x["provider"], set()).add(x["name"])
+                self.by_channel.setdefault(x["defaultChannel"], set()).add(x["name"])
+
+    @property
+    def current(self):
+        # listed by this process less than ttl seconds ago; long-lived processes (openaihub serve)
+        # list again after that
+        return self.listed is not None and time.time() - self.listed < self.ttl
+
+    def update(self, objects):
+        self._replace([summary(x) for x in objects])
+        self.listed = time.time()
+
+    def refresh(self, cluster):
+        self.update(cluster.list(API_VERSION, KIND, self.namespace))
+        self._save()
+
+    def get(self, name):
+        return self.packages.get(name)
+
+    def catalog(self, name):
+        return sorted(self.by_catalog.get(name, ()))
+
+    def lookup(self, cluster, names):
+        # name -> package, None for an unknown one; the index is listed again when it misses one,
+        # an operator may have been registered since, and when this process listed it too long ago
+        expired = self.listed is not None and not self.current
+        if expired or not self.packages or any(x not in self.packages for x in names):
+            self.refresh(cluster)
+        return dict((x, self.packages.get(x)) for x in names)
+
+    def wait(self, predicate, description, timeout=600):
+        # one list and watch of the package-server until predicate(index) holds
+        done = readiness.wait(_Until(self, predicate, description), timeout=timeout)
+        if self.current:
+            self._save()
+        return done
+
+class _Until(readiness.Condition):
+    api_version = API_VERSION
+    kind = KIND
+    # the package-server does not support field selectors
+    field_selectors = False
+
+    def __init__(self, index, predicate, description):
+        readiness.Condition.__init__(self, namespace=index.namespace)
+        self.index = index
+        self.predicate = predicate
+        self.description = description
+
+    def check(self, objects):
+        self.index.update(objects.values())
+        return self.predicate(self.index)
+
+    def __str__(self):
+        return self.description
+
+_indexes = dict()
+_indexes_lock = threading.Lock()
+
+def index(namespace):
+    # one index per namespace and process, shared by every command
+    with _indexes_lock:
+        if namespace not in _indexes:
+            _indexes[namespace] = PackageIndex(namespace)
+        return _indexes[namespace]
+
+__all__ = ["PackageIndex", "index", "summary", "images"]
@@ -0,0 +1,129 @@
+# Copyright 2019 IBM Corporation 
+# 
+# Licensed under the Apache License, Version 2.0 (the "License"); 
+# you may not use this file except in compliance with the License. 
+# You may obtain a copy of the License at 
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0 
+# 
+# Unless required by applicable law or agreed to in writing, software 
+# distributed under the License is distributed on an "AS IS" BASIS, 
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. 
+# See the License for the specific language governing permissions and 
+# limitations under the License. 
+from __future__ import print_function
+import logging
+import time
+from openaihub.func import kube
+from openaihub.func import readiness
+
+logger = logging.getLogger(__name__)
+
+NAME = "openaihub-prepull"
+LABEL = "openaihub.ibm.com/prepull"
+
+# the reasons of a container whose image can not be pulled (the kubelet retries with a backoff)
+PULL_ERRORS = ["ErrImagePull", "ImagePullBackOff", "InvalidImageName", "ErrImageNeverPull"]
+
+# seconds the pulls get at most, they are a head start for the rollouts of the operators
+TIMEOUT = 300
+
+def images(index, subscriptions):
+    # the images of the CSVs the subscriptions resolve to, from the currentCSVDesc of their channel
+    found = set()
+    for doc in subscriptions:
+        channels = dict((x["name"], x) for x in (index.get(doc["spec"]["name"]) or {}).get("channels", []))
+        found.update((channels.get(doc["spec"].get("channel")) or {}).get("images") or [])
+    return sorted(found)
+
+def daemonset(images, namespace):
+    # a container per image on every node, taints tolerated; the command only keeps it from
+    # exiting, an image without sh crashes but is pulled all the same
+    containers = [{"name": "image-%s" % i, "image": x, "imagePullPolicy": "IfNotPresent",
+                   "command": ["sh", "-c", "sleep 3600"],
+                   "resources": {"requests": {"cpu": "1m", "memory": "8Mi"}}} for i, x in enumerate(images)]
+    return {"apiVersion": "apps/v1", "kind": "DaemonSet", "metadata": {"name": NAME, "namespace": namespace},
+            "spec": {"selector": {"matchLabels": {LABEL: NAME}},
+                     "template": {"metadata": {"labels": {LABEL: NAME}},
+                                  "spec": {"containers": containers, "tolerations": [{"operator": "Exists"}],
+                                           "terminationGracePeriodSeconds": 0}}}}
+
+def progress(pod):
+    # (pulled, failed) images of a pre-pull pod; a container that ran or failed to start has its image
+    pulled, failed = [], []
+    for x in (pod.get("status") or {}).get("containerStatuses") or []:
+        state = x.get("state") or {}
+        reason = (state.get("waiting") or {}).get("reason")
+        if reason in PULL_ERRORS:
+            failed.append(x["image"])
+        elif x.get("imageID") or "running" in state or "terminated" in state or x.get("lastState"):
+            pulled.append(x["image"])
+    return pulled, failed
+
+def ready_nodes(cluster):
+    return [x["metadata"]["name"] for x in cluster.list("v1", "Node")
+            if any(c["type"] == "Ready" and c["status"] == "True" for c in (x.get("status") or {}).get("conditions") or [])]
+
+class ImagesPulled(readiness.Condition):
+    # every image is pulled (or failed to) on every node, the progress of each node is logged
+    api_version = "v1"
+    kind = "Pod"
+
+    def __init__(self, namespace, images, nodes):
+        readiness.Condition.__init__(self, namespace=namespace, label_selector="%s=%s" % (LABEL, NAME))
+        self.images = images
+        self.nodes = set(nodes)
+        self.start = time.time()
+        # node -> (pulled, failed, seconds until done)
+        self.nodes_progress = dict()
+
+    def check(self, objects):
+        for pod in objects.values():
+            node = pod["spec"].get("nodeName")
+            if node not in self.nodes:
+                continue
+            pulled, failed = progress(pod)
+            old = self.nodes_progress.get(node)
+            if old is not None and (old[0], old[1]) == (pulled, failed):
+                continue
+            self.nodes_progress[node] = (pulled, failed, time.time() - self.start)
+            logger.info("Pre-pull on %s: %s of %s images%s" % (node, len(pulled), len(self.images),
+                                                                 ", failed %s" % ", ".join(failed) if failed else ""))
+        if set(self.nodes_progress) < self.nodes:
+            return False
+        return all(len(pulled) + len(failed) >= len(self.images) for pulled, failed, _ in self.nodes_progress.values())
+
+    def __str__(self):
+        return "%s images to be pulled on %s nodes" % (len(self.images), len(self.nodes))
+
+def run(cluster, images, namespace, timeout=TIMEOUT, stop=None):
+    # pulls the images on every ready node at once, returns node -> (pulled, failed, seconds), None for
+    # a node without a pod; the pulls are best effort, the daemonset is removed when they are done,
+    # the time is up or stop (a threading.Event) is set
+    nodes = ready_nodes(cluster)
+    if not images or not nodes:
+        return dict()
+    logger.info("Pre-pulling %s images on %s nodes: %s" % (len(images), len(nodes), ", ".join(images)))
+    cluster.apply([daemonset(images, namespace)])
+    condition = ImagesPulled(namespace, images, nodes)
+    try:
+        logger.info("Waiting for %s..." % condition)
+        readiness.Waiter(condition, cancel_check=2, stop=stop).wait(timeout)
+    finally:
+        try:
+            cluster.delete("apps/v1", "DaemonSet", NAME, namespace)
+        except kube.ClusterError as e:
+            logger.info("Unable to delete the daemonset %s: %s" % (NAME, e))
+    return dict((x, condition.nodes_progress.get(x)) for x in nodes)
+
+def print_report(results, images):
+    print("Pre-pulled %s images on %s nodes:" % (len(images), len(results)))
+    for node, result in sorted(results.items()):
+        if result is None:
+            print("    %-32s no pod" % node)
+            continue
+        pulled, failed, seconds = result
+        print("    %-32s %3s/%-3s %8.1fs%s" % (node, len(pulled), len(images), seconds,
+                                           ", failed %s" % ", ".join(failed) if failed else ""))
+
+__all__ = ["images", "daemonset", "progress", "run", "print_report", "ImagesPulled"]
@@ -0,0 +1,277 @@
+# Copyright 2019 IBM Corporation 
+# 
+# Licensed under the Apache License, Version 2.0 (the "License"); 
+# you may not use this file except in compliance with the License. 
+# You may obtain a copy of the License at 
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0 
+# 
+# Unless required by applicable law or agreed to in writing, software 
+# distributed under the License is distributed on an "AS IS" BASIS, 
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. 
+# See the License for the specific language governing permissions and 
+# limitations under the License. 
+from __future__ import print_function
+import logging
+import random
+import time
+from openaihub.func import dag
+from openaihub.func import kube
+from openaihub.func import trace
+
+logger = logging.getLogger(__name__)
+
+class ConditionFailed(Exception):
+    pass
+
+class Condition:
+    # a condition is evaluated over the current objects of one (namespaced) resource list;
+    # subclasses set the resource and implement check(), which returns True once satisfied
+    # and raises ConditionFailed when it can no longer be satisfied
+    api_version = None
+    kind = None
+    # not every aggregated API (e.g. the OLM package-server) supports field selectors
+    field_selectors = True
+
+    def __init__(self, namespace=None, name=None, label_selector=None):
+        self.namespace = namespace
+        self.name = name
+        self.label_selector = label_selector
+
+    def check(self, objects):
+        raise NotImplementedError
+
+    def __str__(self):
+        return "%s %s" % (self.kind, self.name or self.label_selector or "")
+
+class ObjectExists(Condition):
+    def __init__(self, api_version, kind, name, namespace=None):
+        Condition.__init__(self, namespace=namespace, name=name)
+        self.api_version = api_version
+        self.kind = kind
+
+    def check(self, objects):
+        return len(objects) > 0
+
+    def __str__(self):
+        return "%s %s to exist" % (self.kind, self.name)
+
+class ObjectGone(ObjectExists):
+    # deleted and its finalizers done; the DELETED event only comes once they all are removed
+    def check(self, objects):
+        return len(objects) == 0
+
+    def __str__(self):
+        return "%s %s to be deleted" % (self.kind, self.name)
+
+class DeploymentAvailable(Condition):
+    api_version = "apps/v1"
+    kind = "Deployment"
+
+    def __init__(self, name, namespace):
+        Condition.__init__(self, namespace=namespace, name=name)
+
+    def check(self, objects):
+        # same as kubectl rollout status: the latest generation is observed and all of its replicas are available
+        for x in objects.values():
+            spec = x.get("spec", {})
+            status = x.get("status", {})
+            replicas = spec.get("replicas", 1)
+            if status.get("observedGeneration", 0) < x["metadata"].get("generation", 0):
+                return False
+            if status.get("updatedReplicas", 0) < replicas or status.get("availableReplicas", 0) < replicas:
+                return False
+            return True
+        return False
+
+    def __str__(self):
+        return "deployment %s/%s to be available" % (self.namespace, self.name)
+
+class PodPhase(Condition):
+    api_version = "v1"
+    kind = "Pod"
+
+    def __init__(self, namespace, phase, name=None, name_contains=None):
+        Condition.__init__(self, namespace=namespace, name=name)
+        self.phase = phase
+        self.name_contains = name_contains
+
+    def check(self, objects):
+        for x in objects.values():
+            if self.name_contains and self.name_contains not in x["metadata"]["name"]:
+                continue
+            phase = x.get("status", {}).get("phase")
+            if phase == self.phase:
+                return True
+            if phase == "Failed" and self.name:
+                raise ConditionFailed("pod %s/%s failed" % (self.namespace, self.name))
+        return False
+
+    def __str__(self):
+        return "pod %s/%s to be %s" % (self.namespace, self.name or "*%s*" % self.name_contains, self.phase)
+
+class ContainerRunning(Condition):
+    api_version = "v1"
+    kind = "Pod"
+
+    def __init__(self, namespace, name, container):
+        Condition.__init__(self, namespace=namespace, name=name)
+        self.container = container
+
+    def check(self, objects):
+        # init containers count too, they run one after the other before the pod starts
+        for x in objects.values():
+            status = x.get("status", {})
+            if status.get("phase") == "Failed":
+                raise ConditionFailed("pod %s/%s failed" % (self.namespace, self.name))
+            for c in (status.get("initContainerStatuses") or []) + (status.get("containerStatuses") or []):
+                if c.get("name") != self.container:
+                    continue
+                state = c.get("state") or {}
+                if "running" in state:
+                    return True
+                if "terminated" in state:
+                    raise ConditionFailed("container %s of pod %s/%s terminated" % (self.container, self.namespace, self.name))
+        return False
+
+    def __str__(self):
+        return "container %s of pod %s/%s to be running" % (self.container, self.namespace, self.name)
+
+class CSVsSucceeded(Condition):
+    # the ClusterServiceVersions of many subscriptions, waited for with one list and watch
+    api_version = "operators.coreos.com/v1alpha1"
+    kind = "ClusterServiceVersion"
+
+    def __init__(self, namespace, names):
+        Condition.__init__(self, namespace=namespace)
+        self.names = set(names)
+
+    def check(self, objects):
+        phases = dict((name, (x.get("status") or {}).get("phase")) for (namespace, name), x in objects.items())
+        failed = sorted(x for x in self.names if phases.get(x) == "Failed")
+        if failed:
+            raise ConditionFailed("clusterserviceversions %s failed" % ", ".join(failed))
+        return all(phases.get(x) == "Succeeded" for x in self.names)
+
+    def __str__(self):
+        return "clusterserviceversions %s/%s to succeed" % (self.namespace, ", ".join(sorted(self.names)))
+
+class Waiter:
+    # list once, then follow a watch from the listed resourceVersion until the condition holds;
+    # dropped watches resume from the last seen resourceVersion and re-list only when it expired
+    def __init__(self, condition, cluster=None, backoff=0.5, max_backoff=15, watch_timeout=300, cancel_check=10, stop=None):
+        self.condition = condition
+        # the resource is looked up through the cluster, whose lock keeps a discovery refresh of
+        # one thread from breaking the lookups of the others
+        self.cluster = cluster or kube.api()
+        self.client = self.cluster.dynamic
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.watch_timeout = watch_timeout
+        # seconds a quiet watch runs before the wait checks whether its install step is cancelled
+        # or stop (a threading.Event) is set, which ends the wait early with False
+        self.cancel_check = cancel_check
+        self.stop = stop
+        self.retries = 0
+        self.reconnects = 0
+
+    def _key(self, obj):
+        return (obj["metadata"].get("namespace"), obj["metadata"]["name"])
+
+    def _selectors(self):
+        field_selector = None
+        if self.condition.name and self.condition.field_selectors:
+            field_selector = "metadata.name=%s" % self.condition.name
+        return dict(namespace=self.condition.namespace, label_selector=self.condition.label_selector,
+                    field_selector=field_selector)
+
+    def _match(self, obj):
+        return self.condition.name is None or obj["metadata"]["name"] == self.condition.name
+
+    def _list(self, resource):
+        result = resource.get(**self._selectors()).to_dict()
+        objects = dict((self._key(x), x) for x in result.get("items") or [] if self._match(x))
+        return objects, result["metadata"].get("resourceVersion")
+
+    def _sleep(self, deadline):
+        # full jitter exponential backoff between watch reconnects
+        delay = min(self.max_backoff, self.backoff * (2 ** self.retries))
+        self.retries += 1
+        self.reconnects += 1
+        time.sleep(max(0, min(random.uniform(0, delay), deadline - time.time())))
+
+    def wait(self, timeout=600):
+        with trace.span("wait %s" % self.condition, "wait") as span:
+            span.args["returncode"] = 0 if self._wait(timeout) else 1
+            span.args["retries"] = self.reconnects
+            return span.args["returncode"] == 0
+
+    def _wait(self, timeout):
+        from kubernetes.client.rest import ApiException
+        from kubernetes.dynamic.exceptions import ResourceNotFoundError
+        from urllib3.exceptions import HTTPError
+        deadline = time.time() + timeout
+        resource = None
+        objects, resource_version = None, None
+        while time.time() < deadline:
+            dag.check_cancelled()
+            if self.stop is not None and self.stop.is_set():
+                return False
+            try:
+                if resource is None:
+                    resource = self.cluster.resource(self.condition.api_version, self.condition.kind)
+                if resource_version is None:
+                    objects, resource_version = self._list(resource)
+                    if self.condition.check(objects):
+                        return True
+                remaining = max(1, int(deadline - time.time()))
+                for event in self.client.watch(resource, resource_version=resource_version,
+                                               timeout=min(remaining, self.watch_timeout, self.cancel_check), **self._selectors()):
+                    dag.check_cancelled()
+                    if self.stop is not None and self.stop.is_set():
+                        return False
+                    obj = event["raw_object"]
+                    if event["type"] == "ERROR":
+                        # 410 Gone: the resourceVersion is too old, list again
+                        if obj.get("code") == 410:
+                            resource_version = None
+                            break
+                        raise ApiException(status=obj.get("code"), reason=obj.get("message"))
+                    resource_version = obj["metadata"].get("resourceVersion", resource_version)
+                    self.retries = 0
+                    if not self._match(obj):
+                        continue
+                    if event["type"] == "DELETED":
+                        objects.pop(self._key(obj), None)
+                    elif event["type"] in ("ADDED", "MODIFIED"):
+                        objects[self._key(obj)] = obj
+                    else:
+                        continue
+                    if self.condition.check(objects):
+                        return True
+            except ConditionFailed as e:
+                logger.error("Error: %s" % e)
+                return False
+            except ResourceNotFoundError:
+                # the API serving the resource is not registered yet (e.g. OLM is still starting)
+                resource = None
+                self._sleep(deadline)
+            except ApiException as e:
+                if e.status == 410:
+                    resource_version = None
+                else:
+                    logger.info("Watch for %s interrupted: %s" % (self.condition, e.reason))
+                    if e.status == 404:
+                        resource = None
+                    self._sleep(deadline)
+            except HTTPError as e:
+                logger.info("Watch for %s interrupted: %s" % (self.condition, e))
+                self._sleep(deadline)
+        logger.error("Timed out after %ss waiting for %s" % (timeout, self.condition))
+        return False
+
+def wait(condition, timeout=600):
+    logger.info("Waiting for %s..." % condition)
+    return Waiter(condition).wait(timeout)
+
+__all__ = ["Condition", "ObjectExists", "ObjectGone", "DeploymentAvailable", "PodPhase", "ContainerRunning", "CSVsSucceeded", "Waiter", "wait"]
@@ -0,0 +1,94 @@
+# Copyright 2019 IBM Corporation 
+# 
+# Licensed under the Apache License, Version 2.0 (the "License"); 
+# you may not use this file except in compliance with the License. 
+# You may obtain a copy of the License at 
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0 
+# 
+# Unless required by applicable law or agreed to in writing, software 
+# distributed under the License is distributed on an "AS IS" BASIS, 
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. 
+# See the License for the specific language governing permissions and 
+# limitations under the License. 
+from __future__ import print_function
+import logging
+import copy
+import os
+import re
+import threading
+from openaihub.func import kube
+
+logger = logging.getLogger(__name__)
+
+# parsed templates keyed by path, modification time and size
+_templates = dict()
+_templates_lock = threading.Lock()
+
+def load(path):
+    # every template is parsed once per process, callers get their own copy to fill in
+    st = os.stat(path)
+    key = (os.path.realpath(path), st.st_mtime_ns, st.st_size)
+    with _templates_lock:
+        if key not in _templates:
+            _templates[key] = kube.load_documents(path)
+        return copy.deepcopy(_templates[key])
+
+def _pattern(params):
+    # whole placeholders only, OPERATOR does not match inside REPLACE_OPERATOR
+    names = sorted(params, key=len, reverse=True)
+    return re.compile(r"(?<!\w)(%s)(?!\w)" % "|".join(re.escape(x) for x in names))
+
+def substitute(value, params):
+    # replace the placeholders in every string (keys included) of a parsed document
+    if not params:
+        return value
+    pattern = _pattern(params)
+
+    def walk(x):
+        if isinstance(x, dict):
+            return dict((walk(k), walk(v)) for k, v in x.items())
+        if isinstance(x, list):
+            return [walk(v) for v in x]
+        if isinstance(x, str):
+            return pattern.sub(lambda m: str(params[m.group(1)]), x)
+        return x
+    return walk(value)
+
+def render(path, params=None):
+    # the documents of a template with its placeholders filled in, ready for cluster.apply
+    return [substitute(x, params) for x in load(path)]
+
+def argo_patch(doc):
+    # argo has to delete pods and set the finalizers of its workflows on openshift
+    doc = copy.deepcopy(doc)
+    doc["metadata"] = {"labels": {"app": "argo"}, "name": "argo"}
+    for x in doc["rules"]:
+        if "pods" in x["resources"]:
+            x["verbs"].append('delete')
+        elif "workflows" in x["resources"]:
+            x["resources"].append('workflows/finalizers')
+    return doc
+
+def studyjob_patch(doc):
+    # the studyjob controller has to set the finalizers of the jobs it owns on openshift
+    doc = copy.deepcopy(doc)
+    doc["metadata"] = {"name": "studyjob-controller"}
+    for x in doc["rules"]:
+        if "jobs" in x["resources"]:
+            x["resources"].append('jobs/finalizers')
+        elif "tfjobs" in x["resources"]:
+            x["resources"].append('tfjobs/finalizers')
+            x["resources"].append('pytorchjobs/finalizers')
+    return doc
+
+def drop_sub_path(doc, sub_path):
+    # mount the whole volume instead of sub_path in every container of a deployment
+    doc = copy.deepcopy(doc)
+    for container in doc["spec"]["template"]["spec"].get("containers", []):
+        for mount in container.get("volumeMounts", []):
+            if mount.get("subPath") == sub_path:
+                del mount["subPath"]
+    return doc
+
+__all__ = ["load", "render", "substitute", "argo_patch", "studyjob_patch", "drop_sub_path"]
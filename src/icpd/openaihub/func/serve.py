@@ -0,0 +1,526 @@
+# Copyright 2019 IBM Corporation 
+# 
+# Licensed under the Apache License, Version 2.0 (the "License"); 
+# you may not use this file except in compliance with the License. 
+# You may obtain a copy of the License at 
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0 
+# 
+# Unless required by applicable law or agreed to in writing, software 
+# distributed under the License is distributed on an "AS IS" BASIS, 
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. 
+# See the License for the specific language governing permissions and 
+# limitations under the License. 
+from __future__ import print_function
+import logging
+import inspect
+import json
+import multiprocessing
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from openaihub.func import fleet
+
+logger = logging.getLogger(__name__)
+
+# the functions of openaihub.func a job may run
+FUNCTIONS = ["install", "install_operator", "register", "tune", "uninstall"]
+
+# job states
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+# the options of the commands the functions take as positional parameters, with the defaults of
+# the cli; loglevel info gives the step events
+DEFAULTS = {"loglevel": "info", "openshift": False, "subscription_file": '', "namespace": "operators", "storage": ''}
+
+# finished jobs kept for GET /jobs, the oldest are dropped first
+KEEP_FINISHED = 200
+
+# the step lines of log_step and dag.execute
+STEP = re.compile(r"^### (\d+)/(\d+) ### (.*)$")
+
+def validate(function, params):
+    # the params with the defaults of the cli, raises ValueError for an unknown function or
+    # parameters it does not take; logpath is left to the daemon
+    from openaihub import func
+    if function not in FUNCTIONS:
+        raise ValueError("unknown function %s, the functions are %s" % (function, ", ".join(FUNCTIONS)))
+    if not isinstance(params, dict):
+        raise ValueError("params must be an object")
+    signature = inspect.signature(getattr(func, function))
+    params = dict(params)
+    for k, v in DEFAULTS.items():
+        if k in signature.parameters:
+            params.setdefault(k, v)
+    try:
+        signature.bind(**dict({"logpath": ''}, **params) if "logpath" in signature.parameters else params)
+    except TypeError as e:
+        raise ValueError("%s: %s" % (function, e))
+    return params
+
+def result_of(value):
+    # the return value of a function as json: CompletedOperator as an object, lists item by item
+    if isinstance(value, (list, tuple)):
+        return [result_of(x) for x in value]
+    if hasattr(value, "operator_name"):
+        return {"operator": value.operator_name, "returncode": value.returncode}
+    if value is None or isinstance(value, (str, int, float, bool, dict)):
+        return value
+    return str(value)
+
+# worker processes, one job at a time each
+
+class _Events(logging.Handler):
+    # log records of the current job as events, step lines with their numbers
+    def __init__(self, send):
+        logging.Handler.__init__(self, logging.INFO)
+        self.send = send
+
+    def emit(self, record):
+        message = record.getMessage()
+        event = {"type": "log", "level": record.levelname.lower(), "logger": record.name, "message": message}
+        match = STEP.match(message)
+        if match:
+            event.update(type="step", step=int(match.group(1)), steps=int(match.group(2)), description=match.group(3))
+        self.send(event)
+
+class _Output:
+    # stdout of the worker (the plans, summaries and reports the functions print) as events, line by line
+    def __init__(self, send, log):
+        self.send = send
+        self.log = log
+        self.buffer = ""
+        self._lock = threading.Lock()
+
+    def write(self, data):
+        self.log.write(data)
+        with self._lock:
+            self.buffer += data
+            lines = self.buffer.split("\n")
+            self.buffer = lines.pop()
+        for x in lines:
+            self.send({"type": "output", "line": x})
+        return len(data)
+
+    def flush(self):
+        self.log.flush()
+
+def _worker(conn, context, logdir):
+    # runs in a spawned process: the imports, the kubeconfig, the client and its discovery, the
+    # package index and the manifest refs are loaded once and kept warm for every job of the context
+    lock = threading.Lock()
+    current = [None]
+
+    def send(event):
+        if current[0] is None:
+            return
+        event["time"] = round(time.time(), 3)
+        with lock:
+            conn.send(("event", current[0], event))
+
+    log = open(os.path.join(logdir, "worker.log"), "a")
+    sys.stdout = _Output(send, log)
+    sys.stderr = log
+    root = logging.getLogger()
+    for x in list(root.handlers):
+        root.removeHandler(x)
+    root.addHandler(_Events(send))
+    root.addHandler(logging.StreamHandler(log))
+    root.setLevel(logging.INFO)
+    last_error = fleet._LastError() # pylint: disable=protected-access
+    root.addHandler(last_error)
+    from openaihub import func
+    from openaihub.func import kube
+    try:
+        if context:
+            kube.use_context(context, os.path.join(logdir, "kubeconfig"))
+        kube.api()
+    except Exception as e: # pylint: disable=broad-except
+        logger.error("Error: unable to connect to %s: %s" % (context or "the current context", e))
+        log.flush()
+        conn.send(("failed", None, last_error.message))
+        return
+    conn.send(("ready", None, None))
+    func_logger = logging.getLogger(func.__name__)
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return
+        if message is None:
+            return
+        job_id, function, params = message
+        current[0] = job_id
+        last_error.message = ''
+        # the functions add the file handlers of their own logs, they must not outlive the job
+        handlers = list(func_logger.handlers)
+        threads = set(threading.enumerate())
+        start = time.time()
+        returncode, result, error = 0, None, ""
+        try:
+            result = result_of(getattr(func, function)(**params))
+        except SystemExit as e:
+            returncode = e.code if isinstance(e.code, int) else 1
+            error = last_error.message if returncode else ''
+        except Exception as e: # pylint: disable=broad-except
+            logger.error("Error: %s" % e, exc_info=1)
+            returncode, error = 1, str(e)
+        finally:
+            sys.stdout.flush()
+            for x in list(func_logger.handlers):
+                if x not in handlers:
+                    func_logger.removeHandler(x)
+                    x.close()
+        if isinstance(result, list) and any(isinstance(x, dict) and x.get("returncode") for x in result):
+            returncode = returncode or 1
+            error = error or last_error.message
+        with lock:
+            current[0] = None
+            conn.send(("done", job_id, {"returncode": returncode, "result": result, "error": error,
+                                        "duration": round(time.time() - start, 1)}))
+        # a step the run could not stop would keep changing the cluster during the next job
+        left = [x.name for x in threading.enumerate() if x not in threads and x.is_alive()]
+        if left:
+            logger.error("Error: threads %s of job %s are still running, ending the worker" % (", ".join(left), job_id))
+            return
+
+class Worker:
+    # a warm process for one context and the thread forwarding its events to the daemon
+    def __init__(self, daemon, context):
+        self.daemon = daemon
+        self.context = context
+        self.job = None
+        self.jobs = 0
+        self.ready = False
+        self.error = ''
+        self.logdir = fleet.context_dir(os.path.join(daemon.logdir, "workers"), "%s-%s" % (context or "default", uuid.uuid4().hex[:8]))
+        os.makedirs(self.logdir, exist_ok=True)
+        self.conn, child = multiprocessing.get_context("spawn").Pipe()
+        self.process = multiprocessing.get_context("spawn").Process(target=_worker, args=(child, context, self.logdir),
+                                                                   name="openaihub-worker", daemon=True)
+        self.process.start()
+        child.close()
+        self.thread = threading.Thread(target=self._forward, name="worker-%s" % (context or "default"))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self, job):
+        self.job = job
+        self.jobs += 1
+        self.conn.send((job.id, job.function, job.params))
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (IOError, OSError):
+            pass
+
+    def _forward(self):
+        while True:
+            try:
+                kind, job_id, data = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            if kind == "ready":
+                self.daemon.ready(self)
+            elif kind == "event":
+                self.daemon.event(job_id, data)
+            elif kind == "done":
+                self.daemon.done(self, job_id, data)
+            elif kind == "failed":
+                self.error = data
+                logger.error(data)
+                break
+        self.process.join(5)
+        self.daemon.lost(self)
+
+class Job:
+    def __init__(self, function, params, context):
+        self.id = uuid.uuid4().hex[:12]
+        self.function = function
+        self.params = params
+        self.context = context
+        self.key = json.dumps([context, function, params], sort_keys=True)
+        self.state = QUEUED
+        self.events = []
+        self.callers = 1
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.returncode = None
+        self.result = None
+        self.error = ""
+
+    def to_dict(self):
+        return {"id": self.id, "function": self.function, "params": self.params, "context": self.context,
+                "state": self.state, "callers": self.callers, "events": len(self.events),
+                "queued": round((self.started or time.time()) - self.created, 1),
+                "duration": round((self.finished or time.time()) - self.started, 1) if self.started else None,
+                "returncode": self.returncode, "result": self.result, "error": self.error}
+
+class Daemon:
+    # the job queue: jobs of a context run one after the other on at most per_cluster warm workers
+    # of that context, max_workers over all; a job equal to one queued or running is not run twice
+    def __init__(self, logdir, per_cluster=1, max_workers=8, jobs_per_worker=100):
+        self.logdir = logdir
+        self.per_cluster = per_cluster
+        self.max_workers = max_workers
+        self.jobs_per_worker = jobs_per_worker
+        self.jobs = OrderedDict()
+        self.workers = []
+        self.cond = threading.Condition()
+
+    def submit(self, function, params, context=None):
+        # returns the job and whether it is one submitted before; params are validated ones
+        from openaihub import func
+        parameters = inspect.signature(getattr(func, function)).parameters
+        job = Job(function, dict(params), context)
+        with self.cond:
+            for x in self.jobs.values():
+                if x.key == job.key and x.state in (QUEUED, RUNNING):
+                    x.callers += 1
+                    return x, True
+            # the logs of a job go to its own directory
+            if "logpath" in parameters and not params.get("logpath"):
+                path = os.path.join(self.logdir, "jobs", job.id)
+                os.makedirs(path, exist_ok=True)
+                job.params["logpath"] = path
+            self.jobs[job.id] = job
+            logger.info("Job %s: %s on %s queued" % (job.id, function, context or "the current context"))
+            self._dispatch()
+        return job, False
+
+    def _dispatch(self):
+        # called with the lock held: queued jobs in order get an idle worker of their context, or one
+        # that is starting, or a new one while the limits allow
+        starting = dict()
+        for job in [x for x in self.jobs.values() if x.state == QUEUED]:
+            mine = [x for x in self.workers if x.context == job.context]
+            idle = [x for x in mine if x.ready and x.job is None]
+            if idle:
+                self._start(idle[0], job)
+                continue
+            claimed = starting.get(job.context, 0)
+            if claimed < len([x for x in mine if not x.ready]):
+                starting[job.context] = claimed + 1
+                continue
+            if len(mine) >= self.per_cluster:
+                continue
+            if len(self.workers) >= self.max_workers:
+                # make room with an idle worker of another context
+                others = [x for x in self.workers if x.ready and x.job is None and x.context != job.context]
+                if not others:
+                    continue
+                self._retire(others[0])
+            self.workers.append(Worker(self, job.context))
+            starting[job.context] = claimed + 1
+
+    def _start(self, worker, job):
+        job.state = RUNNING
+        job.started = time.time()
+        worker.run(job)
+        logger.info("Job %s: %s on %s started" % (job.id, job.function, job.context or "the current context"))
+
+    def _retire(self, worker):
+        self.workers.remove(worker)
+        worker.stop()
+
+    def _finish(self, job, returncode, result=None, error=""):
+        job.returncode = returncode
+        job.result = result
+        job.error = error
+        job.state = SUCCEEDED if returncode == 0 else FAILED
+        job.finished = time.time()
+        job.events.append({"type": "result", "time": round(job.finished, 3), "state": job.state, "returncode": returncode,
+                           "result": result, "error": error})
+        finished = [x for x in self.jobs.values() if x.state in (SUCCEEDED, FAILED)]
+        for x in finished[:max(0, len(finished) - KEEP_FINISHED)]:
+            del self.jobs[x.id]
+        logger.info("Job %s: %s on %s %s in %.1fs" % (job.id, job.function, job.context or "the current context", job.state,
+                                                     job.finished - job.started))
+
+    def ready(self, worker):
+        with self.cond:
+            worker.ready = True
+            logger.info("Worker %s for %s is ready" % (worker.process.pid, worker.context or "the current context"))
+            self._dispatch()
+
+    def event(self, job_id, event):
+        with self.cond:
+            job = self.jobs.get(job_id)
+            if job is not None:
+                job.events.append(event)
+                self.cond.notify_all()
+
+    def done(self, worker, job_id, data):
+        with self.cond:
+            worker.job = None
+            job = self.jobs.get(job_id)
+            if job is not None:
+                self._finish(job, data["returncode"], data["result"], data["error"])
+            if worker.jobs >= self.jobs_per_worker and worker in self.workers:
+                # a fresh process now and then, the functions keep state in their modules
+                self._retire(worker)
+            self._dispatch()
+            self.cond.notify_all()
+
+    def lost(self, worker):
+        # the process ended: its job fails, a queued job of a context that can not connect fails too
+        with self.cond:
+            if worker in self.workers:
+                self.workers.remove(worker)
+            if worker.job is not None and worker.job.state == RUNNING:
+                self._finish(worker.job, 1, error="the worker process ended")
+            elif not worker.ready:
+                for x in self.jobs.values():
+                    if x.state == QUEUED and x.context == worker.context:
+                        self._finish(x, 1, error=worker.error or "the worker process for %s ended" % (x.context or "the current context"))
+            self._dispatch()
+            self.cond.notify_all()
+
+    def get(self, job_id):
+        with self.cond:
+            return self.jobs.get(job_id)
+
+    def list(self):
+        with self.cond:
+            return [x.to_dict() for x in self.jobs.values()]
+
+    def status(self):
+        with self.cond:
+            return {"workers": [{"context": x.context, "ready": x.ready, "job": x.job.id if x.job else None, "jobs": x.jobs,
+                                 "pid": x.process.pid} for x in self.workers],
+                    "queued": len([x for x in self.jobs.values() if x.state == QUEUED]),
+                    "running": len([x for x in self.jobs.values() if x.state == RUNNING])}
+
+    def events(self, job, since=0, timeout=None):
+        # yields the events of a job from since on, until its result
+        deadline = time.time() + timeout if timeout else None
+        position = since
+        while True:
+            with self.cond:
+                while position >= len(job.events) and job.state in (QUEUED, RUNNING):
+                    remaining = deadline - time.time() if deadline else None
+                    if remaining is not None and remaining <= 0:
+                        return
+                    self.cond.wait(remaining if remaining is not None else 30)
+                events = job.events[position:]
+                finished = job.state in (SUCCEEDED, FAILED)
+            for x in events:
+                yield x
+            position += len(events)
+            if finished and position >= len(job.events):
+                return
+
+    def stop(self):
+        with self.cond:
+            for x in list(self.workers):
+                self._retire(x)
+
+# the HTTP API
+
+def _handler(daemon):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            logger.info("%s %s" % (self.address_string(), format % args))
+
+        def _send(self, code, body):
+            data = json.dumps(body, indent=1, sort_keys=True).encode() + b"\n"
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _error(self, code, message):
+            self._send(code, {"error": message})
+
+        def _chunk(self, data):
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+        def _stream(self, job, since):
+            # newline delimited json, one event per line, the last one is the result
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            try:
+                for x in daemon.events(job, since):
+                    self._chunk(json.dumps(x, sort_keys=True).encode() + b"\n")
+                self._chunk(b"")
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True
+
+        def _parse(self):
+            url = urlparse(self.path)
+            query = dict((k, v[-1]) for k, v in parse_qs(url.query).items())
+            return [x for x in url.path.split("/") if x], query
+
+        def do_GET(self):
+            parts, query = self._parse()
+            if parts == ["healthz"]:
+                return self._send(200, dict(daemon.status(), ok=True))
+            if parts == ["jobs"]:
+                return self._send(200, {"jobs": daemon.list()})
+            if len(parts) in (2, 3) and parts[0] == "jobs":
+                job = daemon.get(parts[1])
+                if job is None:
+                    return self._error(404, "job %s not found" % parts[1])
+                if len(parts) == 3 and parts[2] == "events":
+                    return self._stream(job, int(query.get("since") or 0))
+                if len(parts) == 2:
+                    if query.get("wait"):
+                        for _ in daemon.events(job, len(job.events), timeout=float(query["wait"])):
+                            pass
+                    return self._send(200, job.to_dict())
+            return self._error(404, "no such resource %s" % self.path)
+
+        def do_POST(self):
+            parts, query = self._parse()
+            if parts != ["jobs"]:
+                return self._error(404, "no such resource %s" % self.path)
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"{}")
+                function, params, context = body.get("function"), body.get("params") or {}, body.get("context") or None
+                params = validate(function, params)
+            except (ValueError, AttributeError) as e:
+                return self._error(400, str(e))
+            job, duplicate = daemon.submit(function, params, context)
+            if query.get("stream"):
+                return self._stream(job, 0)
+            self._send(200 if duplicate else 202, dict(job.to_dict(), duplicate=duplicate))
+
+    return Handler
+
+def serve(host="127.0.0.1", port=8765, per_cluster=1, max_workers=8, logdir=''):
+    # blocks until interrupted; the API has no authentication, keep it on a local address
+    logdir = os.path.abspath(logdir or "openaihub-serve")
+    os.makedirs(logdir, exist_ok=True)
+    daemon = Daemon(logdir, per_cluster, max_workers)
+    server = ThreadingHTTPServer((host, port), _handler(daemon))
+    server.daemon_threads = True
+    logger.info("Serving %s on http://%s:%s, at most %s jobs per cluster and %s workers, logs in %s" %
+                (", ".join(FUNCTIONS), host, server.server_address[1], per_cluster, max_workers, logdir))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        daemon.stop()
+    return daemon
+
+__all__ = ["serve", "Daemon", "Job", "Worker", "validate", "result_of", "FUNCTIONS"]
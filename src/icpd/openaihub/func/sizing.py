@@ -0,0 +1,97 @@
+# Copyright 2019 IBM Corporation 
+# 
+# Licensed under the Apache License, Version 2.0 (the "License"); 
+# you may not use this file except in compliance with the License. 
+# You may obtain a copy of the License at 
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0 
+# 
+# Unless required by applicable law or agreed to in writing, software 
+# distributed under the License is distributed on an "AS IS" BASIS, 
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. 
+# See the License for the specific language governing permissions and 
+# limitations under the License. 
+from __future__ import print_function
+import logging
+
+logger = logging.getLogger(__name__)
+
+# the OLM deployments and containers that are sized
+OPERATORS = ["olm-operator", "catalog-operator"]
+
+# name, the largest catalogs it is meant for (packages, bundles, CRDs), then memory and cpu of the
+# olm-operator and the catalog-operator; the catalog-operator keeps every catalog in memory
+PROFILES = [
+    ("small", (50, 200, 100), {"olm-operator": ("160Mi", "400Mi", "10m"), "catalog-operator": ("120Mi", "400Mi", "10m")}),
+    ("medium", (200, 800, 300), {"olm-operator": ("256Mi", "800Mi", "50m"), "catalog-operator": ("300Mi", "1000Mi", "50m")}),
+    ("large", (600, 2500, 800), {"olm-operator": ("512Mi", "1500Mi", "100m"), "catalog-operator": ("800Mi", "2000Mi", "100m")}),
+]
+
+# past the largest profile the catalog-operator limit grows with the bundles
+XLARGE_MI_PER_BUNDLE = 0.8
+
+def measure(cluster, index):
+    # the size of the catalogs the operators serve: packagemanifests, their channel heads (the bundles
+    # OLM resolves) and the CRDs of the cluster, in whichever version the server serves them
+    index.refresh(cluster)
+    packages = list(index.packages.values())
+    _, crds = cluster.list_crds()
+    return {"packages": len(packages), "bundles": sum(len(x["channels"]) for x in packages), "crds": len(crds)}
+
+def _mi(value):
+    return int(value[:-len("Mi")])
+
+def profile(counts, name="auto"):
+    # (name, {deployment: resources}) of a named profile, or of the smallest that fits counts
+    sizes = (counts["packages"], counts["bundles"], counts["crds"])
+    for x, limits, resources in PROFILES:
+        if name == x or (name == "auto" and all(a <= b for a, b in zip(sizes, limits))):
+            return x, dict((k, _resources(*v)) for k, v in resources.items())
+    if name not in ("auto", "xlarge"):
+        raise ValueError("unknown profile %s, the profiles are %s" % (name, ", ".join(names())))
+    # computed from the largest profile
+    _, limits, resources = PROFILES[-1]
+    extra = max(0, counts["bundles"] - limits[1]) * XLARGE_MI_PER_BUNDLE
+    scaled = {}
+    for k, (request, limit, cpu) in resources.items():
+        grow = extra if k == "catalog-operator" else extra / 2
+        scaled[k] = _resources("%dMi" % (_mi(request) + grow / 2), "%dMi" % (_mi(limit) + grow), "%dm" % (int(cpu[:-1]) * 2))
+    return "xlarge", scaled
+
+def _resources(memory_request, memory_limit, cpu_request):
+    # no cpu limit, a throttled catalog-operator falls behind on its catalogs
+    return {"requests": {"memory": memory_request, "cpu": cpu_request}, "limits": {"memory": memory_limit}}
+
+def names():
+    return [x[0] for x in PROFILES] + ["xlarge"]
+
+def params(resources):
+    # the placeholders of the olm and catalog patch templates
+    return {"REPLACE_MEMORY_REQUEST": resources["requests"]["memory"], "REPLACE_CPU_REQUEST": resources["requests"]["cpu"],
+            "REPLACE_MEMORY_LIMIT": resources["limits"]["memory"]}
+
+def current(cluster, name, namespace="olm"):
+    return resources_of(cluster.get("apps/v1", "Deployment", name, namespace), name)
+
+def resources_of(deployment, name):
+    # the resources of the container named like its deployment, None when it is not there
+    if deployment is None:
+        return None
+    for x in deployment["spec"]["template"]["spec"].get("containers") or []:
+        if x["name"] == name:
+            return x.get("resources") or {}
+    return {}
+
+def describe(resources):
+    if not resources:
+        return "none"
+    requests, limits = resources.get("requests") or {}, resources.get("limits") or {}
+    return "requests %s, limits %s" % (
+        " ".join("%s=%s" % x for x in sorted(requests.items())) or "none",
+        " ".join("%s=%s" % x for x in sorted(limits.items())) or "none")
+
+def changed(old, new):
+    # resource quantities are compared as written, e.g. 1Gi and 1024Mi count as a change
+    return any(((old or {}).get(k) or {}).get(x) != v for k in new for x, v in new[k].items())
+
+__all__ = ["measure", "profile", "names", "params", "current", "resources_of", "describe", "changed", "OPERATORS", "PROFILES"]
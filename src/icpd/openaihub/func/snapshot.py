@@ -0,0 +1,117 @@
+# Copyright 2019 IBM Corporation 
+# 
+# Licensed under the Apache License, Version 2.0 (the "License"); 
+# you may not use this file except in compliance with the License. 
+# You may obtain a copy of the License at 
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0 
+# 
+# Unless required by applicable law or agreed to in writing, software 
+# distributed under the License is distributed on an "AS IS" BASIS, 
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. 
+# See the License for the specific language governing permissions and 
+# limitations under the License. 
+from __future__ import print_function
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from openaihub.func import kube
+from openaihub.func import readiness
+
+logger = logging.getLogger(__name__)
+
+def contains(live, desired):
+    # every field of the desired object is set to the same value in the live one; fields the
+    # server defaults or adds (status, uid, ...) are not compared
+    if isinstance(desired, dict):
+        return isinstance(live, dict) and all(k in live and contains(live[k], v) for k, v in desired.items())
+    if isinstance(desired, list):
+        return isinstance(live, list) and len(live) == len(desired) and all(contains(a, b) for a, b in zip(live, desired))
+    return live == desired
+
+class Snapshot:
+    # the cluster state install decides on, read once up front with concurrent calls and then
+    # queried in memory; it is not updated by the steps, later changes need a get of their own
+    def __init__(self, cluster):
+        self.cluster = cluster
+        self.server_version = None
+        self.namespaces = set()
+        # (apiVersion, kind, namespace, name) -> object, None for a missing one
+        self.objects = dict()
+        self.extra = dict()
+        self._lock = threading.Lock()
+
+    def _key(self, api_version, kind, name, namespace=None):
+        return (api_version, kind, namespace, name)
+
+    def _get(self, api_version, kind, name, namespace=None):
+        try:
+            obj = self.cluster.get(api_version, kind, name, namespace)
+        except kube.KindNotServed:
+            obj = None
+        with self._lock:
+            self.objects[self._key(api_version, kind, name, namespace)] = obj
+        return obj
+
+    def collect(self, refs, extra=None, workers=8):
+        # the server version, the namespaces and every ref (apiVersion, kind, name, namespace) at once;
+        # extra maps names to functions of the cluster whose results are kept as well
+        def version():
+            self.server_version = self.cluster.server_version()
+
+        def namespaces():
+            self.namespaces = set(x["metadata"]["name"] for x in self.cluster.list("v1", "Namespace"))
+
+        def keep(name, func):
+            self.extra[name] = func(self.cluster)
+
+        def get_many(refs):
+            objects = self.cluster.get_many(refs)
+            with self._lock:
+                self.objects.update((self._key(*x), obj) for x, obj in objects.items())
+
+        refs = sorted(set(refs), key=str)
+        jobs = [version, namespaces]
+        if hasattr(self.cluster, "get_many"):
+            # a kubectl process per namespace rather than per object
+            groups = dict()
+            for x in refs:
+                groups.setdefault(x[3], []).append(x)
+            jobs += [lambda x=x: get_many(x) for x in groups.values()]
+        else:
+            jobs += [lambda x=x: self._get(*x) for x in refs]
+        jobs += [lambda x=x, f=f: keep(x, f) for x, f in (extra or {}).items()]
+        with ThreadPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+            for future in [pool.submit(x) for x in jobs]:
+                future.result()
+        logger.info("Snapshot of %s objects and %s namespaces, server %s" % (len(refs), len(self.namespaces), self.server_version))
+        return self
+
+    def get(self, api_version, kind, name, namespace=None):
+        key = self._key(api_version, kind, name, namespace)
+        with self._lock:
+            if key in self.objects:
+                return self.objects[key]
+        # not part of the snapshot
+        return self._get(api_version, kind, name, namespace)
+
+    def exists(self, api_version, kind, name, namespace=None):
+        return self.get(api_version, kind, name, namespace) is not None
+
+    def available(self, name, namespace):
+        # the deployment is rolled out, same as kubectl rollout status
+        deployment = self.get("apps/v1", "Deployment", name, namespace)
+        return deployment is not None and readiness.DeploymentAvailable(name, namespace).check({name: deployment})
+
+    def satisfied(self, docs):
+        # every document of a bundle is applied with the same content
+        for doc in docs:
+            live = self.get(doc["apiVersion"], doc["kind"], doc["metadata"]["name"], doc["metadata"].get("namespace"))
+            if live is None or not contains(live, kube.strip_object(doc)):
+                return False
+        return True
+
+def doc_refs(docs):
+    return [(x["apiVersion"], x["kind"], x["metadata"]["name"], x["metadata"].get("namespace")) for x in docs]
+
+__all__ = ["Snapshot", "contains", "doc_refs"]
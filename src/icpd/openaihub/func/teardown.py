@@ -0,0 +1,87 @@
+# Copyright 2019 IBM Corporation 
+# 
+# Licensed under the Apache License, Version 2.0 (the "License"); 
+# you may not use this file except in compliance with the License. 
+# You may obtain a copy of the License at 
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0 
+# 
+# Unless required by applicable law or agreed to in writing, software 
+# distributed under the License is distributed on an "AS IS" BASIS, 
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. 
+# See the License for the specific language governing permissions and 
+# limitations under the License. 
+from __future__ import print_function
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from openaihub.func import dag
+from openaihub.func import kube
+from openaihub.func import readiness
+from openaihub.func import trace
+
+logger = logging.getLogger(__name__)
+
+# the outcomes of a deletion
+DELETED = "deleted"
+TIMED_OUT = "timed out"
+NOT_SERVED = "not served"
+
+class Teardown:
+    # deletes the objects of a step concurrently and follows each with a watch until it is gone,
+    # that is until its finalizers are done; the time of every object is kept for the report
+    def __init__(self, cluster, timeout=600, workers=8):
+        self.cluster = cluster
+        self.timeout = timeout
+        self.workers = workers
+        # (step, ref, seconds, outcome) in the order the objects were gone
+        self.results = []
+        self._lock = threading.Lock()
+
+    def _delete(self, step, ref):
+        api_version, kind, name, namespace = ref
+        start = time.time()
+        with trace.span("delete %s %s" % (kind, name), "delete") as span:
+            try:
+                self.cluster.delete(api_version, kind, name, namespace)
+                waiter = readiness.Waiter(readiness.ObjectGone(api_version, kind, name, namespace))
+                outcome = DELETED if waiter.wait(self.timeout) else TIMED_OUT
+            except kube.KindNotServed:
+                # its CRD is gone, and the object with it
+                outcome = NOT_SERVED
+            except kube.ClusterError as e:
+                outcome = "failed: %s" % e
+            span.args["returncode"] = 0 if outcome in (DELETED, NOT_SERVED) else 1
+        seconds = time.time() - start
+        logger.info("%s %s %s in %.1fs" % (kind, name, outcome, seconds))
+        with self._lock:
+            self.results.append((step, ref, seconds, outcome))
+        return outcome
+
+    def delete(self, step, refs):
+        # raises ClusterError naming every object that is not gone
+        refs = list(refs)
+        if not refs:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(refs))) as pool:
+            outcomes = list(pool.map(lambda x: self._delete(step, x), refs))
+        failed = ["%s %s %s" % (x[1], x[2], outcome) for x, outcome in zip(refs, outcomes) if outcome not in (DELETED, NOT_SERVED)]
+        if failed:
+            raise kube.ClusterError("step %s: %s" % (step, "; ".join(failed)))
+        return refs
+
+def describe(ref):
+    # e.g. Jupyterlab kubeflow/jupyterlab-cr
+    api_version, kind, name, namespace = ref
+    return "%s %s%s" % (kind, "%s/" % namespace if namespace else "", name)
+
+def print_report(teardown, graph):
+    # the objects of each step in the order they were gone, with the time from delete to gone
+    print("Deleted %s objects:" % len([x for x in teardown.results if x[3] == DELETED]))
+    order = dict((x, i) for i, x in enumerate(graph.steps))
+    width = dag.name_width(graph)
+    for step, ref, seconds, outcome in sorted(teardown.results, key=lambda x: (order.get(x[0], 0), x[2])):
+        print("    %-*s  %-56s %8.1fs%s" % (width, step, describe(ref), seconds, "" if outcome == DELETED else ", %s" % outcome))
+
+__all__ = ["Teardown", "describe", "print_report"]
@@ -0,0 +1,138 @@
+# Copyright 2019 IBM Corporation 
+# 
+# Licensed under the Apache License, Version 2.0 (the "License"); 
+# you may not use this file except in compliance with the License. 
+# You may obtain a copy of the License at 
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0 
+# 
+# Unless required by applicable law or agreed to in writing, software 
+# distributed under the License is distributed on an "AS IS" BASIS, 
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. 
+# See the License for the specific language governing permissions and 
+# limitations under the License. 
+from __future__ import print_function
+import logging
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+class Span:
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+        self.thread = threading.current_thread().name
+        self.start = time.time()
+        self.end = None
+
+    @property
+    def duration(self):
+        return (self.end if self.end is not None else time.time()) - self.start
+
+class Tracer:
+    # spans of steps, commands, cluster calls and waits; only kept while a trace is exported
+    def __init__(self):
+        self.enabled = False
+        self.spans = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def reset(self, enabled):
+        with self._lock:
+            self.enabled = enabled
+            self.spans = []
+
+    def _close(self, span):
+        span.end = time.time()
+        if self.enabled:
+            with self._lock:
+                self.spans.append(span)
+
+    @contextmanager
+    def span(self, name, category, **args):
+        span = Span(name, category, args)
+        try:
+            yield span
+        except BaseException as e:
+            span.args["error"] = repr(e)
+            raise
+        finally:
+            self._close(span)
+
+    def step(self, name, **args):
+        # numbered steps run one after the other: a step lasts until the next one of the thread starts
+        self.end_step()
+        self._local.step = Span(name, "step", args)
+
+    def end_step(self):
+        span = getattr(self._local, "step", None)
+        if span is not None:
+            self._local.step = None
+            self._close(span)
+
+    def events(self):
+        # Chrome trace-event format: complete ("X") events in microseconds, one track per thread
+        with self._lock:
+            spans = list(self.spans)
+        if not spans:
+            return []
+        origin = min(x.start for x in spans)
+        threads = dict()
+        for x in spans:
+            threads.setdefault(x.thread, len(threads) + 1)
+        events = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": name}}
+                  for name, tid in threads.items()]
+        for x in sorted(spans, key=lambda x: x.start):
+            events.append({"name": x.name, "cat": x.category, "ph": "X", "pid": os.getpid(), "tid": threads[x.thread],
+                           "ts": int((x.start - origin) * 1e6), "dur": int(x.duration * 1e6),
+                           "args": dict((k, v if isinstance(v, (int, float, bool)) else str(v)) for k, v in x.args.items())})
+        return events
+
+    def write(self, path):
+        with open(path, "w") as f:
+            json.dump({"traceEvents": self.events(), "displayTimeUnit": "ms"}, f, indent=1)
+
+    def print_summary(self, limit=15):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda x: x.duration, reverse=True)[:limit]
+        print("Slowest spans:")
+        print("  %-10s %-56s %8s %6s %7s" % ("category", "name", "seconds", "rc", "retries"))
+        for x in spans:
+            name = x.name if len(x.name) <= 56 else x.name[:53] + "..."
+            print("  %-10s %-56s %8.1f %6s %7s" % (x.category, name, x.duration,
+                                                   x.args.get("returncode", ""), x.args.get("retries", "")))
+
+_tracer = Tracer()
+
+def span(name, category, **args):
+    return _tracer.span(name, category, **args)
+
+def step(name, **args):
+    _tracer.step(name, **args)
+
+def end_step():
+    _tracer.end_step()
+
+@contextmanager
+def export(path):
+    # record the spans of the enclosed run and write them to path, also when the run fails
+    _tracer.reset(bool(path))
+    try:
+        yield _tracer
+    finally:
+        _tracer.end_step()
+        if path:
+            try:
+                _tracer.write(path)
+                logger.info("Trace written to %s" % path)
+            except IOError as e:
+                logger.error("Error: unable to write the trace to %s: %s" % (path, e))
+            _tracer.print_summary()
+            _tracer.reset(False)
+
+__all__ = ["Tracer", "span", "step", "end_step", "export"]
@@ -26,6 +26,13 @@ setuptools.setup(
     long_description_content_type="text/markdown",
     url="https://github.ibm.com/OpenAIHub/OpenAIHub",
     packages=setuptools.find_packages(),
+    # openaihub/manifests links to the registry, patch and requirement directories of src
+    package_data={
+        'openaihub': ['manifests/*/*', 'manifests/*/*/*'],
+    },
+    exclude_package_data={
+        'openaihub': ['manifests/registry/Dockerfile', 'manifests/registry/build.sh'],
+    },
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",